@@ -0,0 +1,149 @@
+"""Stress :meth:`Updater.add_update_archive` with many adds at the same time,
+some of them with the same filename, and check the cache is consistent after.
+
+If pydbus is installed, also time how long AddUpdateArchiveAsync takes to
+return compared to AddUpdateArchive.
+
+Usage: python3 -m benchmarks.bench_add_update [archives] [threads] [size in MB]
+"""
+
+import sys
+import json
+import logging
+from os import urandom, listdir
+from os.path import basename
+from tempfile import mkdtemp
+from shutil import rmtree
+from threading import Thread, Event
+from time import perf_counter
+from oresat_linux_updater.updater import Updater
+
+ADDS_PER_ARCHIVE = 4
+"""Number of times each update archive is added, to race adds of the same
+filename.
+"""
+
+
+def _make_update_archives(count: int, size: int, src_dir: str) -> list:
+    """Make files with update archive filenames. The contents don't matter,
+    they are only copied.
+    """
+
+    data = urandom(size)
+    names = []
+    for i in range(count):
+        names.append(src_dir + "bench_update_{}.tar.xz".format(1611940000 + i))
+        with open(names[-1], "wb") as fptr:
+            fptr.write(data)
+
+    return names
+
+
+def _parallel_adds(updater: Updater, names: list, threads: int) -> float:
+    """Add every update archive ADDS_PER_ARCHIVE times from the threads."""
+
+    adds = names * ADDS_PER_ARCHIVE
+    workers = [Thread(target=lambda i=i: [updater.add_update_archive(j)
+                                          for j in adds[i::threads]])
+               for i in range(threads)]
+
+    start = perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return perf_counter() - start
+
+
+def _check_cache(updater: Updater, names: list, cache_dir: str):
+    cache = sorted([basename(i) for i in names])
+    assert updater.available_update_archives == len(names)
+    assert updater.list_updates == json.dumps(cache)
+    assert sorted([i for i in listdir(cache_dir)
+                   if not i.startswith(".")]) == cache
+
+
+def _async_latency(names: list, work_dir: str, cache_dir: str, log):
+    """Time the D-Bus method calls, without a bus."""
+
+    try:
+        from oresat_linux_updater.dbus_server import DBusServer
+    except ImportError:
+        print("pydbus is not installed, skipping AddUpdateArchiveAsync")
+        return
+
+    done = Event()
+    results = []
+
+    class BenchServer(DBusServer):
+        def UpdateArchiveAdded(self, job, ret):
+            results.append(ret)
+            if len(results) == len(names):
+                done.set()
+
+    server = BenchServer(work_dir, cache_dir, log)
+    server.run()
+
+    start = perf_counter()
+    for name in names:
+        server.AddUpdateArchive(name)
+    sync = (perf_counter() - start) / len(names)
+
+    start = perf_counter()
+    for name in names:
+        server.AddUpdateArchiveAsync(name)
+    queued = (perf_counter() - start) / len(names)
+    done.wait()
+    server.quit()
+
+    print("AddUpdateArchive:       {:.3f} ms per call".format(sync * 1e3))
+    print("AddUpdateArchiveAsync:  {:.3f} ms per call".format(queued * 1e3))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    size = int(float(sys.argv[3]) * 1e6) if len(sys.argv) > 3 else 4_000_000
+    src_dir = mkdtemp() + "/"
+    work_dir = mkdtemp() + "/"
+    cache_dir = mkdtemp() + "/"
+
+    log = logging.getLogger("bench")
+    log.addHandler(logging.NullHandler())
+    log.propagate = False
+
+    names = _make_update_archives(count, size, src_dir)
+    updater = Updater(work_dir, cache_dir, log)
+
+    elapsed = _parallel_adds(updater, names, 1)
+    _check_cache(updater, names, cache_dir)
+    adds = count * ADDS_PER_ARCHIVE
+    print("archives: {}, adds: {}, size: {:.1f} MB".format(count, adds,
+                                                           size / 1e6))
+    print("1 thread:    {:.3f} s ({:.1f} adds/s, {:.1f} MB/s)".format(
+        elapsed, adds / elapsed, adds * size / 1e6 / elapsed))
+
+    rmtree(cache_dir, ignore_errors=True)
+    updater = Updater(work_dir, cache_dir, log)
+
+    elapsed = _parallel_adds(updater, names, threads)
+    _check_cache(updater, names, cache_dir)
+    print("{} threads: {:.3f} s ({:.1f} adds/s, {:.1f} MB/s)".format(
+        threads, elapsed, adds / elapsed, adds * size / 1e6 / elapsed))
+    print("cache is consistent")
+    for method, stats in json.loads(updater.ingest_stats).items():
+        if stats["count"] != 0:
+            print("  {}: {} adds, {:.1f} MB in {:.3f} s".format(
+                method, stats["count"], stats["bytes"] / 1e6,
+                stats["seconds"]))
+
+    rmtree(cache_dir, ignore_errors=True)
+    _async_latency(names, work_dir, cache_dir, log)
+
+    rmtree(src_dir, ignore_errors=True)
+    rmtree(work_dir, ignore_errors=True)
+    rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Benchmark :class:`CacheIndex` holding thousands of cached update archives,
+compared to the sorted list of filenames the Updater used before.
+
+Usage: python3 -m benchmarks.bench_cache_index [number of archives]
+"""
+
+import sys
+import json
+import random
+from tempfile import mkdtemp
+from shutil import rmtree
+from time import perf_counter
+from oresat_linux_updater.cache_index import CacheIndex
+
+LISTINGS = 1000
+"""Number of times the listing is read between changes."""
+
+
+def _names(count: int) -> list:
+    """Make update archive filenames, added in a random order."""
+
+    rand = random.Random(0)
+    names = ["gps_update_{}.tar.xz".format(1611940000 + i * 60)
+             for i in range(count)]
+    rand.shuffle(names)
+    return names
+
+
+def _bench_list(names: list) -> dict:
+    times = {}
+    cache = []
+
+    start = perf_counter()
+    for name in names:
+        if name not in cache:
+            cache.append(name)
+            cache.sort()
+    times["add"] = perf_counter() - start
+
+    start = perf_counter()
+    for _ in range(LISTINGS):
+        json.dumps(cache)
+    times["listing"] = perf_counter() - start
+
+    start = perf_counter()
+    while len(cache) != 0:
+        cache.pop(0)
+    times["pop"] = perf_counter() - start
+
+    return times
+
+
+def _bench_index(names: list, cache_dir: str) -> dict:
+    times = {}
+    index = CacheIndex(cache_dir)
+
+    start = perf_counter()
+    for name in names:
+        index.add(name)
+    times["add"] = perf_counter() - start
+
+    start = perf_counter()
+    for _ in range(LISTINGS):
+        index.listing
+    times["listing"] = perf_counter() - start
+
+    start = perf_counter()
+    CacheIndex(cache_dir)
+    times["load"] = perf_counter() - start
+
+    start = perf_counter()
+    while len(index) != 0:
+        index.pop()
+    times["pop"] = perf_counter() - start
+
+    return times
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    cache_dir = mkdtemp()
+    names = _names(count)
+
+    old = _bench_list(names)
+    new = _bench_index(names, cache_dir)
+
+    print("archives: {}".format(count))
+    print("                     sorted list   CacheIndex")
+    print("add all:             {:9.3f} s  {:9.3f} s".format(old["add"],
+                                                             new["add"]))
+    print("{} listings:       {:9.3f} s  {:9.3f} s".format(
+        LISTINGS, old["listing"], new["listing"]))
+    print("pop all:             {:9.3f} s  {:9.3f} s".format(old["pop"],
+                                                             new["pop"]))
+    print("load from log:                    {:9.3f} s".format(new["load"]))
+
+    rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Benchmark the compression ratio and decode speed of all update archive
+codecs.
+
+Usage: python3 -m benchmarks.bench_codecs [file ...]
+"""
+
+import sys
+from os import remove
+from os.path import getsize, basename, realpath
+from tempfile import mkdtemp
+from shutil import rmtree
+from time import perf_counter
+from oresat_linux_updater.codec import CODECS
+from oresat_linux_updater.status_archive import DPKG_STATUS_FILE
+
+DEFAULT_FILES = [DPKG_STATUS_FILE, realpath(sys.executable)]
+"""Files to put in the archive if none are given. A text and a binary file."""
+
+DECODE_RUNS = 3
+"""Number of times each archive is decoded, the fastest run is reported."""
+
+
+def bench_codec(codec, files: list, work_dir: str) -> tuple:
+    """Compress files with a codec, then time decoding the archive.
+
+    Returns
+    -------
+    tuple
+        The compressed size, the compress time, and the best decode time.
+    """
+
+    archive = work_dir + "bench" + codec.extension
+
+    start = perf_counter()
+    with codec.open_tar(archive, "w") as tar:
+        for i in files:
+            tar.add(i, arcname=basename(i))
+    compress_time = perf_counter() - start
+
+    decode_time = None
+    for _ in range(DECODE_RUNS):
+        start = perf_counter()
+        with codec.open_tar(archive, "r|") as tar:
+            for member in tar:
+                fptr = tar.extractfile(member)
+                while fptr.read(1 << 20):
+                    pass
+        elapsed = perf_counter() - start
+        if decode_time is None or elapsed < decode_time:
+            decode_time = elapsed
+
+    size = getsize(archive)
+    remove(archive)
+    return size, compress_time, decode_time
+
+
+def main():
+    files = sys.argv[1:] if len(sys.argv) > 1 else DEFAULT_FILES
+    total = sum(getsize(i) for i in files)
+    work_dir = mkdtemp() + "/"
+
+    print("input: {} files, {:.2f} MB".format(len(files), total / 1e6))
+    print("{:<6} {:>12} {:>8} {:>12} {:>14}".format(
+        "codec", "size (B)", "ratio", "compress (s)", "decode (MB/s)"))
+
+    for codec in CODECS.values():
+        if not codec.available:
+            print("{:<6} not available".format(codec.name))
+            continue
+
+        size, compress_time, decode_time = bench_codec(codec, files, work_dir)
+        print("{:<6} {:>12} {:>8.2f} {:>12.2f} {:>14.1f}".format(
+            codec.name, size, total / size, compress_time,
+            total / 1e6 / decode_time))
+
+    rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
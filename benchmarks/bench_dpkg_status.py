@@ -0,0 +1,112 @@
+"""Benchmark indexing and querying a dpkg status file with
+:class:`DpkgStatus`, compared to parsing every field of every stanza.
+
+Usage: python3 -m benchmarks.bench_dpkg_status [number of packages]
+"""
+
+import sys
+import random
+from tempfile import mkdtemp
+from shutil import rmtree
+from time import perf_counter
+from oresat_linux_updater.dpkg_status import DpkgStatus
+
+RUNS = 5
+"""Number of times each parse is run, the fastest run is reported."""
+
+QUERIES = 100_000
+"""Number of is installed queries to time."""
+
+
+def _make_dpkg_status(packages: int) -> str:
+    """Make a dpkg status file with realistic stanzas."""
+
+    rand = random.Random(0)
+    stanzas = []
+    for i in range(packages):
+        description = "\n".join(" " + " ".join(rand.choices(
+            ["package", "library", "tool", "data", "the", "for", "a"], k=10))
+            for _ in range(rand.randint(1, 12)))
+        stanzas.append(
+            "Package: package-{}\n"
+            "Status: install ok installed\n"
+            "Priority: optional\n"
+            "Section: libs\n"
+            "Installed-Size: {}\n"
+            "Maintainer: Debian Developers <debian@lists.debian.org>\n"
+            "Architecture: {}\n"
+            "Multi-Arch: same\n"
+            "Version: {}.{}-{}\n"
+            "Depends: libc6 (>= 2.28), package-{} (= 1.0)\n"
+            "Description: package number {}\n{}\n".format(
+                i, rand.randint(10, 10000), rand.choice(["armhf", "all"]),
+                rand.randint(0, 9), rand.randint(0, 99), rand.randint(1, 5),
+                rand.randrange(packages), i, description))
+
+    return "\n".join(stanzas)
+
+
+def _parse_all_fields(path: str) -> dict:
+    """Parse every field of every stanza into a dict per package."""
+
+    packages = {}
+    with open(path, "r") as fptr:
+        for stanza in fptr.read().split("\n\n"):
+            fields = {}
+            key = None
+            for line in stanza.split("\n"):
+                if line.startswith(" ") and key is not None:
+                    fields[key] += "\n" + line
+                elif ":" in line:
+                    key, value = line.split(":", 1)
+                    fields[key] = value.strip()
+            if "Package" in fields:
+                packages[fields["Package"]] = fields
+    return packages
+
+
+def _best_time(func) -> tuple:
+    best = None
+    for _ in range(RUNS):
+        start = perf_counter()
+        ret = func()
+        elapsed = perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, ret
+
+
+def main():
+    packages = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    work_dir = mkdtemp() + "/"
+    path = work_dir + "status"
+
+    content = _make_dpkg_status(packages)
+    with open(path, "w") as fptr:
+        fptr.write(content)
+
+    all_time, all_fields = _best_time(lambda: _parse_all_fields(path))
+    index_time, index = _best_time(lambda: DpkgStatus.from_file(path))
+    assert len(index) == len(all_fields) == packages
+
+    names = ["package-{}".format(i) for i in random.Random(1).choices(
+        range(packages * 2), k=QUERIES)]  # half are not installed
+    versions = [index.get(i).version if i in index else "1.0" for i in names]
+    start = perf_counter()
+    for name, version in zip(names, versions):
+        index.is_installed(name, version)
+    query_time = perf_counter() - start
+
+    print("packages: {}, file size: {:.1f} KB".format(
+        packages, len(content) / 1e3))
+    print("parse all fields: {:.2f} ms".format(all_time * 1e3))
+    print("DpkgStatus index: {:.2f} ms ({:.1f}x)".format(
+        index_time * 1e3, all_time / index_time))
+    print("is_installed:     {:.2f} us per query".format(
+        query_time / QUERIES * 1e6))
+
+    rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
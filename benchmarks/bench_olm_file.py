@@ -0,0 +1,121 @@
+"""Benchmark parsing, sorting, and scanning a directory of OLM filenames,
+compared to the three splits and date only comparisons OLMFile used before.
+
+Usage: python3 -m benchmarks.bench_olm_file [number of filenames]
+"""
+
+import sys
+import random
+from os import listdir
+from os.path import basename
+from pathlib import Path
+from tempfile import mkdtemp
+from shutil import rmtree
+from time import perf_counter
+from operator import attrgetter
+from oresat_linux_updater.olm_file import OLMFile, scan_dir
+
+BOARDS = ["gps", "star-tracker", "dxwifi", "cfc", "c3"]
+KEYWORDS = ["update", "olu-status", "dpkg-status"]
+
+
+class _OldOLMFile():
+    """How OLMFile loaded and compared filenames before."""
+
+    def __init__(self, load: str):
+        self._name = basename(load)
+        self._board = self._name.split("_")[0]
+        self._keyword = self._name.split("_")[1]
+        temp = self._name.split("_")[2]
+        self._date = int(temp.split(".")[0])
+        self._extension = temp[temp.find("."):]
+
+    def __lt__(self, archive_file2):
+        return archive_file2._date < self._date
+
+    def __gt__(self, archive_file2):
+        return archive_file2._date > self._date
+
+
+def _names(count: int) -> list:
+    """Make OLM filenames, in a random order."""
+
+    rand = random.Random(0)
+    names = ["{}_{}_{}.tar.xz".format(rand.choice(BOARDS),
+                                      rand.choice(KEYWORDS),
+                                      1611940000 + i * 60)
+             for i in range(count)]
+    rand.shuffle(names)
+    return names
+
+
+def _bench_old(names: list, tmp_dir: str) -> dict:
+    times = {}
+
+    start = perf_counter()
+    files = [_OldOLMFile(load=i) for i in names]
+    times["parse"] = perf_counter() - start
+
+    start = perf_counter()
+    sorted(files)
+    times["sort"] = perf_counter() - start
+
+    # how the update maker found the status archives for a board
+    start = perf_counter()
+    files = [_OldOLMFile(load=i) for i in listdir(tmp_dir)]
+    files.sort()
+    [i for i in files if i._board == "gps"]
+    times["scan"] = perf_counter() - start
+
+    return times
+
+
+def _bench_new(names: list, tmp_dir: str) -> dict:
+    times = {}
+
+    start = perf_counter()
+    files = [OLMFile(load=i) for i in names]
+    times["parse"] = perf_counter() - start
+
+    start = perf_counter()
+    sorted(files)
+    times["sort"] = perf_counter() - start
+
+    start = perf_counter()
+    sorted(files, key=attrgetter("_key"), reverse=True)
+    times["sort_key"] = perf_counter() - start
+
+    start = perf_counter()
+    scan_dir(tmp_dir, board="gps")
+    times["scan"] = perf_counter() - start
+
+    return times
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    names = _names(count)
+
+    tmp_dir = mkdtemp()
+    for name in names:
+        Path(tmp_dir + "/" + name).touch()
+
+    old = _bench_old(names, tmp_dir)
+    new = _bench_new(names, tmp_dir)
+
+    print("filenames: {}".format(count))
+    print("                     old OLMFile   OLMFile")
+    print("parse:               {:9.3f} s  {:9.3f} s".format(old["parse"],
+                                                             new["parse"]))
+    print("sort:                {:9.3f} s  {:9.3f} s".format(old["sort"],
+                                                             new["sort"]))
+    print("sort by key:                      {:9.3f} s".format(
+        new["sort_key"]))
+    print("scan dir for board:  {:9.3f} s  {:9.3f} s".format(old["scan"],
+                                                             new["scan"]))
+
+    rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Benchmark the pre-flight check of a update's deb files with
+:func:`check_plan`, with one thread and with the default thread pool.
+
+Usage: python3 -m benchmarks.bench_preflight [number of packages]
+"""
+
+import sys
+import random
+import tarfile
+from io import BytesIO
+from tempfile import mkdtemp
+from shutil import rmtree
+from time import perf_counter
+from oresat_linux_updater.instruction import Instruction, InstructionType
+from oresat_linux_updater.dpkg_status import DpkgStatus, DPKG_STATUS_FILE
+from oresat_linux_updater.preflight import check_plan, dpkg_architectures, \
+        PREFLIGHT_THREADS
+
+RUNS = 5
+"""Number of times each check is run, the fastest run is reported."""
+
+DATA_SIZE = 256 * 1024
+"""Size of the random data.tar in each deb file."""
+
+
+def _tar_gz(name: str, data: bytes) -> bytes:
+    out = BytesIO()
+    with tarfile.open(fileobj=out, mode="w:gz") as tar:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        tar.addfile(info, BytesIO(data))
+    return out.getvalue()
+
+
+def _ar_member(name: str, data: bytes) -> bytes:
+    header = "{:<16}{:<12}{:<6}{:<6}{:<8}{:<10}`\n".format(
+        name, 0, 0, 0, 100644, len(data)).encode("ascii")
+    return header + data + (b"\n" if len(data) % 2 else b"")
+
+
+def _make_deb(path: str, index: int, rand: random.Random):
+    """Make a deb file that depends on the package before it."""
+
+    control = ("Package: bench-package{}\n"
+               "Version: 1.0.{}-1\n"
+               "Architecture: all\n"
+               "Maintainer: name <email>\n"
+               "Depends: dpkg, bench-package{} (>= 1.0)\n"
+               "Description: a benchmark package\n"
+               " with a long description\n").format(index, index,
+                                                    max(index - 1, 0))
+    data = rand.getrandbits(DATA_SIZE * 8).to_bytes(DATA_SIZE, "little")
+
+    with open(path, "wb") as fptr:
+        fptr.write(b"!<arch>\n")
+        fptr.write(_ar_member("debian-binary", b"2.0\n"))
+        fptr.write(_ar_member("control.tar.gz",
+                              _tar_gz("./control", control.encode())))
+        fptr.write(_ar_member("data.tar.gz", _tar_gz("./data", data)))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    deb_dir = mkdtemp()
+    rand = random.Random(0)
+
+    debs = []
+    for i in range(count):
+        debs.append("{}/bench-package{}_1.0.{}-1_all.deb".format(deb_dir, i,
+                                                                 i))
+        _make_deb(debs[-1], i, rand)
+    inst_list = [Instruction(InstructionType.DPKG_INSTALL, debs)]
+
+    start = perf_counter()
+    dpkg_status = DpkgStatus.from_file(DPKG_STATUS_FILE)
+    archs = dpkg_architectures()
+    load = perf_counter() - start
+
+    times = {}
+    for threads in [1, PREFLIGHT_THREADS]:
+        best = None
+        for _ in range(RUNS):
+            start = perf_counter()
+            check_plan(inst_list, dpkg_status, archs, threads)
+            elapsed = perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        times[threads] = best
+
+    print("deb files: {}".format(count))
+    print("load dpkg status:  {:9.3f} s".format(load))
+    for threads in times:
+        print("check, {} threads: {:9.3f} s".format(threads, times[threads]))
+
+    rmtree(deb_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Benchmark the cost of verifying update archive members against the
+manifest while extracting, compared to extracting without verifying.
+
+Usage: python3 -m benchmarks.bench_verify [size in MB] [codec]
+"""
+
+import sys
+from os import urandom
+from tempfile import mkdtemp
+from shutil import rmtree
+from time import perf_counter
+from oresat_linux_updater.codec import open_archive
+from oresat_linux_updater.instruction import Instruction, InstructionType
+from oresat_linux_updater.update_archive import create_update_archive, \
+        extract_update_archive, _extract_member
+
+RUNS = 3
+"""Number of times each extraction is run, the fastest run is reported."""
+
+
+def _make_update_archive(size: int, src_dir: str, codec: str) -> str:
+    """Make a update archive with a support file of the size, half random
+    (incompressible) and half zeros.
+    """
+
+    path = src_dir + "support_file"
+    with open(path, "wb") as fptr:
+        fptr.write(urandom(size // 2))
+        fptr.write(bytes(size - size // 2))
+
+    inst_list = [Instruction(InstructionType.SUPPORT_FILE, [path])]
+    return create_update_archive("bench", inst_list, src_dir, codec=codec)
+
+
+def _best_time(func) -> float:
+    best = None
+    for _ in range(RUNS):
+        start = perf_counter()
+        func()
+        elapsed = perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    size = int(float(sys.argv[1]) * 1e6) if len(sys.argv) > 1 else 64_000_000
+    codec = sys.argv[2] if len(sys.argv) > 2 else "xz"
+    src_dir = mkdtemp() + "/"
+    work_dir = mkdtemp() + "/"
+
+    update = _make_update_archive(size, src_dir, codec)
+
+    def extract_only():
+        with open_archive(update, "r|") as tar:
+            for member in tar:
+                _extract_member(tar, member, work_dir)
+
+    def extract_verify():
+        extract_update_archive(update, work_dir)
+
+    plain = _best_time(extract_only)
+    verify = _best_time(extract_verify)
+
+    print("member size: {:.1f} MB, codec: {}".format(size / 1e6, codec))
+    print("extract:          {:.3f} s ({:.1f} MB/s)".format(
+        plain, size / 1e6 / plain))
+    print("extract + verify: {:.3f} s ({:.1f} MB/s)".format(
+        verify, size / 1e6 / verify))
+    print("overhead:         {:+.1f}%".format((verify / plain - 1) * 100))
+
+    rmtree(src_dir, ignore_errors=True)
+    rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
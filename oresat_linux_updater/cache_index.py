@@ -0,0 +1,273 @@
+"""
+Cache Index
+===========
+
+The index of the update archives in the update archive cache, ordered by the
+date in their OLM filename (oldest first), as that is the order they must be
+run in. Update archives with the same date are ordered by filename.
+
+The index is a heap of (date, filename) pairs plus a dictionary of the
+filenames in it, so adding and popping the oldest update archive are
+O(log n) and counting and checking if a filename is in the index are O(1).
+Removed entries are left in the heap until they reach the top.
+
+Changes are appended to a log file in the cache directory, with the date of
+each added update archive, so the index is usually loaded from the log alone
+when the daemon starts; the cache directory is not listed and the filenames
+are not parsed again. The index is rebuilt from the cache directory (and the
+log rewritten) if the log is missing or invalid, e.g. a append was cut short
+by a power loss, or if the cache directory was modified after the log was last
+written, e.g. a file was copied into or deleted from it by anything else. The
+index always changes the cache directory before it logs the change, so that
+only needs a stat of both.
+
+Changes made to the cache directory in the same filesystem timestamp tick as
+the last log write are not seen, so a file in the index can still be
+missing; users of the index must handle that.
+
+**Example log file**::
+
+    + 1612392143 gps_update_1612392143.tar.xz
+    + 1612392200 gps_update_1612392200.tar.xz
+    - gps_update_1612392143.tar.xz
+"""
+
+import heapq
+import json
+from os import listdir, replace, stat, utime
+from os.path import basename, join
+from oresat_linux_updater.olm_file import OLMFile
+
+INDEX_FILE = ".index"
+"""The filename of the log file in the cache directory."""
+
+
+class CacheIndex():
+    """The update archives in the cache, oldest first. Not thread safe."""
+
+    def __init__(self, cache_dir: str):
+        """
+        Parameters
+        ----------
+        cache_dir: str
+            Path to the update archive cache directory. Hidden files in it are
+            ignored.
+        """
+
+        self._path = join(cache_dir, INDEX_FILE)
+        self._heap = []
+        self._entries = {}  # filename: (date, filename, entry id)
+        self._next_id = 0
+        self._listing = None
+        self._log_lines = 0
+
+        dates = self._read_log()
+        if dates is not None and not self._modified(cache_dir):
+            for name, date in dates.items():
+                self._insert(name, date)
+        else:  # rebuild from the cache directory and rewrite the log
+            dates = dates or {}
+            for name in listdir(cache_dir):
+                if not name.startswith("."):
+                    self._insert(name, dates.get(name))
+            self._log_lines = len(self._entries) * 2 + 1
+        heapq.heapify(self._heap)
+
+        if self._log_lines > len(self._entries) * 2:
+            self._compact()
+
+    def _modified(self, cache_dir: str) -> bool:
+        """Check if the cache directory was modified after the log file was
+        last written.
+        """
+
+        try:
+            return stat(cache_dir).st_mtime_ns > stat(self._path).st_mtime_ns
+        except OSError:
+            return True
+
+    def _read_log(self) -> dict:
+        """Get the filenames and dates in the log file.
+
+        Returns
+        -------
+        dict
+            The dates by filename or None if the log is missing or invalid.
+        """
+
+        dates = {}
+
+        try:
+            with open(self._path, "r") as fptr:
+                for line in fptr:
+                    self._log_lines += 1
+                    if not line.endswith("\n"):
+                        return None  # append was cut short
+                    if line.startswith("+ "):
+                        date, _, name = line[2:-1].partition(" ")
+                        dates[name] = int(date)
+                    elif line.startswith("- "):
+                        dates.pop(line[2:-1], None)
+                    else:
+                        return None
+        except (OSError, UnicodeDecodeError, ValueError):
+            return None
+
+        return dates
+
+    def _append_log(self, line: str):
+        with open(self._path, "a") as fptr:
+            fptr.write(line + "\n")
+        self._log_lines += 1
+
+    def _compact(self):
+        """Rewrite the log file with only the filenames in the index."""
+
+        with open(self._path + ".tmp", "w") as fptr:
+            for date, name, _ in sorted(self._entries.values()):
+                fptr.write("+ {} {}\n".format(date, name))
+        replace(self._path + ".tmp", self._path)
+        utime(self._path)  # not older than the rename
+        self._log_lines = len(self._entries)
+
+    def _insert(self, name: str, date=None) -> bool:
+        """Add a filename to the dictionary and the heap (not in heap order).
+        If the date is not given, it is parsed from the filename and files
+        that don't follow the OLM filename standards are ignored.
+        """
+
+        if date is None:
+            try:
+                date = OLMFile(load=name).date
+            except Exception:
+                return False
+
+        entry = (date, name, self._next_id)
+        self._next_id += 1
+        self._entries[name] = entry
+        self._heap.append(entry)
+        self._listing = None
+        return True
+
+    def _pop_removed(self):
+        """Pop the removed entries off the top of the heap."""
+
+        while len(self._heap) != 0 and \
+                self._entries.get(self._heap[0][1]) != self._heap[0]:
+            heapq.heappop(self._heap)
+
+    def add(self, name: str) -> bool:
+        """Add a update archive to the index.
+
+        Parameters
+        ----------
+        name: str
+            The filename of the update archive.
+
+        Returns
+        -------
+        bool
+            True if it was added or False if it was already in the index or
+            does not follow the OLM filename standards.
+        """
+
+        name = basename(name)
+        if name in self._entries or not self._insert(name):
+            return False
+
+        # _insert() appended it, move it into heap order
+        heapq.heappush(self._heap, self._heap.pop())
+        self._append_log("+ {} {}".format(self._entries[name][0], name))
+        return True
+
+    def remove(self, name: str) -> bool:
+        """Remove a update archive from the index.
+
+        Parameters
+        ----------
+        name: str
+            The filename of the update archive.
+
+        Returns
+        -------
+        bool
+            True if it was removed or False if it was not in the index.
+        """
+
+        if self._entries.pop(basename(name), None) is None:
+            return False
+
+        self._listing = None
+        self._append_log("- " + basename(name))
+        self._pop_removed()
+
+        if len(self._heap) > len(self._entries) * 2 + 16:
+            self._heap = list(self._entries.values())
+            heapq.heapify(self._heap)
+
+        return True
+
+    def oldest(self) -> str:
+        """Get the oldest update archive, without removing it.
+
+        Returns
+        -------
+        str
+            The filename of the oldest update archive or None if the index is
+            empty.
+        """
+
+        self._pop_removed()
+        return self._heap[0][1] if len(self._heap) != 0 else None
+
+    def pop(self) -> str:
+        """Remove the oldest update archive from the index.
+
+        Returns
+        -------
+        str
+            The filename of the oldest update archive or None if the index is
+            empty.
+        """
+
+        name = self.oldest()
+        if name is not None:
+            self.remove(name)
+
+        return name
+
+    def clear(self):
+        """Remove all update archives from the index."""
+
+        self._heap = []
+        self._entries = {}
+        self._listing = None
+        self._compact()
+
+    def names(self) -> list:
+        """Get all filenames in the index.
+
+        Returns
+        -------
+        list
+            The filenames, oldest first.
+        """
+
+        return [i[1] for i in sorted(self._entries.values())]
+
+    @property
+    def listing(self) -> str:
+        """str: The JSON list of filenames, oldest first. Only remade after
+        the index changes.
+        """
+
+        if self._listing is None:
+            self._listing = json.dumps(self.names())
+
+        return self._listing
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, name: str) -> bool:
+        return basename(name) in self._entries
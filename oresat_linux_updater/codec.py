@@ -0,0 +1,340 @@
+"""Compression codecs for update archives and status archives.
+
+All codecs are a tar file compressed (or not) with a different compressor. The
+codec is picked by the file extension when making a archive and is detected
+from magic bytes (falling back to the file extension) when opening one.
+
++-------+-------------+---------------------------------------------------+
+| Name  | Extension   | Notes                                             |
++=======+=============+===================================================+
+| xz    | .tar.xz     | Best ratio, slowest to decompress. The default.   |
++-------+-------------+---------------------------------------------------+
+| zstd  | .tar.zst    | Good ratio, fast to decompress. Requires the      |
+|       |             | optional zstandard module.                        |
++-------+-------------+---------------------------------------------------+
+| gz    | .tar.gz     | Worse ratio, fast to decompress.                  |
++-------+-------------+---------------------------------------------------+
+| none  | .tar        | No compression.                                   |
++-------+-------------+---------------------------------------------------+
+"""
+
+import tarfile
+from oresat_linux_updater.parallel_xz import ParallelXZWriter
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DEFAULT_CODEC = "xz"
+"""The codec used when one is not given."""
+
+TAR_MAGIC_OFFSET = 257
+"""Offset of the ustar magic in the first tar header."""
+
+HEADER_SIZE = 512
+"""Number of bytes to read to detect the codec of a archive."""
+
+
+class CodecError(Exception):
+    """Unknown or unavailable compression codec."""
+
+
+class _ClosingTarFile(tarfile.TarFile):
+    """A TarFile that also closes the decompression/compression streams it
+    was opened on.
+    """
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            for i in getattr(self, "_streams", []):
+                i.close()
+
+
+class Codec():
+    """A compression codec built into Python's tarfile module."""
+
+    def __init__(self, name: str, extension: str, tar_comp: str,
+                 magic: bytes, magic_offset=0):
+        """
+        Parameters
+        ----------
+        name: str
+            The name of the codec.
+        extension: str
+            The file extension for archives using the codec.
+        tar_comp: str
+            The compression method for tarfile.open() mode strings.
+        magic: bytes
+            The magic bytes the compressed file starts with.
+        magic_offset: int
+            The offset of the magic bytes in the file.
+        """
+
+        self._name = name
+        self._extension = extension
+        self._tar_comp = tar_comp
+        self._magic = magic
+        self._magic_offset = magic_offset
+
+    def __repr__(self):
+        return "{} {}".format(self.__class__.__name__, self._name)
+
+    def matches(self, header: bytes) -> bool:
+        """Check if the start of a file has the magic bytes of the codec.
+
+        Parameters
+        ----------
+        header: bytes
+            The first :data:`HEADER_SIZE` bytes of the file.
+
+        Returns
+        -------
+        bool
+            True if the header matches the codec.
+        """
+
+        end = self._magic_offset + len(self._magic)
+        return header[self._magic_offset:end] == self._magic
+
+    def open_tar(self, path: str, mode="r", jobs=1) -> tarfile.TarFile:
+        """Open a tar file with the codec.
+
+        Parameters
+        ----------
+        path: str
+            Path to the archive.
+        mode: str
+            "r" to read with random access, "r|" to read as a stream (members
+            must be read in order), "w" to write.
+        jobs: int
+            Number of processes to compress with when writing. Ignored by
+            codecs that can't compress in parallel.
+
+        Raises
+        ------
+        CodecError
+            Invalid mode.
+        tarfile.TarError
+            Invalid archive.
+
+        Returns
+        -------
+        tarfile.TarFile
+            The opened tar file.
+        """
+
+        if mode not in ["r", "r|", "w"]:
+            raise CodecError("invalid mode {}".format(mode))
+
+        if mode == "r|":
+            return tarfile.open(path, "r|" + self._tar_comp)
+        return tarfile.open(path, mode + ":" + self._tar_comp)
+
+    @property
+    def name(self) -> str:
+        """str: The name of the codec."""
+        return self._name
+
+    @property
+    def extension(self) -> str:
+        """str: The file extension for archives using the codec."""
+        return self._extension
+
+    @property
+    def available(self) -> bool:
+        """bool: Flag if the codec can be used."""
+        return True
+
+
+class XZCodec(Codec):
+    """The xz codec. Can compress with multiple processes, see
+    :mod:`oresat_linux_updater.parallel_xz`.
+    """
+
+    def __init__(self):
+        super().__init__("xz", ".tar.xz", "xz", b"\xfd7zXZ\x00")
+
+    def open_tar(self, path: str, mode="r", jobs=1) -> tarfile.TarFile:
+        if mode != "w" or jobs == 1:
+            return super().open_tar(path, mode)
+
+        stream = ParallelXZWriter(path, jobs)
+        tar = _ClosingTarFile.open(fileobj=stream, mode="w|")
+        tar._streams = [stream]
+        return tar
+
+
+class ZstdCodec(Codec):
+    """The zstd codec. Requires the optional zstandard module. Archives are
+    always read as a stream.
+    """
+
+    def __init__(self, level=19):
+        """
+        Parameters
+        ----------
+        level: int
+            The zstd compression level.
+        """
+
+        super().__init__("zstd", ".tar.zst", "", b"\x28\xb5\x2f\xfd")
+        self._level = level
+
+    def open_tar(self, path: str, mode="r", jobs=1) -> tarfile.TarFile:
+        if mode not in ["r", "r|", "w"]:
+            raise CodecError("invalid mode {}".format(mode))
+        if not self.available:
+            raise CodecError("zstd requires the zstandard module")
+
+        if mode == "w":
+            fptr = open(path, "wb")
+            try:
+                stream = zstandard.ZstdCompressor(level=self._level) \
+                    .stream_writer(fptr)
+                tar = _ClosingTarFile.open(fileobj=stream, mode="w|")
+            except Exception:
+                fptr.close()
+                raise
+        else:
+            fptr = open(path, "rb")
+            stream = zstandard.ZstdDecompressor().stream_reader(fptr)
+            try:
+                tar = _ClosingTarFile.open(fileobj=stream, mode="r|")
+            except (tarfile.TarError, zstandard.ZstdError):
+                stream.close()
+                fptr.close()
+                raise tarfile.ReadError("invalid zstd archive")
+
+        tar._streams = [stream, fptr]
+        return tar
+
+    @property
+    def available(self) -> bool:
+        return zstandard is not None
+
+
+CODECS = {
+    "xz": XZCodec(),
+    "zstd": ZstdCodec(),
+    "gz": Codec("gz", ".tar.gz", "gz", b"\x1f\x8b"),
+    "none": Codec("none", ".tar", "", b"ustar", TAR_MAGIC_OFFSET),
+}
+"""All codecs by name."""
+
+
+ARCHIVE_ERRORS = (tarfile.TarError, CodecError, EOFError) + \
+    ((zstandard.ZstdError,) if zstandard is not None else ())
+"""All exceptions that can be raised while reading a invalid archive."""
+
+
+def get_codec(name: str) -> Codec:
+    """Get a codec by name.
+
+    Parameters
+    ----------
+    name: str
+        The name of the codec.
+
+    Raises
+    ------
+    CodecError
+        Unknown codec.
+
+    Returns
+    -------
+    Codec
+        The codec.
+    """
+
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise CodecError("unknown codec {}".format(name))
+
+
+def codec_from_extension(extension: str) -> Codec:
+    """Get the codec for a file extension (e.g. the
+    :attr:`OLMFile.extension`).
+
+    Parameters
+    ----------
+    extension: str
+        The file extension.
+
+    Returns
+    -------
+    Codec
+        The codec or None if no codec uses the extension.
+    """
+
+    for codec in CODECS.values():
+        if codec.extension == extension:
+            return codec
+
+    return None
+
+
+def detect_codec(path: str) -> Codec:
+    """Detect the codec of a archive from its magic bytes, falling back to
+    its file extension.
+
+    Parameters
+    ----------
+    path: str
+        Path to the archive.
+
+    Raises
+    ------
+    CodecError
+        The codec could not be detected.
+
+    Returns
+    -------
+    Codec
+        The codec.
+    """
+
+    try:
+        with open(path, "rb") as fptr:
+            header = fptr.read(HEADER_SIZE)
+    except OSError:
+        header = b""
+
+    for codec in CODECS.values():
+        if codec.matches(header):
+            return codec
+
+    for codec in CODECS.values():
+        if path.endswith(codec.extension):
+            return codec
+
+    raise CodecError("unknown codec for {}".format(path))
+
+
+def open_archive(path: str, mode="r") -> tarfile.TarFile:
+    """Open a update or status archive with the detected codec.
+
+    Parameters
+    ----------
+    path: str
+        Path to the archive.
+    mode: str
+        "r" to read with random access or "r|" to read as a stream.
+
+    Raises
+    ------
+    CodecError
+        The codec could not be detected or is not available.
+    tarfile.TarError
+        Invalid archive.
+
+    Returns
+    -------
+    tarfile.TarFile
+        The opened tar file.
+    """
+
+    return detect_codec(path).open_tar(path, mode)
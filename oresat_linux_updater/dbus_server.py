@@ -1,11 +1,14 @@
 """OreSat Linux updater D-Bus server"""
 
+from os import close
 from logging import Logger
-from time import sleep
 from enum import IntEnum, auto
-from threading import Thread, Lock
+from collections import deque
+from threading import Thread, Condition
 from pydbus.generic import signal
-from oresat_linux_updater.status_archive import make_status_archive
+from gi.repository import GLib
+from oresat_linux_updater.status_archive import StatusArchiveCache, \
+        acknowledge_status_archive, reset_status_snapshot
 from oresat_linux_updater.updater import Updater, Result
 
 
@@ -22,7 +25,7 @@ class State(IntEnum):
     """Updating."""
 
     UPDATE_FAILED = auto()
-    """Update failed, cache was cleared"""
+    """Update failed, update archives that required it were deleted"""
 
     STATUS_FILE = auto()
     """Making the status tar file."""
@@ -43,28 +46,88 @@ class DBusServer():
                 <arg type='s' name='update_archive' direction='in'/>
                 <arg type='b' name='output' direction='out'/>
             </method>
+            <method name='AddUpdateArchiveFd'>
+                <arg type='s' name='filename' direction='in'/>
+                <arg type='h' name='fd_index' direction='in'/>
+                <arg type='b' name='output' direction='out'/>
+            </method>
+            <method name='BeginUpdateArchiveUpload'>
+                <arg type='s' name='filename' direction='in'/>
+                <arg type='t' name='size' direction='in'/>
+                <arg type='s' name='sha256' direction='in'/>
+                <arg type='u' name='part_size' direction='in'/>
+                <arg type='b' name='output' direction='out'/>
+            </method>
+            <method name='AddUpdateArchivePart'>
+                <arg type='s' name='filename' direction='in'/>
+                <arg type='u' name='index' direction='in'/>
+                <arg type='ay' name='data' direction='in'/>
+                <arg type='u' name='crc32' direction='in'/>
+                <arg type='b' name='output' direction='out'/>
+            </method>
+            <method name='MissingUpdateArchiveParts'>
+                <arg type='s' name='filename' direction='in'/>
+                <arg type='au' name='parts' direction='out'/>
+            </method>
+            <method name='CommitUpdateArchiveUpload'>
+                <arg type='s' name='filename' direction='in'/>
+                <arg type='b' name='output' direction='out'/>
+            </method>
+            <method name='CancelUpdateArchiveUpload'>
+                <arg type='s' name='filename' direction='in'/>
+                <arg type='b' name='output' direction='out'/>
+            </method>
+            <method name='AddUpdateArchiveAsync'>
+                <arg type='s' name='update_archive' direction='in'/>
+                <arg type='u' name='job' direction='out'/>
+            </method>
             <method name='Update'>
                 <arg type='b' name='output' direction='out'/>
             </method>
+            <method name='UpdateAll'>
+                <arg type='b' name='output' direction='out'/>
+            </method>
             <method name='MakeStatusArchive'>
                 <arg type='s' name='filepath' direction='out'/>
             </method>
+            <method name='MakeStatusArchiveAsync'>
+                <arg type='u' name='job' direction='out'/>
+            </method>
+            <method name='AcknowledgeStatusArchive'>
+                <arg type='s' name='filename' direction='in'/>
+                <arg type='b' name='output' direction='out'/>
+            </method>
+            <method name='ResetStatusSnapshot'/>
             <property name="StatusName" type="s" access="read" />
             <property name="StatusValue" type="y" access="read" />
             <property name="AvailableUpdateArchives" type="u" access="read" />
             <property name="ListUpdates" type="s" access="read" />
+            <property name="IngestStats" type="s" access="read" />
+            <property name="ListUploads" type="s" access="read" />
             <signal name="StatusArchive">
+                <arg type='u'/>
                 <arg type='s'/>
             </signal>
+            <signal name="UpdateArchiveAdded">
+                <arg type='u'/>
+                <arg type='b'/>
+            </signal>
             <signal name="UpdateResult">
                 <arg type='y'/>
             </signal>
+            <signal name="UpdateArchiveResult">
+                <arg type='s'/>
+                <arg type='y'/>
+            </signal>
         </interface>
         <interface name="org.OreSat.Updater.Update">
             <property name="UpdateArchive" type="s" access="read" />
-            <property name="TotalInstructions" type="y" access="read" />
-            <property name="InstructionIndex" type="y" access="read" />
+            <property name="TotalInstructions" type="u" access="read" />
+            <property name="InstructionIndex" type="u" access="read" />
             <property name="InstructionCommand" type="s" access="read" />
+            <property name="InstructionOutputBytes" type="t" access="read" />
+            <property name="InstructionOutputLines" type="u" access="read" />
+            <property name="SkippedPackages" type="u" access="read" />
         </interface>
     </node>
     """  # doesn't work in __init__()
@@ -74,12 +137,16 @@ class DBusServer():
 
     # doesn't work in __init__()
     StatusArchive = signal()
+    UpdateArchiveAdded = signal()
     UpdateResult = signal()
+    UpdateArchiveResult = signal()
 
     # -------------------------------------------------------------------------
     # non-D-Bus Methods
 
-    def __init__(self, work_dir: str, cache_dir: str, logger: Logger):
+    def __init__(self, work_dir: str, cache_dir: str, logger: Logger,
+                 streaming=False, status_dir=None, stage_dir=None,
+                 upload_dir=None):
         """
         Parameters
         ----------
@@ -89,28 +156,69 @@ class DBusServer():
             Archivepath to update archive cache directory.
         logger: logging.Logger
             The logger object to use.
+        streaming: bool
+            Run instructions while the update archive is still being
+            extracted.
+        status_dir: str
+            Path to the directory to keep dpkg status snapshots in. If set,
+            status archives will only have a delta of the dpkg status file
+            once one has been acknowledged.
+        stage_dir: str
+            Path to the directory to extract the next update archive into in
+            the background. If None, update archives are only extracted when
+            updating.
+        upload_dir: str
+            Path to the directory to keep update archives being uploaded in
+            parts in. If None, update archives can't be uploaded in parts.
 
         Attributes
         ----------
-        StatusArchive: str
-            D-Bus Signal with a str that will sent the absolute path to the
-            updater status file after the MakeStatusArchive D-Bus Method is
-            called.
+        StatusArchive: (uint32, str)
+            D-Bus Signal with the job id from MakeStatusArchiveAsync D-Bus
+            Method and the absolute path to the new status archive (or a empty
+            str on failure), sent when the status archive is made.
+        UpdateArchiveAdded: (uint32, bool)
+            D-Bus Signal with the job id from AddUpdateArchiveAsync D-Bus
+            Method and True if the update archive was added to the cache or
+            False on failure, sent when the copy is done.
         UpdateResult: uint8
             D-Bus Signal with a :class:`Result` value that will be sent after
-            an update has finished or failed.
+            an update has finished or failed. After UpdateAll, it is the worst
+            result of the update archives that were run.
+        UpdateArchiveResult: (str, uint8)
+            D-Bus Signal with the filename of a update archive that was run
+            and its :class:`Result` value, sent for each update archive before
+            the UpdateResult D-Bus Signal.
         """
 
         self._log = logger
-        self._updater = Updater(work_dir, cache_dir, logger)
+        self._updater = Updater(work_dir, cache_dir, logger, streaming,
+                                stage_dir, upload_dir)
         self._cache_dir = cache_dir
+        self._status_dir = status_dir
+        self._status_archives = StatusArchiveCache()
 
         self._status = State.STANDBY
+        self._update_all = False  # run every cached update archive
 
-        # set up working thread
+        # set up working thread, it sleeps on the condition until there is
+        # something for it to do
         self._running = False
         self._working_thread = Thread(target=self._working_loop)
-        self._mutex = Lock()
+        self._cond = Condition()
+        self._wakeups = 0
+
+        # status archive jobs, protected by the condition
+        self._status_job = 0  # id of the newest job
+        self._status_job_queued = False
+        self._status_builds = 0
+        self._status_before_build = State.STANDBY
+
+        # update archive add jobs, protected by the condition, copied in order
+        # by their own thread so a long copy never waits for an update
+        self._ingest_thread = Thread(target=self._ingest_loop)
+        self._add_job = 0  # id of the newest job
+        self._add_queue = deque()
 
     def __del__(self):
         self.quit()
@@ -120,40 +228,168 @@ class DBusServer():
         self._log.debug("starting working thread")
         self._running = True
         self._working_thread.start()
+        self._ingest_thread.start()
+        self._updater.start_staging()
 
     def quit(self):
         """Stop the D-Bus server."""
         self._log.debug("stopping working thread")
-        self._running = False
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
         if self._working_thread.is_alive():
             self._working_thread.join()
+        if self._ingest_thread.is_alive():
+            self._ingest_thread.join()
+        self._updater.stop_staging()
+
+    def _has_work(self) -> bool:
+        """Check if the working thread has something to do. Must be called
+        with the condition held.
+        """
+
+        return not self._running or self._status == State.UPDATE or \
+            self._status_job_queued
 
     def _working_loop(self):
         """The main loop to contol the Linux Updater asynchronously. Will be in
         its own thread.
+
+        The thread waits on a condition variable, so it uses no CPU while
+        there is nothing to do and it is woken up as soon as a D-Bus method
+        gives it work.
         """
 
         self._log.debug("starting working loop")
 
-        while self._running:
-            if self._status == State.UPDATE:
-                ret = self._updater.update()
-                self.UpdateResult(ret)
-                if ret in [Result.NOTHING, Result.SUCCESS]:
-                    self._status = State.STANDBY
+        while True:
+            with self._cond:
+                self._cond.wait_for(self._has_work)
+                self._wakeups += 1
+                if not self._running:
+                    break
+
+                updating = self._status == State.UPDATE
+                update_all = self._update_all
+                status_job = 0
+                if not updating:  # updates go first, the job waits
+                    status_job = self._status_job
+                    self._status_job_queued = False
+
+            if updating:
+                if update_all:
+                    results = self._updater.update_all()
                 else:
-                    self._status = State.UPDATE_FAILED
-            elif self._status in [State.STANDBY,
-                                  State.STATUS_FILE,
-                                  State.UPDATE_FAILED]:
-                sleep(0.1)  # nothing for this thread to do
-            else:  # this should not happen
-                msg = "Invalid state in working loop {}".format(self._status)
-                self._log.critical(msg)
-                self._status = State.STANDBY
+                    ret = self._updater.update()
+                    results = [(self._updater.last_update_archive, ret)]
+
+                # the Result values are ordered from best to worst
+                ret = max([i[1] for i in results], default=Result.NOTHING)
+                for fname, fret in results:
+                    if fname != "":
+                        self.UpdateArchiveResult(fname, fret)
+                self.UpdateResult(ret)
+
+                with self._cond:
+                    if ret in [Result.NOTHING, Result.SUCCESS]:
+                        self._status = State.STANDBY
+                    else:
+                        self._status = State.UPDATE_FAILED
+            else:
+                self.StatusArchive(status_job, self._make_status_archive())
 
         self._log.debug("stoping working loop")
 
+    def _ingest_loop(self):
+        """Add the queued update archives to the cache, oldest job first. Will
+        be in its own thread.
+
+        The adds run one after another, not in parallel; the copies all go to
+        the same storage, so running them at once would not make them faster
+        and a job would no longer finish in order. On quit, the jobs not
+        started yet fail.
+        """
+
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: not self._running or
+                                    len(self._add_queue) != 0)
+                if not self._running:
+                    pending = list(self._add_queue)
+                    self._add_queue.clear()
+                    break
+                job, update_archive = self._add_queue.popleft()
+
+            ret = self._updater.add_update_archive(update_archive)
+            self.UpdateArchiveAdded(job, ret)
+
+        # don't leave clients waiting on the job ids they were given
+        for job, _ in pending:
+            self.UpdateArchiveAdded(job, False)
+
+    def _make_status_archive(self) -> str:
+        """Make a status archive, while in the :data:`State.STATUS_FILE`
+        state.
+
+        Returns
+        -------
+        str
+            Filepath to new file or empty str on failure.
+        """
+
+        with self._cond:
+            self._status_builds += 1
+            if self._status_builds == 1 and \
+                    self._status in [State.STANDBY, State.UPDATE_FAILED]:
+                self._status_before_build = self._status
+                self._status = State.STATUS_FILE
+
+        self._log.debug("making status archive")
+        try:
+            ret = self._status_archives.make_status_archive(
+                    self._cache_dir, True, status_dir=self._status_dir)
+        except FileNotFoundError as exc:
+            self._log.error(exc)
+            ret = ""
+
+        if ret == "":
+            self._log.critical("failed to make status archive")
+        else:
+            self._log.info(ret + " was made")
+
+        with self._cond:
+            self._status_builds -= 1
+            if self._status_builds == 0 and self._status == State.STATUS_FILE:
+                self._status = self._status_before_build
+
+        return ret
+
+    def _start_update(self, update_all: bool) -> bool:
+        """Wake the working thread to update, if not busy.
+
+        Parameters
+        ----------
+        update_all: bool
+            Run every update archive in the cache instead of the oldest one.
+
+        Returns
+        -------
+        bool
+            True if a the updater will start to update or False on failure.
+        """
+
+        ret = False
+
+        with self._cond:
+            if self._status in [State.STANDBY,
+                                State.UPDATE_FAILED]:
+                self._status = State.UPDATE
+                self._update_all = update_all
+                self._cond.notify_all()
+                ret = True
+
+        return ret
+
     # -------------------------------------------------------------------------
     # D-Bus Methods
 
@@ -173,6 +409,182 @@ class DBusServer():
 
         return self._updater.add_update_archive(update_archive)
 
+    def AddUpdateArchiveFd(self, filename: str, fd_index: int,
+                           dbus_context=None) -> bool:
+        """D-Bus Method that adds an update archive passed as a Unix file
+        descriptor to the update archive cache, so the daemon doesn't need to
+        be able to open the caller's path. It is reflinked into the cache if
+        possible, otherwise copied in the kernel.
+
+        Parameters
+        ----------
+        filename: str
+            The filename of the update archive.
+        fd_index: int
+            The index of the file descriptor in the Unix fd list of the D-Bus
+            message (a D-Bus handle), not the file descriptor itself.
+        dbus_context: pydbus.method_call_context.MethodCallContext
+            Set by pydbus, used to get the Unix fd list of the D-Bus message.
+
+        Returns
+        -------
+        bool
+            True if a file was added or False on failure.
+        """
+
+        # pydbus (checked with 0.6.0, the last release) has no public way to
+        # get the Unix fd list, it is read from the Gio.DBusMethodInvocation
+        # in the private MethodCallContext._mi attribute
+        invocation = getattr(dbus_context, "_mi", None)
+        if invocation is None:
+            self._log.error("pydbus did not give the D-Bus message, can't get "
+                            "file descriptors")
+            return False
+
+        try:
+            fd_list = invocation.get_message().get_unix_fd_list()
+            # a new file descriptor, must be closed
+            fd = fd_list.get(fd_index) if fd_list is not None else -1
+        except (AttributeError, GLib.Error):
+            fd = -1
+        if fd < 0:
+            self._log.error("no file descriptor {} for {}".format(
+                fd_index, filename))
+            return False
+
+        try:
+            return self._updater.add_update_archive_fd(filename, fd)
+        finally:
+            close(fd)
+
+    def BeginUpdateArchiveUpload(self, filename: str, size: int, sha256: str,
+                                 part_size: int) -> bool:
+        """D-Bus Method to begin uploading an update archive in parts. If the
+        same update archive is already being uploaded with the same part size
+        (e.g. from a earlier pass or before the daemon restarted), the upload
+        is resumed.
+
+        Parameters
+        ----------
+        filename: str
+            The filename of the update archive.
+        size: uint64
+            The size of the update archive in bytes.
+        sha256: str
+            The SHA-256 hex digest of the update archive.
+        part_size: uint32
+            The size of every part in bytes, except the last one.
+
+        Returns
+        -------
+        bool
+            True if the upload can start or False on failure.
+        """
+
+        return self._updater.begin_upload(filename, size, sha256, part_size)
+
+    def AddUpdateArchivePart(self, filename: str, index: int, data: bytes,
+                             crc32: int) -> bool:
+        """D-Bus Method to add a part of an update archive being uploaded.
+        Parts can be added in any order.
+
+        Parameters
+        ----------
+        filename: str
+            The filename of the update archive.
+        index: uint32
+            The index of the part.
+        data: bytes
+            The part.
+        crc32: uint32
+            The CRC-32 of the part.
+
+        Returns
+        -------
+        bool
+            True if the part was added or False on failure.
+        """
+
+        return self._updater.add_upload_part(filename, index, bytes(data),
+                                             crc32)
+
+    def MissingUpdateArchiveParts(self, filename: str) -> list:
+        """D-Bus Method to get the parts of an update archive being uploaded
+        that were not received yet.
+
+        Parameters
+        ----------
+        filename: str
+            The filename of the update archive.
+
+        Returns
+        -------
+        list
+            The indexes of the missing parts.
+        """
+
+        return self._updater.missing_upload_parts(filename)
+
+    def CommitUpdateArchiveUpload(self, filename: str) -> bool:
+        """D-Bus Method to add an update archive that was uploaded in parts to
+        the update archive cache, once all parts were received and it matches
+        its hash.
+
+        Parameters
+        ----------
+        filename: str
+            The filename of the update archive.
+
+        Returns
+        -------
+        bool
+            True if the update archive was added or False on failure.
+        """
+
+        return self._updater.commit_upload(filename)
+
+    def CancelUpdateArchiveUpload(self, filename: str) -> bool:
+        """D-Bus Method to stop uploading an update archive and delete the
+        parts received.
+
+        Parameters
+        ----------
+        filename: str
+            The filename of the update archive.
+
+        Returns
+        -------
+        bool
+            True if the upload was canceled or False if there was no upload.
+        """
+
+        return self._updater.cancel_upload(filename)
+
+    def AddUpdateArchiveAsync(self, update_archive: str) -> int:
+        """D-Bus Method to queue copying an update archive into the update
+        archive cache. Returns right away, the UpdateArchiveAdded D-Bus Signal
+        is sent with the job id and the result once it is copied. Jobs are
+        run one at a time, in order. If the daemon quits first, the signal is
+        sent with False.
+
+        Parameters
+        ----------
+        update_archive: str
+            The absolute path to update archive for the updater to store.
+
+        Returns
+        -------
+        uint32
+            The job id.
+        """
+
+        with self._cond:
+            self._add_job += 1
+            self._add_queue.append((self._add_job, update_archive))
+            self._cond.notify_all()
+
+            return self._add_job
+
     def Update(self) -> bool:
         """D-Bus Method to load the oldest update archive in cache and runs update.
 
@@ -182,47 +594,100 @@ class DBusServer():
             True if a the updater will start to update or False on failure.
         """
 
-        ret = False
+        return self._start_update(False)
 
-        self._mutex.acquire()
-        if self._status in [State.STANDBY,
-                            State.UPDATE_FAILED]:
-            self._status = State.UPDATE
-            ret = True
-        self._mutex.release()
+    def UpdateAll(self) -> bool:
+        """D-Bus Method to run every update archive in cache in one pass, with
+        their instructions merged into one plan. The UpdateArchiveResult D-Bus
+        Signal is sent for each update archive that was run, with its
+        filename, then the UpdateResult D-Bus Signal with the worst result.
 
-        return ret
+        Returns
+        -------
+        bool
+            True if a the updater will start to update or False on failure.
+        """
+
+        return self._start_update(True)
 
     def MakeStatusArchive(self) -> str:
         """D-Bus Method to make status tar file with a copy of the dpkg status
         file and a file with the list of update archives in cache.
 
+        This blocks the D-Bus server until the status archive is made, see
+        MakeStatusArchiveAsync for a non-blocking version.
+
         Returns
         -------
         str
             Filepath to new file or empty str.
         """
 
-        self._mutex.acquire()
-        if self._status in [State.STANDBY,
-                            State.UPDATE_FAILED]:
-            self._status = State.STATUS_FILE
-        self._mutex.release()
+        return self._make_status_archive()
 
-        self._log.debug("making status archive")
-        ret = make_status_archive(self._cache_dir, True)
+    def MakeStatusArchiveAsync(self) -> int:
+        """D-Bus Method to queue making a status archive on the working thread.
+        Returns right away, the StatusArchive D-Bus Signal is sent with the job
+        id and the filepath once it is made.
 
-        if ret == "":
-            self._log.critical("failed to make status archive")
-        else:
-            self._log.info(ret + " was made")
+        Requests made before the queued job starts are coalesced into it and
+        get the same job id. If an update is running, the job runs after it.
 
-        self._mutex.acquire()
-        self._status = State.STANDBY
-        self._mutex.release()
+        Returns
+        -------
+        uint32
+            The job id.
+        """
+
+        with self._cond:
+            if not self._status_job_queued:
+                self._status_job += 1
+                self._status_job_queued = True
+                self._cond.notify_all()
+
+            return self._status_job
+
+    def AcknowledgeStatusArchive(self, filename: str) -> bool:
+        """D-Bus Method to tell the daemon the ground station has a status
+        archive, so the following status archives only have the dpkg status
+        changes since it.
+
+        Parameters
+        ----------
+        filename: str
+            The filename of the status archive.
+
+        Returns
+        -------
+        bool
+            True if the status archive is now the base or False if it is
+            unknown (or no status directory is set).
+        """
+
+        # the ground station has it, so it can be deleted when over the max
+        # size
+        self._status_archives.acknowledge(filename)
+
+        if self._status_dir is None:
+            return False
+
+        ret = acknowledge_status_archive(self._status_dir, filename)
+        if ret:
+            self._log.info(filename + " was acknowledged")
+        else:
+            self._log.error("no dpkg status snapshot for " + filename)
 
         return ret
 
+    def ResetStatusSnapshot(self):
+        """D-Bus Method to forget the acknowledged status archive, so the next
+        status archive has the full dpkg status file.
+        """
+
+        if self._status_dir is not None:
+            reset_status_snapshot(self._status_dir)
+            self._log.info("dpkg status snapshot was reset")
+
     # -------------------------------------------------------------------------
     # D-Bus Properties
 
@@ -266,17 +731,35 @@ class DBusServer():
 
         return self._updater.list_updates
 
+    @property
+    def ListUploads(self) -> str:
+        """str: D-Bus Property for the JSON list of the filenames of update
+        archives being uploaded in parts. Readonly.
+        """
+
+        return self._updater.list_uploads
+
+    @property
+    def IngestStats(self) -> str:
+        """str: D-Bus Property for a JSON dictionary with the number of update
+        archives added, the total bytes, and the total seconds for each ingest
+        method. Readonly.
+        """
+
+        return self._updater.ingest_stats
+
     @property
     def TotalInstructions(self) -> int:
-        """uint8: D-Bus Property for the number intruction in the current
-        update. Will be 0 if not updating. Readonly.
+        """uint32: D-Bus Property for the number intruction in the current
+        update, a merged UpdateAll plan can have more than 255. Will be 0 if
+        not updating. Readonly.
         """
 
         return self._updater.total_instructions
 
     @property
     def InstructionIndex(self) -> int:
-        """uint8: D-Bus Property for current index in the instructions. Wil
+        """uint32: D-Bus Property for current index in the instructions. Wil
         be 0 if not updating. Readonly.
         """
 
@@ -289,3 +772,30 @@ class DBusServer():
         """
 
         return self._updater.instruction_command
+
+    @property
+    def InstructionOutputBytes(self) -> int:
+        """uint64: D-Bus Property for the number of bytes of output from the
+        current instruction command so far. Will be 0 if not updating.
+        Readonly.
+        """
+
+        return self._updater.instruction_output_bytes
+
+    @property
+    def InstructionOutputLines(self) -> int:
+        """uint32: D-Bus Property for the number of lines of output from the
+        current instruction command so far. Will be 0 if not updating.
+        Readonly.
+        """
+
+        return self._updater.instruction_output_lines
+
+    @property
+    def SkippedPackages(self) -> int:
+        """uint32: D-Bus Property for the number of dpkg package operations
+        skipped in the current or last update, because they were already done.
+        Readonly.
+        """
+
+        return self._updater.skipped_packages
@@ -0,0 +1,692 @@
+"""Fast, compact parser and index for dpkg status files.
+
+Only the fields needed to know what is installed (Package, Version,
+Architecture, and Status) are kept, everything else in a stanza is skipped
+without being decoded. Strings are interned, so the many packages with the
+same architecture or status share one str, and each package is a small
+:code:`__slots__` record.
+
+Also reads the control files of deb files and parses package relationship
+fields and versions like dpkg does, for checking deb files before they are
+installed (see :mod:`oresat_linux_updater.preflight`).
+"""
+
+import re
+import mmap
+import tarfile
+from io import BytesIO
+from sys import intern
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DPKG_STATUS_FILE = "/var/lib/dpkg/status"
+"""The dpkg status file of the system."""
+
+_AR_MAGIC = b"!<arch>\n"
+_AR_HEADER_SIZE = 60
+
+_PACKAGE = b"\nPackage: "
+_FIELDS = (b"\nVersion: ", b"\nArchitecture: ", b"\nStatus: ")
+"""The fields for :class:`DpkgPackage` after the name, in order."""
+_PROVIDES = b"\nProvides: "
+_UNPACKED_STATES = ("unpacked", "half-configured", "triggers-awaited",
+                    "triggers-pending", "installed")
+"""The package states with all the package's files on disk."""
+
+_EPOCH = re.compile(r"[0-9]+$")
+_UPSTREAM = re.compile(r"[0-9A-Za-z.+~:-]+$")
+_REVISION = re.compile(r"[0-9A-Za-z.+~]+$")
+"""The chars allowed in each part of a version, from the Debian Policy
+Manual."""
+
+_RELATION = re.compile(r"([^\s:(\[]+)(?::\S+)?\s*(?:\(\s*(<<|<=|=|>=|>>|<|>)"
+                       r"\s*([^)\s]+)\s*\))?")
+
+
+class DpkgStatusError(Exception):
+    """Invalid deb file."""
+
+
+class DpkgVersionError(DpkgStatusError):
+    """Invalid Debian package version."""
+
+
+class DpkgPackage():
+    """A package in a dpkg status file."""
+
+    __slots__ = ["name", "version", "arch", "status"]
+
+    def __init__(self, name: str, version: str, arch: str, status: str):
+        """
+        Parameters
+        ----------
+        name: str
+            The name of the package.
+        version: str
+            The version of the package.
+        arch: str
+            The architecture of the package.
+        status: str
+            The dpkg status of the package, e.g. "install ok installed".
+        """
+
+        self.name = name
+        self.version = version
+        self.arch = arch
+        self.status = status
+
+    def __repr__(self):
+        return "{} {}_{}_{}".format(self.__class__.__name__, self.name,
+                                    self.version, self.arch)
+
+    def __eq__(self, other):
+        if not isinstance(other, DpkgPackage):
+            return NotImplemented
+        return self.name == other.name and self.version == other.version and \
+            self.arch == other.arch and self.status == other.status
+
+    def __hash__(self):
+        return hash((self.name, self.version, self.arch, self.status))
+
+    @property
+    def installed(self) -> bool:
+        """bool: Flag if the package is installed (not just its config files
+        or partly installed)."""
+
+        return self.status.endswith(" installed")
+
+    @property
+    def state(self) -> str:
+        """str: The package state, the last word of the status, e.g.
+        "installed", "triggers-pending" or "config-files"."""
+
+        return self.status.rpartition(" ")[2]
+
+    @property
+    def unpacked(self) -> bool:
+        """bool: Flag if the package's files are on disk, it is unpacked or
+        in a later state, e.g. with its triggers still pending."""
+
+        return self.state in _UNPACKED_STATES
+
+
+def _field(data: bytes, key: bytes, start: int, end: int) -> str:
+    """Get the value of a field in a stanza, interned. Empty str if missing.
+    Searched in place, so the stanza is never copied.
+    """
+
+    pos = data.find(key, start, end)
+    if pos == -1:
+        return ""
+    pos += len(key)
+    line_end = data.find(b"\n", pos, end)
+    if line_end == -1:
+        line_end = end
+    return intern(data[pos:line_end].decode("utf-8").strip())
+
+
+def iter_dpkg_status(data, provides=None) -> iter:
+    """Iterate over the packages in a dpkg status file without copying the
+    whole file.
+
+    Parameters
+    ----------
+    data: bytes
+        The contents of a dpkg status file, can be any bytes-like object with
+        a find() method (e.g. a mmap) or a str.
+    provides: set
+        Optional, the names of the virtual packages provided by the unpacked
+        packages (see :attr:`DpkgPackage.unpacked`) are added to it, in the
+        same pass.
+
+    Yields
+    ------
+    DpkgPackage
+        Each package in file order.
+    """
+
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+
+    for start, end in _stanzas(data):
+        if start == 0 and data[:len(_PACKAGE) - 1] == _PACKAGE[1:]:
+            name = _field(data, _PACKAGE[1:], 0, end)
+        else:
+            name = _field(data, _PACKAGE, start, end)
+
+        if name == "":
+            continue
+
+        package = DpkgPackage(name, *[_field(data, key, start, end)
+                                      for key in _FIELDS])
+        if provides is not None and package.unpacked and \
+                data.find(_PROVIDES, start, end) != -1:
+            for group in parse_relations(_field(data, _PROVIDES, start,
+                                                end)):
+                provides.update([i[0] for i in group])
+
+        yield package
+
+
+def _stanzas(data) -> iter:
+    """Iterate over the (start, end) offsets of the stanzas in a dpkg status
+    file. Fields are searched for as "\\nKey: ", so a stanza starts at the
+    newline before it, except the first one.
+    """
+
+    start = 0
+    size = len(data)
+    while start < size:
+        end = data.find(b"\n\n", start + 1)
+        end = size if end == -1 else end + 1
+        yield start, end
+        start = end
+
+
+class DpkgStatus():
+    """A index of the packages in a dpkg status file."""
+
+    def __init__(self, packages=(), provides=None):
+        """
+        Parameters
+        ----------
+        packages: iter
+            The :class:`DpkgPackage` to index.
+        provides: set
+            The names of the virtual packages provided by the unpacked
+            packages. Can be filled while the packages are iterated over (see
+            :func:`iter_dpkg_status`).
+        """
+
+        self._packages = {}
+        self._count = 0
+        for package in packages:
+            self._add(package)
+        self._provides = provides if provides is not None else set()
+
+    def _add(self, package: DpkgPackage):
+        same_name = self._packages.get(package.name)
+        if same_name is None:
+            self._packages[package.name] = package
+        elif isinstance(same_name, DpkgPackage):  # multi-arch
+            self._packages[package.name] = (same_name, package)
+        else:
+            self._packages[package.name] = same_name + (package,)
+        self._count += 1
+
+    @classmethod
+    def from_file(cls, path: str):
+        """Index a dpkg status file. The file is read with mmap.
+
+        Parameters
+        ----------
+        path: str
+            Path to the dpkg status file.
+
+        Raises
+        ------
+        FileNotFoundError
+
+        Returns
+        -------
+        DpkgStatus
+            The index.
+        """
+
+        with open(path, "rb") as fptr:
+            try:
+                data = mmap.mmap(fptr.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                return cls()
+
+            with data:
+                provides = set()
+                return cls(iter_dpkg_status(data, provides), provides)
+
+    @classmethod
+    def from_string(cls, content):
+        """Index the contents of a dpkg status file, e.g. from
+        :meth:`StatusArchive.dpkg_status`.
+
+        Parameters
+        ----------
+        content: str
+            The contents of the dpkg status file, str or bytes.
+
+        Returns
+        -------
+        DpkgStatus
+            The index.
+        """
+
+        provides = set()
+        return cls(iter_dpkg_status(content, provides), provides)
+
+    @property
+    def provides(self) -> set:
+        """set: The names of the virtual packages provided by the unpacked
+        packages. Readonly."""
+
+        return self._provides
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, name: str):
+        return name in self._packages
+
+    def __iter__(self):
+        for same_name in self._packages.values():
+            if isinstance(same_name, DpkgPackage):
+                yield same_name
+            else:
+                yield from same_name
+
+    def get(self, name: str, arch=None) -> DpkgPackage:
+        """Get a package.
+
+        Parameters
+        ----------
+        name: str
+            The name of the package.
+        arch: str
+            The architecture of the package. If not set, the first package
+            with the name is returned.
+
+        Returns
+        -------
+        DpkgPackage
+            The package or None if it is not in the dpkg status file.
+        """
+
+        same_name = self._packages.get(name)
+        if same_name is None or isinstance(same_name, DpkgPackage):
+            if arch is not None and same_name is not None and \
+                    same_name.arch != arch:
+                return None
+            return same_name
+
+        if arch is None:
+            return same_name[0]
+        for package in same_name:
+            if package.arch == arch:
+                return package
+        return None
+
+    def is_purged(self, name: str, arch=None) -> bool:
+        """Check if a package is purged, not installed and has no config
+        files left.
+
+        Parameters
+        ----------
+        name: str
+            The name of the package.
+        arch: str
+            The architecture of the package. If not set, any architecture.
+
+        Returns
+        -------
+        bool
+            True if the package is purged.
+        """
+
+        same_name = self._packages.get(name)
+        if same_name is None:
+            return True
+        if isinstance(same_name, DpkgPackage):
+            same_name = (same_name,)
+
+        for package in same_name:
+            if (arch is None or package.arch == arch) and \
+                    not package.status.endswith(" not-installed"):
+                return False
+        return True
+
+    def is_removed(self, name: str, arch=None) -> bool:
+        """Check if a package is removed, not installed or only its config
+        files are left. A package in any other state (e.g. "unpacked",
+        "half-configured" or "triggers-pending") still has files on disk.
+
+        Parameters
+        ----------
+        name: str
+            The name of the package.
+        arch: str
+            The architecture of the package. If not set, any architecture.
+
+        Returns
+        -------
+        bool
+            True if the package is removed.
+        """
+
+        same_name = self._packages.get(name)
+        if same_name is None:
+            return True
+        if isinstance(same_name, DpkgPackage):
+            same_name = (same_name,)
+
+        for package in same_name:
+            if (arch is None or package.arch == arch) and \
+                    package.state not in ["not-installed", "config-files"]:
+                return False
+        return True
+
+    def is_installed(self, name: str, version=None, arch=None) -> bool:
+        """Check if a package is installed.
+
+        Parameters
+        ----------
+        name: str
+            The name of the package.
+        version: str
+            The exact version the package must be at. If not set, any
+            version.
+        arch: str
+            The architecture of the package. If not set, any architecture.
+
+        Returns
+        -------
+        bool
+            True if the package is installed.
+        """
+
+        same_name = self._packages.get(name)
+        if same_name is None:
+            return False
+        if isinstance(same_name, DpkgPackage):
+            same_name = (same_name,)
+
+        for package in same_name:
+            if package.installed and \
+                    (version is None or package.version == version) and \
+                    (arch is None or package.arch == arch):
+                return True
+        return False
+
+
+def _read_deb_control_file(path: str) -> bytes:
+    """Read the control file of a deb file.
+
+    Raises
+    ------
+    DpkgStatusError
+        Invalid deb file.
+    FileNotFoundError
+    """
+
+    control = None
+
+    with open(path, "rb") as fptr:
+        if fptr.read(len(_AR_MAGIC)) != _AR_MAGIC:
+            raise DpkgStatusError("{} is not a deb file".format(path))
+
+        while True:
+            header = fptr.read(_AR_HEADER_SIZE)
+            if len(header) != _AR_HEADER_SIZE:
+                raise DpkgStatusError("no control.tar in {}".format(path))
+
+            name = header[:16].decode("ascii", errors="replace").strip()
+            try:
+                size = int(header[48:58])
+            except ValueError:
+                raise DpkgStatusError("invalid ar header in {}".format(path))
+
+            if name.startswith("control.tar"):
+                control = fptr.read(size)
+                break
+            fptr.seek(size + size % 2, 1)  # members are 2 byte aligned
+
+    if name.endswith(".zst"):
+        if zstandard is None:
+            raise DpkgStatusError("zstd control.tar requires the zstandard "
+                                  "module")
+        control = zstandard.ZstdDecompressor().decompressobj().decompress(
+            control)
+
+    try:
+        with tarfile.open(fileobj=BytesIO(control)) as tar:
+            for member in tar:
+                if member.name in ["./control", "control"]:
+                    return tar.extractfile(member).read()
+    except (tarfile.TarError, EOFError) as exc:
+        raise DpkgStatusError("invalid control.tar in {}: {}".format(path,
+                                                                     exc))
+
+    raise DpkgStatusError("no control file in {}".format(path))
+
+
+def read_deb_control(path: str) -> DpkgPackage:
+    """Read the package name, version, and architecture from the control file
+    of a deb file, without running dpkg-deb.
+
+    Parameters
+    ----------
+    path: str
+        Path to the deb file.
+
+    Raises
+    ------
+    DpkgStatusError
+        Invalid deb file.
+    FileNotFoundError
+
+    Returns
+    -------
+    DpkgPackage
+        The package, with a empty status.
+    """
+
+    stanza = b"\n" + _read_deb_control_file(path)
+    package = DpkgPackage(*[_field(stanza, key, 0, len(stanza))
+                            for key in (_PACKAGE,) + _FIELDS])
+    if package.name == "" or package.version == "":
+        raise DpkgStatusError("invalid control file in {}".format(path))
+
+    return package
+
+
+def read_deb_fields(path: str) -> dict:
+    """Read all fields from the control file of a deb file, without running
+    dpkg-deb. Continuation lines are joined.
+
+    Parameters
+    ----------
+    path: str
+        Path to the deb file.
+
+    Raises
+    ------
+    DpkgStatusError
+        Invalid deb file.
+    FileNotFoundError
+
+    Returns
+    -------
+    dict
+        The field names and values.
+    """
+
+    fields = {}
+    key = None
+
+    data = _read_deb_control_file(path).decode("utf-8", errors="replace")
+    for line in data.split("\n"):
+        if line.startswith((" ", "\t")) and key is not None:
+            fields[key] += " " + line.strip()
+        elif ":" in line:
+            key, _, value = line.partition(":")
+            key = key.strip()
+            fields[key] = value.strip()
+
+    if fields.get("Package", "") == "" or fields.get("Version", "") == "":
+        raise DpkgStatusError("invalid control file in {}".format(path))
+
+    return fields
+
+
+def parse_relations(value: str) -> list:
+    """Parse a package relationship field, e.g. Depends or Provides.
+    Architecture qualifiers and restrictions are ignored.
+
+    Parameters
+    ----------
+    value: str
+        The value of the field, e.g. "libc6 (>= 2.28), python3 | python".
+
+    Returns
+    -------
+    list
+        A list for each comma separated group, with a (name, operator,
+        version) tuple for each alternative. The operator and version are
+        None if there is no version.
+    """
+
+    groups = []
+
+    for group in value.split(","):
+        alternatives = []
+        for alternative in group.split("|"):
+            match = _RELATION.match(alternative.strip())
+            if match is not None:
+                alternatives.append(match.groups())
+        if len(alternatives) != 0:
+            groups.append(alternatives)
+
+    return groups
+
+
+def _version_order(char: str) -> int:
+    """The sort weight of a non-digit char in a Debian version."""
+
+    if char == "":
+        return 0
+    if char == "~":
+        return -1
+    if char.isalpha():
+        return ord(char)
+    return ord(char) + 256
+
+
+def _compare_version_part(a: str, b: str) -> int:
+    """Compare upstream versions or Debian revisions like dpkg."""
+
+    i = 0
+    j = 0
+
+    while i < len(a) or j < len(b):
+        # non-digit part, "~" sorts before anything, even the end
+        while (i < len(a) and not a[i].isdigit()) or \
+                (j < len(b) and not b[j].isdigit()):
+            ac = _version_order(a[i] if i < len(a) and not a[i].isdigit()
+                                else "")
+            bc = _version_order(b[j] if j < len(b) and not b[j].isdigit()
+                                else "")
+            if ac != bc:
+                return -1 if ac < bc else 1
+            i += 1
+            j += 1
+
+        # digit part, compared as numbers
+        i_end = i
+        while i_end < len(a) and a[i_end].isdigit():
+            i_end += 1
+        j_end = j
+        while j_end < len(b) and b[j_end].isdigit():
+            j_end += 1
+
+        an = int(a[i:i_end] or "0")
+        bn = int(b[j:j_end] or "0")
+        if an != bn:
+            return -1 if an < bn else 1
+        i = i_end
+        j = j_end
+
+    return 0
+
+
+def compare_versions(a: str, b: str) -> int:
+    """Compare two Debian package versions ([epoch:]upstream[-revision]),
+    the same way dpkg does.
+
+    Parameters
+    ----------
+    a: str
+        The first version.
+    b: str
+        The second version.
+
+    Raises
+    ------
+    DpkgVersionError
+        A version is not a valid Debian version, e.g. "a:1.0".
+
+    Returns
+    -------
+    int
+        -1 if a is older than b, 0 if they are the same, or 1 if a is newer.
+    """
+
+    versions = []
+    for version in (a, b):
+        # the epoch ends at the first colon, the upstream version can have
+        # more, the revision starts after the last hyphen
+        epoch, _, rest = version.partition(":") if ":" in version \
+            else ("0", "", version)
+        upstream, hyphen, revision = rest.rpartition("-") if "-" in rest \
+            else (rest, "", "")
+        if _EPOCH.match(epoch) is None or \
+                _UPSTREAM.match(upstream) is None or \
+                (hyphen != "" and _REVISION.match(revision) is None):
+            raise DpkgVersionError("invalid version {}".format(version))
+        versions.append((int(epoch), upstream, revision))
+
+    if versions[0][0] != versions[1][0]:
+        return -1 if versions[0][0] < versions[1][0] else 1
+
+    ret = _compare_version_part(versions[0][1], versions[1][1])
+    if ret == 0:
+        ret = _compare_version_part(versions[0][2], versions[1][2])
+
+    return ret
+
+
+def version_satisfies(version: str, operator: str, required: str) -> bool:
+    """Check a version against a version relationship.
+
+    Parameters
+    ----------
+    version: str
+        The version of the package.
+    operator: str
+        The relationship operator, e.g. ">=". If None, any version matches.
+    required: str
+        The version in the relationship.
+
+    Raises
+    ------
+    DpkgVersionError
+        A version is not a valid Debian version.
+
+    Returns
+    -------
+    bool
+        True if the version satisfies the relationship.
+    """
+
+    if operator is None:
+        return True
+
+    ret = compare_versions(version, required)
+    if operator in ["<<", "<"]:
+        return ret < 0
+    if operator == "<=":
+        return ret <= 0
+    if operator == "=":
+        return ret == 0
+    if operator == ">=":
+        return ret >= 0
+    return ret > 0  # ">>" or ">"
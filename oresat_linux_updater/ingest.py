@@ -0,0 +1,160 @@
+"""Copy files into the update archive cache as cheaply as the filesystem
+allows.
+
+The methods are tried in order, the first one that works is used.
+
++-----------------+-------------------------------------------------------+
+| Method          | Notes                                                 |
++=================+=======================================================+
+| link            | Hardlink, no data is written. Only on the same        |
+|                 | filesystem and only for files the daemon made, as     |
+|                 | the owner of a linked file could still change it.     |
++-----------------+-------------------------------------------------------+
+| reflink         | Copy-on-write clone (btrfs, xfs, ...), no data is     |
+|                 | written.                                              |
++-----------------+-------------------------------------------------------+
+| copy_file_range | Copied in the kernel, can be offloaded by the         |
+|                 | filesystem.                                           |
++-----------------+-------------------------------------------------------+
+| sendfile        | Copied in the kernel.                                 |
++-----------------+-------------------------------------------------------+
+| copy            | Read and written by the daemon.                       |
++-----------------+-------------------------------------------------------+
+"""
+
+import os
+from fcntl import ioctl
+
+INGEST_METHODS = ["link", "reflink", "copy_file_range", "sendfile", "copy"]
+"""All ingest methods, in the order they are tried."""
+
+FICLONE = 0x40049409
+"""The Linux ioctl to reflink a whole file."""
+
+COPY_CHUNK_SIZE = 1024 * 1024
+"""The most bytes copied by one system call."""
+
+
+def _link(src_fd: int, dst: str, link_path: str) -> bool:
+    """Hardlink the file, only works on the same filesystem."""
+
+    if not os.path.samestat(os.stat(link_path), os.fstat(src_fd)):
+        return False  # path was replaced after it was opened
+
+    try:
+        os.link(link_path, dst, follow_symlinks=False)
+    except OSError:
+        return False
+
+    return True
+
+
+def _reflink(src_fd: int, dst_fd: int) -> bool:
+    try:
+        ioctl(dst_fd, FICLONE, src_fd)
+    except OSError:
+        return False
+
+    return True
+
+
+def _copy_file_range(src_fd: int, dst_fd: int, size: int) -> bool:
+    offset = 0
+
+    while offset < size:
+        try:
+            count = os.copy_file_range(src_fd, dst_fd,
+                                       min(size - offset, COPY_CHUNK_SIZE),
+                                       offset, offset)
+        except (OSError, AttributeError):
+            if offset == 0:
+                return False  # not supported, try the next method
+            raise
+        if count == 0:
+            break  # file was truncated
+        offset += count
+
+    return True
+
+
+def _sendfile(src_fd: int, dst_fd: int, size: int) -> bool:
+    offset = 0
+
+    while offset < size:
+        try:
+            count = os.sendfile(dst_fd, src_fd, offset,
+                                min(size - offset, COPY_CHUNK_SIZE))
+        except OSError:
+            if offset == 0:
+                return False  # not supported, try the next method
+            raise
+        if count == 0:
+            break  # file was truncated
+        offset += count
+
+    return True
+
+
+def _copy(src_fd: int, dst_fd: int):
+    offset = 0
+
+    while True:
+        data = os.pread(src_fd, COPY_CHUNK_SIZE, offset)
+        if len(data) == 0:
+            break
+        os.write(dst_fd, data)
+        offset += len(data)
+
+
+def ingest_fd(src_fd: int, dst: str, link_path=None) -> str:
+    """Make a new file that is a copy of a open file, with the cheapest method
+    that works. The file is always read from its start, the file offset of the
+    file descriptor is not used or changed by the link or kernel copies.
+
+    Only a file the daemon made and no one else can write to may be
+    hardlinked, a caller's file is always copied (or reflinked), so it can't
+    be changed after it was checked.
+
+    Parameters
+    ----------
+    src_fd: int
+        File descriptor of the file to copy. It is not closed.
+    dst: str
+        Path to the new file. Must not exist.
+    link_path: str
+        Optional, the path the file was opened from, if it may be hardlinked.
+
+    Raises
+    ------
+    OSError
+        The file could not be copied.
+
+    Returns
+    -------
+    str
+        The method used, one of :data:`INGEST_METHODS`.
+    """
+
+    size = os.fstat(src_fd).st_size
+
+    if link_path is not None and _link(src_fd, dst, link_path):
+        return "link"
+
+    dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    try:
+        if _reflink(src_fd, dst_fd):
+            method = "reflink"
+        elif _copy_file_range(src_fd, dst_fd, size):
+            method = "copy_file_range"
+        elif _sendfile(src_fd, dst_fd, size):
+            method = "sendfile"
+        else:
+            _copy(src_fd, dst_fd)
+            method = "copy"
+    except OSError:
+        os.close(dst_fd)
+        os.remove(dst)
+        raise
+
+    os.close(dst_fd)
+    return method
@@ -1,8 +1,13 @@
 """Everything todo with update instructions."""
 
 import subprocess
+import selectors
+from os import read
+from collections import deque
 from logging import Logger
 from enum import IntEnum, auto
+from oresat_linux_updater.dpkg_status import DpkgStatus, DpkgStatusError, \
+        read_deb_control
 
 
 class InstructionType(IntEnum):
@@ -31,15 +36,85 @@ INSTRUCTIONS_WITH_FILES = [
         ]
 """The list of instructions that require files."""
 
+DPKG_INSTRUCTIONS = [
+        InstructionType.DPKG_INSTALL,
+        InstructionType.DPKG_REMOVE,
+        InstructionType.DPKG_PURGE,
+        ]
+"""The list of instructions that run dpkg."""
+
+DPKG_TRIGGERS_COMMAND = "dpkg --triggers-only --pending"
+"""The bash command to run all pending dpkg triggers."""
+
+OUTPUT_CHUNK_SIZE = 4096
+"""The most bytes read from a command's stdout or stderr at once. Also the
+longest line that will be logged, longer lines are split.
+"""
+
+OUTPUT_TAIL_LINES = 20
+"""The number of lines of output kept for error reports."""
+
 
 class InstructionError(Exception):
     """Invalid instruction."""
 
 
+class CommandOutput():
+    """Live counters and a tail of the output of a running command.
+
+    The counters can be read from other threads while the command is running.
+    """
+
+    def __init__(self, tail_lines=OUTPUT_TAIL_LINES):
+        """
+        Parameters
+        ----------
+        tail_lines: int
+            The number of lines of output to keep.
+        """
+
+        self._bytes = 0
+        self._lines = 0
+        self._tail = deque(maxlen=tail_lines)
+
+    def reset(self):
+        """Reset the counters and clear the tail."""
+
+        self._bytes = 0
+        self._lines = 0
+        self._tail.clear()
+
+    def _add_bytes(self, size: int):
+        self._bytes += size
+
+    def _add_line(self, line: str):
+        self._lines += 1
+        self._tail.append(line)
+
+    @property
+    def bytes(self) -> int:
+        """int: The number of bytes of stdout and stderr read so far."""
+
+        return self._bytes
+
+    @property
+    def lines(self) -> int:
+        """int: The number of lines of stdout and stderr read so far."""
+
+        return self._lines
+
+    @property
+    def tail(self) -> list:
+        """list: The last lines of stdout and stderr."""
+
+        return list(self._tail)
+
+
 class Instruction():
     """Instruction for the OreSat Linux updater."""
 
-    def __init__(self, i_type: InstructionType, i_items: list):
+    def __init__(self, i_type: InstructionType, i_items: list,
+                 defer_triggers=False):
         """
         Parameters
         ----------
@@ -49,6 +124,9 @@ class Instruction():
             A list of :class:`str` for the instruction. If it is a
             :data:`InstructionType.BASH_SCRIPT` the list must be only have 1
             item.
+        defer_triggers: bool
+            Don't run dpkg triggers, they must be run later with
+            :data:`DPKG_TRIGGERS_COMMAND`. Only used by dpkg instructions.
         """
 
         if i_type not in InstructionType:
@@ -61,21 +139,24 @@ class Instruction():
 
         self._type = i_type
         self._items = i_items
+        self._defer_triggers = defer_triggers and i_type in DPKG_INSTRUCTIONS
 
         items_str = ""
         for item in self._items:
             items_str += " " + item
 
+        dpkg = "dpkg --no-triggers" if self._defer_triggers else "dpkg"
+
         if self._type == InstructionType.BASH_SCRIPT:
             self._bash_command = "bash " + self._items[0]
         elif self._type == InstructionType.SUPPORT_FILE:
             self._bash_command = ""
         if self._type == InstructionType.DPKG_INSTALL:
-            self._bash_command = "dpkg -i" + items_str
+            self._bash_command = dpkg + " -i" + items_str
         elif self._type == InstructionType.DPKG_REMOVE:
-            self._bash_command = "dpkg -r" + items_str
+            self._bash_command = dpkg + " -r" + items_str
         elif self._type == InstructionType.DPKG_PURGE:
-            self._bash_command = "dpkg -P" + items_str
+            self._bash_command = dpkg + " -P" + items_str
 
     def __repr__(self):
         return "{}: {}".format(self.__class__.__name__, self._type)
@@ -83,7 +164,7 @@ class Instruction():
     def __str__(self):
         return "{}: {}".format(self._type, self._items)
 
-    def run(self, log: Logger):
+    def run(self, log: Logger, output=None):
         """Run the instruction. All stdout message will be logged with info
         level and all stderr messages will be logged with error level.
 
@@ -91,6 +172,8 @@ class Instruction():
         ----------
         log: logging.Logger
             The logger to use to output stdin, stdout, stderr.
+        output: CommandOutput
+            Optional, counters to update while the command runs.
 
         Raises
         ------
@@ -99,7 +182,7 @@ class Instruction():
         """
 
         if self.bash_command != "":
-            run_bash_command(self._bash_command, log)
+            run_bash_command(self._bash_command, log, output)
 
     @property
     def type(self):
@@ -119,17 +202,255 @@ class Instruction():
 
         return self._bash_command
 
+    @property
+    def defer_triggers(self):
+        """bool: Flag if dpkg triggers will be left pending."""
+
+        return self._defer_triggers
+
+
+def plan_instructions(inst_list: list, defer_triggers=True) -> list:
+    """Make the list of instructions to run from the instructions in a update
+    archive.
+
+    Consecutive dpkg instructions of the same type are merged into one dpkg
+    call, so the dpkg database is only loaded once for them. Support file
+    instructions don't run anything, so they don't stop a merge, but bash
+    scripts always do.
+
+    If triggers are deferred, all pending triggers must be run with
+    :data:`DPKG_TRIGGERS_COMMAND` before the next bash script and after the
+    last instruction, so bash scripts see the same system as without
+    merging.
+
+    Parameters
+    ----------
+    inst_list: list
+        A list of Instructions, in the order of the update archive.
+    defer_triggers: bool
+        Make the dpkg instructions defer their triggers.
+
+    Returns
+    -------
+    list
+        The list of Instructions to run.
+    """
+
+    return [i[0] for i in _plan([(i, set()) for i in inst_list],
+                                defer_triggers)]
+
+
+def _plan(tagged: list, defer_triggers: bool) -> list:
+    """Merge a list of (Instruction, owners set) pairs like
+    :func:`plan_instructions`, the owners of merged instructions are joined.
+    """
 
-def run_bash_command(command: str, log: Logger) -> bool:
+    plan = []
+    group_type = None
+    group_items = []
+    group_owners = set()
+
+    for inst, owners in tagged:
+        if inst.type == InstructionType.SUPPORT_FILE:
+            plan.append((inst, owners))
+            continue
+
+        # the same file or package twice in one dpkg call is not the same
+        # as two dpkg calls
+        if inst.type == group_type and \
+                len(set(inst.items) & set(group_items)) == 0:
+            group_items += inst.items
+            group_owners |= owners
+            continue
+
+        if group_type is not None:
+            plan.append((Instruction(group_type, group_items, defer_triggers),
+                         group_owners))
+            group_type = None
+            group_items = []
+            group_owners = set()
+
+        if inst.type in DPKG_INSTRUCTIONS:
+            group_type = inst.type
+            group_items = list(inst.items)
+            group_owners = set(owners)
+        else:
+            plan.append((inst, owners))
+
+    if group_type is not None:
+        plan.append((Instruction(group_type, group_items, defer_triggers),
+                     group_owners))
+
+    return plan
+
+
+def _package_key(inst_type: InstructionType, item: str) -> tuple:
+    """Get the package name and architecture (None if not known) a item of a
+    dpkg instruction is for or None if the deb file can't be read.
+    """
+
+    if inst_type == InstructionType.DPKG_INSTALL:
+        try:
+            package = read_deb_control(item)
+        except (DpkgStatusError, OSError):
+            return None
+        return package.name, package.arch
+
+    name, _, arch = item.partition(":")
+    return name, arch or None
+
+
+def plan_batch(inst_lists: list, defer_triggers=True) -> tuple:
+    """Make one list of instructions to run from the instructions of several
+    update archives, in the order the update archives would be run.
+
+    First, package installs made pointless by a later update archive are
+    dropped, the same package is installed again in the same merged dpkg
+    call. Nothing is dropped across any other instruction (a bash script or
+    a dpkg remove or purge), as it could need the dropped version. Then the
+    instructions are merged like :func:`plan_instructions`.
+
+    Parameters
+    ----------
+    inst_lists: list
+        A list of Instructions for each update archive, oldest first.
+    defer_triggers: bool
+        Make the dpkg instructions defer their triggers.
+
+    Returns
+    -------
+    tuple
+        The list of Instructions to run and a list with the set of indexes of
+        the update archives each Instruction is for. A update archive is done
+        once all Instructions for it finished, including the ones that
+        replaced its dropped installs.
+    """
+
+    # [update archive index, type, items, owners]
+    entries = [[i, inst.type, list(inst.items), set([i])]
+               for i in range(len(inst_lists)) for inst in inst_lists[i]]
+
+    # package name: (entry, arch) of the next install of it in the same
+    # merged dpkg call
+    later = {}
+    for entry in reversed(entries):
+        index, inst_type, items, owners = entry
+
+        if inst_type == InstructionType.SUPPORT_FILE:
+            continue
+        if inst_type != InstructionType.DPKG_INSTALL:
+            later = {}
+            continue
+
+        for item in list(items):
+            key = _package_key(inst_type, item)
+            if key is None:
+                continue
+            name, arch = key
+
+            if name in later:
+                next_entry, next_arch = later[name]
+                if next_entry[0] > index and \
+                        (next_arch is None or next_arch == arch):
+                    items.remove(item)
+                    next_entry[3] |= owners
+                    continue
+
+            later[name] = (entry, arch)
+
+    tagged = [(Instruction(i[1], i[2]), i[3]) for i in entries
+              if len(i[2]) != 0]
+    plan = _plan(tagged, defer_triggers)
+    return [i[0] for i in plan], [i[1] for i in plan]
+
+
+def _is_satisfied(inst_type: InstructionType, item: str,
+                  dpkg_status: DpkgStatus) -> bool:
+    """Check if a item of a dpkg instruction is already done."""
+
+    if inst_type == InstructionType.DPKG_INSTALL:
+        try:
+            package = read_deb_control(item)
+        except (DpkgStatusError, OSError):
+            return False  # let dpkg report it
+        return dpkg_status.is_installed(package.name, package.version,
+                                        package.arch)
+
+    name, _, arch = item.partition(":")
+    if inst_type == InstructionType.DPKG_REMOVE:
+        return dpkg_status.is_removed(name, arch or None)
+    return dpkg_status.is_purged(name, arch or None)
+
+
+def remove_satisfied(inst: Instruction, dpkg_status: DpkgStatus) -> tuple:
+    """Remove the items of a dpkg instruction that are already done; deb files
+    with the exact package, version, and architecture already installed and
+    packages already removed or purged.
+
+    Parameters
+    ----------
+    inst: Instruction
+        The instruction.
+    dpkg_status: DpkgStatus
+        The dpkg status of the system.
+
+    Returns
+    -------
+    tuple
+        The instruction to run (the same instruction if nothing was removed)
+        or None if nothing is left to do and the list of items removed.
+    """
+
+    if inst.type not in DPKG_INSTRUCTIONS:
+        return inst, []
+
+    skipped = [i for i in inst.items
+               if _is_satisfied(inst.type, i, dpkg_status)]
+
+    if len(skipped) == 0:
+        return inst, []
+    if len(skipped) == len(inst.items):
+        return None, skipped
+
+    items = [i for i in inst.items if i not in skipped]
+    return Instruction(inst.type, items, inst.defer_triggers), skipped
+
+
+def run_pending_triggers(log: Logger, output=None):
+    """Run all pending dpkg triggers.
+
+    Parameters
+    ----------
+    log: logging.Logger
+        The logger to use to output stdin, stdout, stderr.
+    output: CommandOutput
+        Optional, counters to update while dpkg runs.
+
+    Raises
+    ------
+    InstructionError
+        dpkg failed.
+    """
+
+    run_bash_command(DPKG_TRIGGERS_COMMAND, log, output)
+
+
+def run_bash_command(command: str, log: Logger, output=None):
     """Run a bash command. All stdout message will be logged with info
     level and all stderr messages will be logged with error level.
 
+    The output is read in chunks of at most :data:`OUTPUT_CHUNK_SIZE` bytes
+    and logged line by line as it arrives, so it is never all held in memory.
+
     Parameters
     ----------
     command : str
         The bash command string to run.
     log: logging.Logger
         The logger to use to output stdin, stdout, stderr.
+    output: CommandOutput
+        Optional, counters to update while the command runs. The tail of the
+        output is added to the error message if the command fails.
 
     Raises
     ------
@@ -139,15 +460,52 @@ def run_bash_command(command: str, log: Logger) -> bool:
 
     log.info(command)
 
-    out = subprocess.run(command, capture_output=True, shell=True)
+    if output is None:
+        output = CommandOutput()
+
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, shell=True)
+
+    with selectors.DefaultSelector() as sel:
+        sel.register(proc.stdout, selectors.EVENT_READ, [log.info, b""])
+        sel.register(proc.stderr, selectors.EVENT_READ, [log.error, b""])
+
+        while len(sel.get_map()) != 0:
+            for key, _ in sel.select():
+                log_func, partial = key.data
+                chunk = read(key.fd, OUTPUT_CHUNK_SIZE)
+
+                if len(chunk) == 0:  # EOF
+                    _log_output(partial, log_func, output)
+                    sel.unregister(key.fileobj)
+                    continue
+
+                output._add_bytes(len(chunk))
+                lines = (partial + chunk).split(b"\n")
+                for line in lines[:-1]:
+                    _log_output(line, log_func, output)
+
+                # don't let a line without a newline grow forever
+                if len(lines[-1]) >= OUTPUT_CHUNK_SIZE:
+                    _log_output(lines[-1], log_func, output)
+                    lines[-1] = b""
+                key.data[1] = lines[-1]
+
+    proc.stdout.close()
+    proc.stderr.close()
+    returncode = proc.wait()
+
+    if returncode != 0:
+        msg = "Bash command failed with exit code {}!".format(returncode)
+        if len(output.tail) != 0:
+            msg += " Last output:\n" + "\n".join(output.tail)
+        raise InstructionError(msg)
 
-    if out.returncode != 0:
-        for line in out.stderr.decode("utf-8").split("\n"):
-            if len(line) != 0:
-                log.error(line)
 
-        raise InstructionError("Bash command failed!")
+def _log_output(line: bytes, log_func, output: CommandOutput):
+    """Log a line of output, if it is not empty."""
 
-    for line in out.stdout.decode("utf-8").split("\n"):
-        if len(line) != 0:
-            log.info(line)
+    if len(line) != 0:
+        line = line.decode("utf-8", errors="replace")
+        output._add_line(line)
+        log_func(line)
@@ -0,0 +1,189 @@
+"""
+Update Journal
+==============
+
+A small JSON file in the updater's working directory that records how far the
+update in the working directory got, so a update resumed after a power loss or
+reboot doesn't have to start from scratch.
+
+**Example journal**::
+
+    {
+        "update_archive": "gps_update_1612392143.tar.xz",
+        "extracted": true,
+        "completed": 3
+    }
+
+`completed` is the number of planned instructions (see
+:func:`oresat_linux_updater.instruction.plan_instructions`) that finished. The
+journal is replaced atomically and flushed to storage every time it is saved,
+so it is always either the old or the new journal.
+
+A batch of update archives run by UpdateAll has its merged plan (see
+:func:`oresat_linux_updater.instruction.plan_batch`) in the journal, as it
+can't be planned again once some of the update archives finished.
+
+**Example batch journal**::
+
+    {
+        "update_archive": "",
+        "extracted": true,
+        "completed": 1,
+        "batch": ["gps_update_1612392143.tar.xz",
+                  "star-tracker_update_1612392200.tar.xz"],
+        "plan": [
+            {
+                "type": "DPKG_INSTALL",
+                "items": ["/var/cache/oresat_linux_updater/work/0/a.deb",
+                          "/var/cache/oresat_linux_updater/work/1/b.deb"],
+                "defer_triggers": true,
+                "owners": [0, 1]
+            },
+            {
+                "type": "BASH_SCRIPT",
+                "items": ["/var/cache/oresat_linux_updater/work/1/c.sh"],
+                "defer_triggers": false,
+                "owners": [1]
+            }
+        ]
+    }
+"""
+
+import json
+from os import open as os_open, close, fsync, replace, O_RDONLY
+from os.path import dirname
+from oresat_linux_updater.instruction import Instruction, InstructionType, \
+        InstructionError
+
+JOURNAL_FILE = ".journal.json"
+"""The filename of the journal in the working directory."""
+
+
+def save_json(path: str, data):
+    """Atomically replace a JSON file and flush it to storage.
+
+    Parameters
+    ----------
+    path: str
+        Path to the file.
+    data
+        Anything that can be converted to JSON.
+    """
+
+    with open(path + ".tmp", "w") as fptr:
+        fptr.write(json.dumps(data))
+        fptr.flush()
+        fsync(fptr.fileno())
+    replace(path + ".tmp", path)
+
+    # flush the rename
+    fd = os_open(dirname(path) or ".", O_RDONLY)
+    try:
+        fsync(fd)
+    finally:
+        close(fd)
+
+
+class UpdateJournal():
+    """The progress of the update in the working directory."""
+
+    def __init__(self, path: str, update_archive: str, extracted=False,
+                 completed=0, batch=None, plan=None, owners=None):
+        """
+        Parameters
+        ----------
+        path: str
+            Path to the journal file.
+        update_archive: str
+            Filename of the update archive the journal is for, a empty str for
+            a batch.
+        extracted: bool
+            Flag if the update archive was fully extracted and verified.
+        completed: int
+            The number of planned instructions that finished.
+        batch: list
+            The filenames of the update archives in the batch, oldest first,
+            or None if the journal is for one update archive.
+        plan: list
+            The planned :class:`Instruction` of the batch.
+        owners: list
+            The set of indexes into batch of the update archives each planned
+            instruction of the batch is for.
+        """
+
+        self._path = path
+        self.update_archive = update_archive
+        self.extracted = extracted
+        self.completed = completed
+        self.batch = batch
+        self.plan = plan
+        self.owners = owners
+
+    def __repr__(self):
+        return "{}: {} {} {}".format(self.__class__.__name__,
+                                     self.update_archive or self.batch,
+                                     self.extracted, self.completed)
+
+    @classmethod
+    def load(cls, path: str):
+        """Load a journal.
+
+        Parameters
+        ----------
+        path: str
+            Path to the journal file.
+
+        Returns
+        -------
+        UpdateJournal
+            The journal or None if it is missing or invalid.
+        """
+
+        try:
+            with open(path, "r") as fptr:
+                data = json.load(fptr)
+        except (OSError, json.JSONDecodeError, UnicodeDecodeError):
+            return None
+
+        if not isinstance(data, dict) or \
+                not isinstance(data.get("update_archive"), str) or \
+                not isinstance(data.get("extracted"), bool) or \
+                not isinstance(data.get("completed"), int) or \
+                data["completed"] < 0:
+            return None
+
+        batch = data.get("batch")
+        plan = None
+        owners = None
+        if batch is not None:
+            try:
+                batch = [str(i) for i in batch]
+                plan = [Instruction(InstructionType[i["type"]],
+                                    [str(j) for j in i["items"]],
+                                    bool(i["defer_triggers"]))
+                        for i in data["plan"]]
+                owners = [set([int(j) for j in i["owners"]])
+                          for i in data["plan"]]
+            except (TypeError, KeyError, ValueError, InstructionError):
+                return None
+
+        return cls(path, data["update_archive"], data["extracted"],
+                   data["completed"], batch, plan, owners)
+
+    def save(self):
+        """Atomically replace the journal file and flush it to storage."""
+
+        data = {
+            "update_archive": self.update_archive,
+            "extracted": self.extracted,
+            "completed": self.completed,
+        }
+        if self.batch is not None:
+            data["batch"] = self.batch
+            data["plan"] = [{"type": self.plan[i].type.name,
+                             "items": self.plan[i].items,
+                             "defer_triggers": self.plan[i].defer_triggers,
+                             "owners": sorted(self.owners[i])}
+                            for i in range(len(self.plan))]
+
+        save_json(self._path, data)
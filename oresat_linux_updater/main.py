@@ -15,6 +15,9 @@ from oresat_linux_updater.dbus_server import DBusServer, DBUS_INTERFACE_NAME
 
 CACHE_DIR = "/var/cache/oresat_linux_updater/"
 WORK_DIR = "/var/lib/oresat_linux_updater/"
+STATUS_DIR = "/var/lib/oresat_linux_updater_status/"
+STAGE_DIR = "/var/lib/oresat_linux_updater_stage/"
+UPLOAD_DIR = "/var/cache/oresat_linux_updater_upload/"
 
 
 def _daemonize(pid_file: str):
@@ -84,6 +87,20 @@ def main():
     parser.add_argument("-c", "--cache-dir", dest="cache_dir",
                         default=CACHE_DIR,
                         help="override the update archive cache directory")
+    parser.add_argument("--status-dir", dest="status_dir",
+                        default=STATUS_DIR,
+                        help="override the dpkg status snapshot directory")
+    parser.add_argument("--stage-dir", dest="stage_dir",
+                        default=STAGE_DIR,
+                        help="override the directory the next update archive "
+                        "is extracted into in the background")
+    parser.add_argument("--upload-dir", dest="upload_dir",
+                        default=UPLOAD_DIR,
+                        help="override the directory update archives being "
+                        "uploaded in parts are kept in")
+    parser.add_argument("-s", "--streaming", action="store_true",
+                        help="run instructions while the update archive is "
+                        "still being extracted")
     args = parser.parse_args()
 
     if args.daemon:
@@ -103,7 +120,8 @@ def main():
     log = logging.getLogger('oresat-linux-updater')
 
     # make updater
-    updater = DBusServer(args.work_dir, args.cache_dir, log)
+    updater = DBusServer(args.work_dir, args.cache_dir, log, args.streaming,
+                         args.status_dir, args.stage_dir, args.upload_dir)
 
     # set up dbus wrapper
     bus = SystemBus()
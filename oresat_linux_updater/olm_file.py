@@ -1,8 +1,24 @@
 """Fallow the file format for the OreSat Linux Manager."""
 
-from os import uname
-from os.path import basename
+from os import uname, listdir
 from time import time
+from operator import attrgetter
+from oresat_linux_updater.codec import codec_from_extension
+
+
+def _parse(name: str) -> tuple:
+    """Split a OLM filename into its board, keyword, date, and extension in
+    one pass.
+    """
+
+    board, sep, rest = name.partition("_")
+    keyword, sep2, rest = rest.partition("_")
+    date, dot, ext = rest.partition(".")
+
+    if not sep or not sep2 or not date.isdigit():
+        raise ValueError(name + " does not follow the OLM filename standards")
+
+    return board, keyword, int(date), dot + ext
 
 
 class OLMFile():
@@ -11,9 +27,14 @@ class OLMFile():
     Can be used in list to sort a list of files following the
     oresat-linux-manager (OLM) filename standards. When used in a sorted list,
     the list will be order newest to oldest, so list.pop() can be used to get
-    the oldest file in the list.
+    the oldest file in the list. Files with the same date are ordered by
+    name. Two OLMFile objects are equal if they have the same filename, so
+    they can be used in sets and as dictionary keys.
     """
 
+    __slots__ = ("_name", "_board", "_keyword", "_date", "_extension",
+                 "_key")
+
     def __init__(self, load=None, board=None, keyword=None, ext=".txt"):
         """
         Parameters
@@ -35,33 +56,27 @@ class OLMFile():
         Raises
         ------
         ValueError
-            If load and keyword are both set.
-        FileNotFoundError
-            If load is set to an invalid filepath.
+            If load and keyword are both set or the filename of load does not
+            follow the OLM filename standards.
         """
         if load is not None and keyword is not None:
             raise ValueError("Can't load a file and make a new file")
 
         if load is not None:  # load file
-            self._name = basename(load)
-
-            self._board = self.name.split("_")[0]
-            self._keyword = self.name.split("_")[1]
-
-            temp = self.name.split("_")[2]
-
-            self._date = int(temp.split(".")[0])
-            self._extension = temp[temp.find("."):]
+            self._name = load.rpartition("/")[2]
+            self._board, self._keyword, self._date, self._extension = \
+                _parse(self._name)
+            self._key = (self._date, self._name)
         elif keyword is not None:  # hold data for new file
             if board is None:
                 board = uname()[1]
-            else:
-                self._board = board
 
+            self._board = board
             self._keyword = keyword
             self._date = int(time())
             self._extension = ext
             self._name = board + "_" + keyword + "_" + str(self._date) + ext
+            self._key = (self._date, self._name)
 
     def __repr__(self):
         return "{} {}".format(self.__class__.__name__, self._name)
@@ -69,11 +84,40 @@ class OLMFile():
     def __str__(self):
         return self._name
 
-    def __lt__(self, archive_file2):
-        return archive_file2.date < self._date
-
-    def __gt__(self, archive_file2):
-        return archive_file2.date > self._date
+    # compared by their (date, name) key in reverse, so sorted lists are
+    # newest first
+
+    def __eq__(self, other):
+        if not isinstance(other, OLMFile):
+            return NotImplemented
+        return self._name == other._name
+
+    def __hash__(self):
+        return hash(self._name)
+
+    def __lt__(self, other):
+        try:
+            return other._key < self._key
+        except AttributeError:
+            return NotImplemented
+
+    def __le__(self, other):
+        try:
+            return other._key <= self._key
+        except AttributeError:
+            return NotImplemented
+
+    def __gt__(self, other):
+        try:
+            return other._key > self._key
+        except AttributeError:
+            return NotImplemented
+
+    def __ge__(self, other):
+        try:
+            return other._key >= self._key
+        except AttributeError:
+            return NotImplemented
 
     @property
     def name(self) -> str:
@@ -102,3 +146,49 @@ class OLMFile():
     def extension(self) -> str:
         """str: The file extension."""
         return self._extension
+
+    @property
+    def codec(self):
+        """Codec: The compression codec for the file extension or None if the
+        file is not a archive.
+        """
+        return codec_from_extension(self._extension)
+
+
+def scan_dir(path: str, keyword=None, board=None) -> list:
+    """Get all the files in a directory that follow the OLM filename
+    standards. Hidden files and files that don't follow the standards are
+    skipped.
+
+    Parameters
+    ----------
+    path: str
+        Path to the directory.
+    keyword: str
+        Optional, only get files with this keyword.
+    board: str
+        Optional, only get files for or from this board.
+
+    Returns
+    -------
+    list
+        The OLMFile objects, newest to oldest like a sorted list of OLMFile.
+    """
+
+    files = []
+
+    for name in listdir(path):
+        if name.startswith("."):
+            continue
+
+        try:
+            file = OLMFile(load=name)
+        except ValueError:
+            continue
+
+        if (keyword is None or file._keyword == keyword) and \
+                (board is None or file._board == board):
+            files.append(file)
+
+    files.sort(key=attrgetter("_key"), reverse=True)
+    return files
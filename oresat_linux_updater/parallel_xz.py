@@ -0,0 +1,418 @@
+"""Multi-process, block based xz compression.
+
+The input is split into fixed size blocks that are compressed independently on
+a process pool and written as one standard multi-block .xz stream (the same
+format :code:`xz -T0` makes), so any xz decoder, including Python's lzma
+module used by the daemon, can read it.
+
+As each block is independent, the block index at the end of the stream (see
+:func:`read_xz_index`) can be used to decompress any block on its own (see
+:func:`read_xz_block`) or to decompress blocks in parallel.
+"""
+
+import lzma
+import struct
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count
+from zlib import crc32
+
+XZ_MAGIC = b"\xfd7zXZ\x00"
+"""The magic bytes at the start of every xz stream."""
+
+XZ_FOOTER_MAGIC = b"YZ"
+"""The magic bytes at the end of every xz stream."""
+
+BLOCK_SIZE = 24 * 1024 * 1024
+"""The default uncompressed block size. Same as :code:`xz -T` with the default
+preset (3 times the 8 MiB dictionary).
+"""
+
+_HEADER_SIZE = 12
+_FOOTER_SIZE = 12
+_CHECK_SIZES = {lzma.CHECK_NONE: 0, lzma.CHECK_CRC32: 4,
+                lzma.CHECK_CRC64: 8, lzma.CHECK_SHA256: 32}
+
+
+class XZError(Exception):
+    """Invalid or unsupported xz file."""
+
+
+class XZBlock():
+    """The location of a block in a xz file."""
+
+    __slots__ = ["compressed_offset", "compressed_size",
+                 "uncompressed_offset", "uncompressed_size",
+                 "unpadded_size", "check"]
+
+    def __init__(self, compressed_offset: int, unpadded_size: int,
+                 uncompressed_offset: int, uncompressed_size: int,
+                 check: int):
+        """
+        Parameters
+        ----------
+        compressed_offset: int
+            The offset of the block in the xz file.
+        unpadded_size: int
+            The size of the block without its padding.
+        uncompressed_offset: int
+            The offset of the block's data in the uncompressed data.
+        uncompressed_size: int
+            The size of the block's data uncompressed.
+        check: int
+            The lzma check type the block's stream uses.
+        """
+
+        self.compressed_offset = compressed_offset
+        self.compressed_size = _pad4(unpadded_size)
+        self.uncompressed_offset = uncompressed_offset
+        self.uncompressed_size = uncompressed_size
+        self.unpadded_size = unpadded_size
+        self.check = check
+
+    def __repr__(self):
+        return "{} {}+{}".format(self.__class__.__name__,
+                                 self.uncompressed_offset,
+                                 self.uncompressed_size)
+
+
+def _pad4(size: int) -> int:
+    """Round up to a multiple of 4."""
+
+    return (size + 3) & ~3
+
+
+def _encode_varint(value: int) -> bytes:
+    """Encode a xz multibyte integer."""
+
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _decode_varint(data: bytes, pos: int) -> tuple:
+    """Decode a xz multibyte integer. Returns the value and the new
+    position.
+    """
+
+    value = 0
+    shift = 0
+    while True:
+        if pos >= len(data) or shift > 63:
+            raise XZError("invalid multibyte integer")
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if byte & 0x80 == 0:
+            return value, pos
+
+
+def _stream_flags(check: int) -> bytes:
+    return bytes([0, check])
+
+
+def _stream_header(check: int) -> bytes:
+    flags = _stream_flags(check)
+    return XZ_MAGIC + flags + struct.pack("<I", crc32(flags))
+
+
+def _stream_index(records: list) -> bytes:
+    """Make a stream index from a list of (unpadded size, uncompressed size)
+    records.
+    """
+
+    index = bytearray(b"\x00" + _encode_varint(len(records)))
+    for unpadded, uncompressed in records:
+        index += _encode_varint(unpadded) + _encode_varint(uncompressed)
+    index += bytes(_pad4(len(index)) - len(index))
+    return bytes(index) + struct.pack("<I", crc32(index))
+
+
+def _stream_footer(check: int, index_size: int) -> bytes:
+    data = struct.pack("<I", index_size // 4 - 1) + _stream_flags(check)
+    return struct.pack("<I", crc32(data)) + data + XZ_FOOTER_MAGIC
+
+
+def _parse_footer(footer: bytes) -> tuple:
+    """Parse a stream footer. Returns the index size and the check type."""
+
+    if len(footer) != _FOOTER_SIZE or footer[10:] != XZ_FOOTER_MAGIC:
+        raise XZError("invalid stream footer")
+    if struct.unpack("<I", footer[:4])[0] != crc32(footer[4:10]):
+        raise XZError("invalid stream footer CRC32")
+
+    index_size = (struct.unpack("<I", footer[4:8])[0] + 1) * 4
+    check = footer[9] & 0x0f
+    if footer[8] != 0 or check not in _CHECK_SIZES:
+        raise XZError("unsupported stream flags")
+
+    return index_size, check
+
+
+def _parse_index(index: bytes) -> list:
+    """Parse a stream index. Returns a list of (unpadded size, uncompressed
+    size) records.
+    """
+
+    if len(index) < 8 or index[0] != 0:
+        raise XZError("invalid index")
+    if struct.unpack("<I", index[-4:])[0] != crc32(index[:-4]):
+        raise XZError("invalid index CRC32")
+
+    records = []
+    count, pos = _decode_varint(index, 1)
+    for _ in range(count):
+        unpadded, pos = _decode_varint(index, pos)
+        uncompressed, pos = _decode_varint(index, pos)
+        records.append((unpadded, uncompressed))
+
+    return records
+
+
+def _compress_block(data: bytes, preset: int, check: int) -> tuple:
+    """Compress one block. Runs in the process pool.
+
+    Returns
+    -------
+    tuple
+        The raw block (with padding), its unpadded size, and its uncompressed
+        size.
+    """
+
+    stream = lzma.compress(data, format=lzma.FORMAT_XZ, check=check,
+                           preset=preset)
+    index_size, _ = _parse_footer(stream[-_FOOTER_SIZE:])
+    index_start = len(stream) - _FOOTER_SIZE - index_size
+    records = _parse_index(stream[index_start:-_FOOTER_SIZE])
+
+    if len(records) != 1:
+        raise XZError("expected 1 block, got {}".format(len(records)))
+
+    unpadded, uncompressed = records[0]
+    block = stream[_HEADER_SIZE:_HEADER_SIZE + _pad4(unpadded)]
+    return block, unpadded, uncompressed
+
+
+class ParallelXZWriter():
+    """A write-only file object that compresses everything written to it into
+    a multi-block xz file using a process pool.
+
+    Can be used as the fileobj of a :code:`tarfile.open(mode="w|")`.
+    """
+
+    def __init__(self, path: str, jobs=None, block_size=BLOCK_SIZE,
+                 preset=lzma.PRESET_DEFAULT, check=lzma.CHECK_CRC64):
+        """
+        Parameters
+        ----------
+        path: str
+            Path to the xz file to make.
+        jobs: int
+            Number of processes to compress with. If not set, the number of
+            cpus will be used.
+        block_size: int
+            The uncompressed size of each block.
+        preset: int
+            The xz compression preset.
+        check: int
+            The lzma integrity check type.
+        """
+
+        if block_size <= 0:
+            raise ValueError("block_size must be positive")
+
+        self._jobs = jobs if jobs is not None else cpu_count() or 1
+        self._block_size = block_size
+        self._preset = preset
+        self._check = check
+        self._buffer = bytearray()
+        self._records = []
+        self._pending = deque()
+        self._closed = False
+        self._executor = ProcessPoolExecutor(max_workers=self._jobs)
+        self._fptr = open(path, "wb")
+        self._fptr.write(_stream_header(check))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _submit(self, data: bytes):
+        """Queue a block for compression, writing finished blocks out in order
+        so at most 2 blocks per process are held in memory.
+        """
+
+        future = self._executor.submit(_compress_block, data, self._preset,
+                                       self._check)
+        self._pending.append(future)
+
+        while len(self._pending) > self._jobs * 2:
+            self._write_block(self._pending.popleft())
+
+    def _write_block(self, future):
+        block, unpadded, uncompressed = future.result()
+        self._fptr.write(block)
+        self._records.append((unpadded, uncompressed))
+
+    def write(self, data: bytes) -> int:
+        """Write uncompressed data.
+
+        Parameters
+        ----------
+        data: bytes
+            The data to compress.
+
+        Returns
+        -------
+        int
+            The number of bytes written.
+        """
+
+        if self._closed:
+            raise ValueError("write to closed file")
+
+        self._buffer += data
+        while len(self._buffer) >= self._block_size:
+            self._submit(bytes(self._buffer[:self._block_size]))
+            del self._buffer[:self._block_size]
+
+        return len(data)
+
+    def close(self):
+        """Compress the remaining data, write the index and close the file."""
+
+        if self._closed:
+            return
+        self._closed = True
+
+        try:
+            if len(self._buffer) != 0:
+                self._submit(bytes(self._buffer))
+                self._buffer = bytearray()
+
+            while len(self._pending) != 0:
+                self._write_block(self._pending.popleft())
+
+            index = _stream_index(self._records)
+            self._fptr.write(index)
+            self._fptr.write(_stream_footer(self._check, len(index)))
+        finally:
+            self._executor.shutdown()
+            self._fptr.close()
+
+    @property
+    def blocks(self) -> int:
+        """int: The number of blocks written so far."""
+
+        return len(self._records)
+
+
+def read_xz_index(path: str) -> list:
+    """Read the block index of a xz file, without decompressing it. Only the
+    stream footers and indexes are read. Concatenated streams and stream
+    padding are supported.
+
+    Parameters
+    ----------
+    path: str
+        Path to the xz file.
+
+    Raises
+    ------
+    XZError
+        Invalid xz file.
+
+    Returns
+    -------
+    list
+        A list of :class:`XZBlock` in file order.
+    """
+
+    streams = []
+
+    with open(path, "rb") as fptr:
+        pos = fptr.seek(0, 2)
+
+        while pos > 0:
+            if pos < _HEADER_SIZE + _FOOTER_SIZE:
+                raise XZError("truncated xz file")
+
+            fptr.seek(pos - _FOOTER_SIZE)
+            footer = fptr.read(_FOOTER_SIZE)
+
+            if footer[8:] == b"\x00\x00\x00\x00":  # stream padding
+                pos -= 4
+                continue
+
+            index_size, check = _parse_footer(footer)
+            index_start = pos - _FOOTER_SIZE - index_size
+            if index_start < _HEADER_SIZE:
+                raise XZError("invalid index size")
+
+            fptr.seek(index_start)
+            records = _parse_index(fptr.read(index_size))
+
+            blocks_size = sum(_pad4(i[0]) for i in records)
+            stream_start = index_start - blocks_size - _HEADER_SIZE
+            if stream_start < 0:
+                raise XZError("invalid index")
+
+            fptr.seek(stream_start)
+            if fptr.read(_HEADER_SIZE) != _stream_header(check):
+                raise XZError("invalid stream header")
+
+            streams.append((stream_start + _HEADER_SIZE, records, check))
+            pos = stream_start
+
+    blocks = []
+    uncompressed_offset = 0
+    for offset, records, check in reversed(streams):
+        for unpadded, uncompressed in records:
+            blocks.append(XZBlock(offset, unpadded, uncompressed_offset,
+                                  uncompressed, check))
+            offset += _pad4(unpadded)
+            uncompressed_offset += uncompressed
+
+    return blocks
+
+
+def read_xz_block(path: str, block: XZBlock) -> bytes:
+    """Decompress one block of a xz file.
+
+    Parameters
+    ----------
+    path: str
+        Path to the xz file.
+    block: XZBlock
+        The block to decompress, from :func:`read_xz_index`.
+
+    Raises
+    ------
+    XZError
+        Invalid block.
+
+    Returns
+    -------
+    bytes
+        The uncompressed data of the block.
+    """
+
+    with open(path, "rb") as fptr:
+        fptr.seek(block.compressed_offset)
+        raw = fptr.read(block.compressed_size)
+
+    # wrap the block in its own stream, so lzma can decode it
+    index = _stream_index([(block.unpadded_size, block.uncompressed_size)])
+    stream = _stream_header(block.check) + raw + index + \
+        _stream_footer(block.check, len(index))
+
+    try:
+        return lzma.decompress(stream, format=lzma.FORMAT_XZ)
+    except lzma.LZMAError as exc:
+        raise XZError(str(exc))
@@ -0,0 +1,208 @@
+"""
+Pre-flight Check
+================
+
+Checks the deb files of a update before the critical section, so a corrupt or
+mismatched deb file fails the update before anything on the board changed,
+instead of when dpkg is run.
+
+The control file of every deb file the planned instructions install is read
+on a thread pool (see :func:`read_deb_files`), without running dpkg-deb.
+Then the planned instructions are simulated in order against the unpacked
+packages from the dpkg status file, installed or with their files on disk but
+not fully configured (e.g. triggers still pending after a update with
+deferred triggers). A deb file fails the check if:
+
+- it is not a valid deb file or has no valid control file
+- its package name is invalid
+- its architecture is not "all" or one of the architectures dpkg allows
+- a group of its Depends or Pre-Depends is not satisfied by a installed
+  package or a package installed by the same or a earlier instruction
+- a version it depends on, or of a package it depends on, is not a valid
+  Debian version
+
+Virtual packages (from Provides) satisfy any version and stay provided once
+installed. Bash scripts are assumed to not change any packages.
+"""
+
+import re
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from os import cpu_count
+from oresat_linux_updater.instruction import InstructionType
+from oresat_linux_updater.dpkg_status import DpkgStatusError, \
+        DpkgVersionError, read_deb_fields, parse_relations, version_satisfies
+
+PREFLIGHT_THREADS = min(8, cpu_count() or 1)
+"""The default number of threads used to read deb files."""
+
+_PACKAGE_NAME = re.compile(r"[a-z0-9][a-z0-9+.-]+$")
+"""Valid package names, from the Debian Policy Manual."""
+
+_DEPENDS_FIELDS = ["Pre-Depends", "Depends"]
+
+
+class PreflightError(Exception):
+    """A planned instruction would fail."""
+
+    def __init__(self, msg: str, index: int):
+        """
+        Parameters
+        ----------
+        msg: str
+            What would fail.
+        index: int
+            The index of the planned instruction that would fail.
+        """
+
+        super().__init__(msg)
+        self.index = index
+
+
+def dpkg_architectures() -> list:
+    """Get the architectures dpkg allows, the native one first.
+
+    Returns
+    -------
+    list
+        The architectures or None if dpkg could not be run.
+    """
+
+    archs = []
+
+    for option in ["--print-architecture", "--print-foreign-architectures"]:
+        try:
+            out = subprocess.run(["dpkg", option], stdout=subprocess.PIPE,
+                                 stderr=subprocess.DEVNULL, check=True)
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        archs += out.stdout.decode("utf-8", errors="replace").split()
+
+    return archs
+
+
+def _read_deb(path: str):
+    try:
+        return read_deb_fields(path)
+    except (DpkgStatusError, OSError) as exc:
+        return exc
+
+
+def read_deb_files(paths: list, threads=PREFLIGHT_THREADS) -> dict:
+    """Read the control files of deb files in parallel.
+
+    Parameters
+    ----------
+    paths: list
+        Paths to the deb files.
+    threads: int
+        The number of threads to use.
+
+    Returns
+    -------
+    dict
+        The fields of each deb file (see :func:`read_deb_fields`) by path, or
+        the exception raised if it could not be read.
+    """
+
+    paths = list(dict.fromkeys(paths))  # no duplicates, keep the order
+    if len(paths) <= 1 or threads <= 1:
+        return {i: _read_deb(i) for i in paths}
+
+    with ThreadPoolExecutor(max_workers=min(threads, len(paths))) as pool:
+        return dict(zip(paths, pool.map(_read_deb, paths)))
+
+
+def _satisfied(group: list, installed: dict, virtual: set) -> bool:
+    """Check if any alternative in a group of a Depends field is installed."""
+
+    for name, operator, version in group:
+        if name in virtual or (name in installed and version_satisfies(
+                installed[name], operator, version)):
+            return True
+
+    return False
+
+
+def check_plan(inst_list: list, dpkg_status, archs=None,
+               threads=PREFLIGHT_THREADS) -> int:
+    """Check the deb files of planned instructions before running them.
+
+    Parameters
+    ----------
+    inst_list: list
+        The list of planned :class:`Instruction`, with the paths to the
+        extracted deb files.
+    dpkg_status: DpkgStatus
+        The unpacked packages and the virtual packages they provide.
+    archs: list
+        The architectures dpkg allows (see :func:`dpkg_architectures`). If
+        None, architectures are not checked.
+    threads: int
+        The number of threads used to read the deb files.
+
+    Raises
+    ------
+    PreflightError
+        A planned instruction would fail.
+
+    Returns
+    -------
+    int
+        The number of deb files checked.
+    """
+
+    debs = read_deb_files([j for i in inst_list
+                           if i.type == InstructionType.DPKG_INSTALL
+                           for j in i.items], threads)
+
+    installed = {i.name: i.version for i in dpkg_status if i.unpacked}
+    virtual = set(dpkg_status.provides)
+    allowed = None if archs is None else set(archs) | {"all"}
+
+    for index in range(len(inst_list)):
+        inst = inst_list[index]
+
+        if inst.type in [InstructionType.DPKG_REMOVE,
+                         InstructionType.DPKG_PURGE]:
+            for name in inst.items:
+                installed.pop(name.partition(":")[0], None)
+            continue
+        elif inst.type != InstructionType.DPKG_INSTALL:
+            continue
+
+        # dpkg unpacks all packages in a call before configuring them, so
+        # they can depend on each other
+        fields = []
+        for path in inst.items:
+            deb = debs[path]
+            if isinstance(deb, Exception):
+                raise PreflightError(str(deb), index)
+
+            if _PACKAGE_NAME.match(deb["Package"]) is None:
+                raise PreflightError("invalid package name {} in {}".format(
+                    deb["Package"], path), index)
+
+            arch = deb.get("Architecture", "")
+            if allowed is not None and arch not in allowed:
+                raise PreflightError("{} is for architecture {}".format(
+                    path, arch or "none"), index)
+
+            installed[deb["Package"]] = deb["Version"]
+            for group in parse_relations(deb.get("Provides", "")):
+                virtual.update([i[0] for i in group])
+            fields.append((path, deb))
+
+        for path, deb in fields:
+            for key in _DEPENDS_FIELDS:
+                for group in parse_relations(deb.get(key, "")):
+                    try:
+                        satisfied = _satisfied(group, installed, virtual)
+                    except DpkgVersionError as exc:
+                        raise PreflightError("{}: {}".format(path, exc),
+                                             index)
+                    if not satisfied:
+                        raise PreflightError("{} depends on {}".format(
+                            path, " | ".join(i[0] for i in group)), index)
+
+    return len(debs)
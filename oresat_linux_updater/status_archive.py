@@ -1,18 +1,351 @@
-"""File for creating status archive or existing files from staus archives."""
+"""File for creating status archive or existing files from staus archives.
+
+If a status directory is given to :func:`make_status_archive`, a snapshot of
+the dpkg status file is kept for each status archive made. Once the ground
+station acknowledges a status archive (see :func:`acknowledge_status_archive`),
+its snapshot becomes the base and all following status archives only contain a
+delta, the packages added, changed or removed since the base.
+
+:class:`StatusArchiveCache` can be used to reuse the last status archive made
+while nothing in it has changed.
+"""
 
 import json
+import hashlib
 import tarfile
-from os import listdir, remove
-from os.path import basename, isfile, isdir
+from io import BytesIO
+from time import time
+from os import listdir, remove, replace, stat, fsync, close, O_RDONLY
+from os import open as os_open
+from os.path import basename, isfile, isdir, getsize
+from pathlib import Path
+from threading import Lock
 from oresat_linux_updater.olm_file import OLMFile
+from oresat_linux_updater.dpkg_status import DpkgStatus, DPKG_STATUS_FILE
+from oresat_linux_updater.codec import DEFAULT_CODEC, get_codec, open_archive
 
 OLU_STATUS_KEYWORD = "olu-status"
 DPKG_STATUS_KEYWORD = "dpkg-status"
-DPKG_STATUS_FILE = "/var/lib/dpkg/status"
+DPKG_STATUS_DELTA_KEYWORD = "dpkg-status-delta"
+STATUS_ARCHIVE_DIR = "/tmp/"
+"""The default directory to make status archives in."""
+STATUS_ARCHIVES_MAX_SIZE = 2 * 1024 * 1024
+"""The default max size of all status archives kept by
+:class:`StatusArchiveCache`.
+"""
+SNAPSHOT_EXT = ".dpkg-status"
+BASE_SNAPSHOT = "base" + SNAPSHOT_EXT
+"""The acknowledged dpkg status snapshot in the status directory."""
+MAX_PENDING_SNAPSHOTS = 8
+"""Max number of snapshots waiting to be acknowledged to keep."""
+
+
+def _split_dpkg_status(content: str) -> dict:
+    """Split a dpkg status file into its package stanzas.
+
+    Parameters
+    ----------
+    content: str
+        The contents of a dpkg status file.
+
+    Returns
+    -------
+    dict
+        The stanzas by "package:architecture".
+    """
+
+    stanzas = {}
+
+    for stanza in content.split("\n\n"):
+        stanza = stanza.strip("\n")
+        if stanza == "":
+            continue
+
+        package = ""
+        arch = ""
+        for line in stanza.split("\n"):
+            if line.startswith("Package:"):
+                package = line[8:].strip()
+            elif line.startswith("Architecture:"):
+                arch = line[13:].strip()
+
+        stanzas[package + ":" + arch] = stanza
+
+    return stanzas
+
+
+def _join_dpkg_status(stanzas: dict) -> str:
+    """Join package stanzas back into a dpkg status file, sorted by package.
+    """
+
+    return "".join(stanzas[i] + "\n\n" for i in sorted(stanzas))
+
+
+def _status_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def make_dpkg_status_delta(base: str, target: str) -> dict:
+    """Make a delta between two dpkg status files.
+
+    Parameters
+    ----------
+    base: str
+        The contents of the base dpkg status file.
+    target: str
+        The contents of the new dpkg status file.
+
+    Returns
+    -------
+    dict
+        The delta. The sha256 of the normalized base and target status files
+        and the packages stanzas changed (or added) and removed.
+    """
+
+    base = _split_dpkg_status(base)
+    target = _split_dpkg_status(target)
+
+    return {
+        "base": _status_hash(_join_dpkg_status(base)),
+        "target": _status_hash(_join_dpkg_status(target)),
+        "changed": {k: v for k, v in target.items() if base.get(k) != v},
+        "removed": sorted(k for k in base if k not in target),
+    }
+
+
+def apply_dpkg_status_delta(base: str, delta: dict) -> str:
+    """Rebuild a dpkg status file from its base and a delta.
+
+    Parameters
+    ----------
+    base: str
+        The contents of the base dpkg status file.
+    delta: dict
+        The delta from :func:`make_dpkg_status_delta`.
+
+    Raises
+    ------
+    ValueError
+        The delta is not for the base or the result is not the target.
+
+    Returns
+    -------
+    str
+        The normalized contents of the new dpkg status file.
+    """
+
+    stanzas = _split_dpkg_status(base)
+    if _status_hash(_join_dpkg_status(stanzas)) != delta["base"]:
+        raise ValueError("dpkg status delta is not for the base")
+
+    for i in delta["removed"]:
+        stanzas.pop(i, None)
+    stanzas.update(delta["changed"])
+
+    content = _join_dpkg_status(stanzas)
+    if _status_hash(content) != delta["target"]:
+        raise ValueError("rebuilt dpkg status does not match the delta")
+
+    return content
+
+
+class StatusArchive():
+    """A status archive from a board.
+
+    The archive is only opened and decompressed once, the first time a member
+    is needed, and all the status members are read in one pass. The decoded
+    contents are cached, so all properties can be used many times.
+    """
+
+    def __init__(self, path: str):
+        """
+        Parameters
+        ----------
+        path: str
+            Path to the status archive.
+        """
+
+        self._path = path
+        self._members = None
+        self._olu_status = None
+        self._dpkg_status_delta = None
+
+    def __repr__(self):
+        return "{} {}".format(self.__class__.__name__, basename(self._path))
+
+    def _read(self, keyword: str) -> bytes:
+        """Get the raw contents of a member by its keyword, the archive is
+        read on the first call.
+
+        Raises
+        ------
+        FileNotFoundError
+            Missing the member.
+        """
+
+        if self._members is None:
+            members = {}
+            with open_archive(self._path, "r|") as tar:
+                for i in tar:
+                    try:
+                        member_keyword = OLMFile(load=i.name).keyword
+                    except (ValueError, IndexError):
+                        continue  # not a OLM file
+
+                    if i.isfile() and member_keyword in [
+                            OLU_STATUS_KEYWORD, DPKG_STATUS_KEYWORD,
+                            DPKG_STATUS_DELTA_KEYWORD]:
+                        members[member_keyword] = tar.extractfile(i).read()
+            self._members = members
+
+        if keyword not in self._members:
+            raise FileNotFoundError("missing {} file in {}".format(
+                keyword, self._path))
+
+        return self._members[keyword]
+
+    def _has(self, keyword: str) -> bool:
+        try:
+            self._read(keyword)
+        except FileNotFoundError:
+            return False
+        return True
+
+    @property
+    def path(self) -> str:
+        """str: Path to the status archive. Readonly."""
+
+        return self._path
+
+    @property
+    def olu_status(self) -> str:
+        """str: The contents of the olu status file. Readonly.
+
+        Raises FileNotFoundError if missing.
+        """
+
+        if self._olu_status is None:
+            self._olu_status = self._read(OLU_STATUS_KEYWORD).decode("utf-8")
+        return self._olu_status
+
+    @property
+    def update_archives(self) -> list:
+        """list: The filenames of the update archives that were in the
+        board's cache. Readonly.
+
+        Raises FileNotFoundError if the olu status file is missing.
+        """
+
+        return json.loads(self.olu_status) or []
+
+    @property
+    def has_dpkg_status(self) -> bool:
+        """bool: Flag if the status archive has the full dpkg status file.
+        Readonly.
+        """
+
+        return self._has(DPKG_STATUS_KEYWORD)
+
+    @property
+    def dpkg_status_delta(self) -> dict:
+        """dict: The dpkg status delta or None if the status archive does not
+        have one. Readonly.
+        """
+
+        if self._dpkg_status_delta is None and \
+                self._has(DPKG_STATUS_DELTA_KEYWORD):
+            self._dpkg_status_delta = \
+                json.loads(self._read(DPKG_STATUS_DELTA_KEYWORD))
+        return self._dpkg_status_delta
+
+    def dpkg_status(self, bases=None) -> str:
+        """Get the contents of the dpkg status file.
+
+        If the status archive only has a dpkg status delta, the full dpkg
+        status file is rebuilt from the chain of deltas back to a status
+        archive with the full dpkg status file.
+
+        Parameters
+        ----------
+        bases: list
+            Older :class:`StatusArchive` (or paths to them) from the same
+            board to find the base of a delta in. Order does not matter.
+
+        Raises
+        ------
+        FileNotFoundError
+            Missing the dpkg status file or the base of a delta.
+
+        Returns
+        -------
+        str
+            The contents of the dpkg file.
+        """
+
+        if self.has_dpkg_status:
+            return self._read(DPKG_STATUS_KEYWORD).decode("utf-8")
+
+        delta = self.dpkg_status_delta
+        if delta is None:
+            raise FileNotFoundError("missing {} file in {}".format(
+                DPKG_STATUS_KEYWORD, self._path))
+
+        # index the other archives by the hash of the dpkg status they hold
+        fulls = {}
+        deltas = {}
+        for base in bases or []:
+            if not isinstance(base, StatusArchive):
+                base = StatusArchive(base)
+
+            if base.has_dpkg_status:
+                normalized = _join_dpkg_status(
+                        _split_dpkg_status(base.dpkg_status()))
+                fulls[_status_hash(normalized)] = normalized
+            elif base.dpkg_status_delta is not None:
+                deltas[base.dpkg_status_delta["target"]] = \
+                    base.dpkg_status_delta
+
+        chain = [delta]
+        while chain[-1]["base"] not in fulls:
+            if chain[-1]["base"] not in deltas or len(chain) > len(deltas):
+                raise FileNotFoundError("missing base dpkg-status for {}"
+                                        .format(self._path))
+            chain.append(deltas[chain[-1]["base"]])
+
+        status = fulls[chain[-1]["base"]]
+        for i in reversed(chain):
+            status = apply_dpkg_status_delta(status, i)
+
+        return status
+
+    def dpkg_index(self, bases=None) -> DpkgStatus:
+        """Get a index of the packages in the dpkg status file to query.
+
+        Parameters
+        ----------
+        bases: list
+            See :meth:`dpkg_status`.
+
+        Raises
+        ------
+        FileNotFoundError
+            Missing the dpkg status file or the base of a delta.
+
+        Returns
+        -------
+        DpkgStatus
+            The index.
+        """
+
+        if self.has_dpkg_status:  # skip decoding it
+            return DpkgStatus.from_string(self._read(DPKG_STATUS_KEYWORD))
+        return DpkgStatus.from_string(self.dpkg_status(bases))
 
 
 def read_olu_status_file(name: str) -> str:
-    """Read the contents of the olu status file in the status archive
+    """Read the contents of the olu status file in the status archive. Use
+    :class:`StatusArchive` to read more than one file from the same status
+    archive.
 
     Parameters
     ----------
@@ -29,38 +362,26 @@ def read_olu_status_file(name: str) -> str:
         The contents of the olu file.
     """
 
-    status_file = ""
-    tar = tarfile.open(name, "r")
-
-    for i in tar.getmembers():
-        olm_file = OLMFile(load=i.name)
-        if olm_file.keyword == OLU_STATUS_KEYWORD:
-            status_file = olm_file.name
-            fptr = tar.extractfile(status_file)
-            content = fptr.read()
-            content = content.decode("utf-8")
-            tar.close()
-            break
+    return StatusArchive(name).olu_status
 
-    if status_file == "":
-        tar.close()
-        raise FileNotFoundError("missing olu-status file in {}".format(name))
 
-    return content
-
-
-def read_dpkg_status_file(name: str):
+def read_dpkg_status_file(name: str, bases=None):
     """Read the contents of the dpkg status file in the status archive if it
-    exit.
+    exit. Use :class:`StatusArchive` to read more than one file from the same
+    status archive.
 
     Parameters
     ----------
     name: str
         The olu status tar file.
+    bases: list
+        Paths to older status archives from the same board to find the base
+        of a delta in. See :meth:`StatusArchive.dpkg_status`.
 
     Raises
     ------
     FileNotFoundError
+        Missing the dpkg status file or the base of a delta.
 
     Returns
     -------
@@ -68,40 +389,127 @@ def read_dpkg_status_file(name: str):
         The contents of the dpkg file.
     """
 
-    status_file = ""
-    tar = tarfile.open(name, "r")
+    return StatusArchive(name).dpkg_status(bases)
 
-    for i in tar.getmembers():
-        olm_file = OLMFile(load=i.name)
-        if olm_file.keyword == DPKG_STATUS_KEYWORD:
-            status_file = olm_file.name
-            fptr = tar.extractfile(status_file)
-            content = fptr.read()
-            content = content.decode("utf-8")
-            tar.close()
-            break
 
-    if status_file == "":
-        tar.close()
-        raise FileNotFoundError("missing dpkg-status file in {}".format(name))
+def acknowledge_status_archive(status_dir: str, name: str) -> bool:
+    """Use the dpkg status snapshot of a status archive as the base for
+    future deltas, as the ground station has it.
 
-    return content
+    Parameters
+    ----------
+    status_dir: str
+        Path to the status directory given to :func:`make_status_archive`.
+    name: str
+        Filename of the status archive.
+
+    Returns
+    -------
+    bool
+        True if the snapshot became the base or False if there is no snapshot
+        for the status archive.
+    """
+
+    name = basename(name)
+    snapshot = status_dir + "/" + name + SNAPSHOT_EXT
+    if not isfile(snapshot):
+        return False
+
+    replace(snapshot, status_dir + "/" + BASE_SNAPSHOT)
+
+    # older snapshots will never be acknowledged now
+    date = OLMFile(load=name).date
+    for i in _pending_snapshots(status_dir):
+        if OLMFile(load=i).date <= date:
+            remove(status_dir + "/" + i)
+
+    return True
+
+
+def reset_status_snapshot(status_dir: str):
+    """Remove the acknowledged dpkg status snapshot, so the next status
+    archive has the full dpkg status file.
+
+    Parameters
+    ----------
+    status_dir: str
+        Path to the status directory given to :func:`make_status_archive`.
+    """
+
+    if isfile(status_dir + "/" + BASE_SNAPSHOT):
+        remove(status_dir + "/" + BASE_SNAPSHOT)
+
+
+def _pending_snapshots(status_dir: str) -> list:
+    """List the snapshots waiting to be acknowledged, oldest first."""
+
+    snapshots = [i for i in listdir(status_dir)
+                 if i.endswith(SNAPSHOT_EXT) and i != BASE_SNAPSHOT]
+    snapshots.sort(key=lambda i: OLMFile(load=i).date)
+    return snapshots
+
+
+def _list_update_cache(update_cache_dir: str) -> list:
+    """List the update archives in the cache, without hidden files (the
+    index log and the directory of partial copies that are still being
+    added).
+    """
+
+    return sorted([i for i in listdir(update_cache_dir)
+                   if not i.startswith(".")])
+
+
+def _add_bytes(tar: tarfile.TarFile, name: str, data: bytes):
+    """Add a file to a tar file from memory."""
 
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time())
+    info.mode = 0o644
+    tar.addfile(info, BytesIO(data))
 
-def make_status_archive(update_cache_dir: str, dpkg_status=False) -> str:
+
+def _fsync(path: str):
+    """Flush a file to storage."""
+
+    fd = os_open(path, O_RDONLY)
+    try:
+        fsync(fd)
+    finally:
+        close(fd)
+
+
+def make_status_archive(update_cache_dir: str, dpkg_status=False,
+                        codec=DEFAULT_CODEC, status_dir=None,
+                        archive_dir=STATUS_ARCHIVE_DIR) -> str:
     """Make status tar file with a copy of the dpkg status file and a file
     with the list of updates in cache.
 
+    The status archive is built from memory and streamed straight to its path
+    and synced once, no temporary files are made for its members.
+
+    If status_dir is set, a snapshot of the dpkg status file is saved for
+    :func:`acknowledge_status_archive` and, once there is a acknowledged
+    snapshot, only a delta from it is added instead of the dpkg status file.
+
     Parameters
     ----------
     update_cache_dir: str
         Path to the update archive cache.
     dpkg_status: bool
         Include the dpkg status file to update archive.
+    codec: str
+        The name of the compression codec to use.
+    status_dir: str
+        Path to the directory to keep the dpkg status snapshots in.
+    archive_dir: str
+        Path to the directory to make the status archive in.
 
     Raises
     ------
     FileNotFoundError
+    CodecError
+        Unknown or unavailable codec.
 
     Returns
     -------
@@ -115,19 +523,217 @@ def make_status_archive(update_cache_dir: str, dpkg_status=False) -> str:
     if dpkg_status and not isfile(DPKG_STATUS_FILE):
         raise FileNotFoundError("{} is missing".format(DPKG_STATUS_FILE))
 
+    codec = get_codec(codec)
+
     # make the filenames
-    olu_file = "/tmp/" + OLMFile(keyword=OLU_STATUS_KEYWORD).name
-    olu_tar = "/tmp/" + OLMFile(keyword=OLU_STATUS_KEYWORD, ext=".tar.xz").name
-    if dpkg_status:
-        dpkg_file = OLMFile(keyword=DPKG_STATUS_KEYWORD).name
+    olu_file = OLMFile(keyword=OLU_STATUS_KEYWORD).name
+    olu_tar = archive_dir + "/" + OLMFile(keyword=OLU_STATUS_KEYWORD,
+                                          ext=codec.extension).name
+    dpkg_data = None
+    delta_data = None
+
+    if dpkg_status and status_dir is not None:
+        Path(status_dir).mkdir(parents=True, exist_ok=True)
+        with open(DPKG_STATUS_FILE, "rb") as fptr:
+            dpkg_data = fptr.read()
+        status = _join_dpkg_status(_split_dpkg_status(dpkg_data.decode()))
+
+        base_snapshot = status_dir + "/" + BASE_SNAPSHOT
+        if isfile(base_snapshot):
+            with open(base_snapshot, "r") as fptr:
+                delta = make_dpkg_status_delta(fptr.read(), status)
+            delta_data = json.dumps(delta).encode()
 
-    with open(olu_file, "w") as fptr:
-        fptr.write(json.dumps(listdir(update_cache_dir)))
+        snapshot = status_dir + "/" + basename(olu_tar) + SNAPSHOT_EXT
+        with open(snapshot + ".tmp", "w") as fptr:
+            fptr.write(status)
+        replace(snapshot + ".tmp", snapshot)
 
-    with tarfile.open(olu_tar, "w:xz") as tfptr:
-        tfptr.add(olu_file, arcname=basename(olu_file))
-        if dpkg_status:
-            tfptr.add(DPKG_STATUS_FILE, arcname=basename(dpkg_file))
+        for i in _pending_snapshots(status_dir)[:-MAX_PENDING_SNAPSHOTS]:
+            remove(status_dir + "/" + i)
 
-    remove(olu_file)
+    # all members are added from memory (or read from the dpkg status file),
+    # so the archive is the only file written
+    with codec.open_tar(olu_tar, "w") as tfptr:
+        _add_bytes(tfptr, olu_file,
+                   json.dumps(_list_update_cache(update_cache_dir)).encode())
+        if delta_data is not None:
+            _add_bytes(tfptr, OLMFile(keyword=DPKG_STATUS_DELTA_KEYWORD,
+                                      ext=".json").name, delta_data)
+        elif dpkg_data is not None:
+            _add_bytes(tfptr, OLMFile(keyword=DPKG_STATUS_KEYWORD).name,
+                       dpkg_data)
+        elif dpkg_status:
+            tfptr.add(DPKG_STATUS_FILE,
+                      arcname=OLMFile(keyword=DPKG_STATUS_KEYWORD).name)
+
+    _fsync(olu_tar)
     return olu_tar
+
+
+class StatusArchiveCache():
+    """Makes status archives, but returns the last one made if nothing in it
+    would change, so repeated requests don't recompress the same data.
+
+    The fingerprint of a status archive is the list of update archives in
+    cache, the size and mtime of the dpkg status file (or its sha256 if only
+    they changed) and the acknowledged snapshot. Old status archives are
+    deleted once all the status archives made are over the max size, except
+    the newest one and the ones handed out and not yet acknowledged (see
+    :meth:`acknowledge`).
+
+    All methods are thread safe.
+    """
+
+    def __init__(self, archive_dir=STATUS_ARCHIVE_DIR,
+                 max_size=STATUS_ARCHIVES_MAX_SIZE):
+        """
+        Parameters
+        ----------
+        archive_dir: str
+            Path to the directory to make status archives in.
+        max_size: int
+            Max size of all status archives kept in bytes. The newest status
+            archive and the last :data:`MAX_PENDING_SNAPSHOTS` handed out and
+            not yet acknowledged are always kept.
+        """
+
+        self._archive_dir = archive_dir
+        self._max_size = max_size
+        self._lock = Lock()
+        self._archives = []  # oldest first
+        self._handed_out = []  # oldest first, not yet acknowledged
+        self._fingerprint = None
+        self._dpkg_hash = None
+
+    def _make_fingerprint(self, update_cache_dir: str, dpkg_status: bool,
+                          codec: str, status_dir) -> tuple:
+        """Make the fingerprint, the dpkg status file stat is last."""
+
+        base = None
+        if status_dir is not None and isfile(status_dir + "/" + BASE_SNAPSHOT):
+            info = stat(status_dir + "/" + BASE_SNAPSHOT)
+            base = (info.st_mtime_ns, info.st_size)
+
+        dpkg = None
+        if dpkg_status and isfile(DPKG_STATUS_FILE):
+            info = stat(DPKG_STATUS_FILE)
+            dpkg = (info.st_mtime_ns, info.st_size, info.st_ino)
+
+        return (_list_update_cache(update_cache_dir), dpkg_status, codec,
+                status_dir, base, dpkg)
+
+    @staticmethod
+    def _hash_dpkg_status() -> str:
+        sha256 = hashlib.sha256()
+        with open(DPKG_STATUS_FILE, "rb") as fptr:
+            for chunk in iter(lambda: fptr.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def make_status_archive(self, update_cache_dir: str, dpkg_status=False,
+                            codec=DEFAULT_CODEC, status_dir=None) -> str:
+        """Get a status archive, only makes a new one if something changed.
+        See :func:`make_status_archive` for the parameters.
+
+        Raises
+        ------
+        FileNotFoundError
+        CodecError
+            Unknown or unavailable codec.
+
+        Returns
+        -------
+        str
+            Path to status file or empty string on failure.
+        """
+
+        if not isdir(update_cache_dir):
+            raise FileNotFoundError("{} is missing".format(update_cache_dir))
+
+        with self._lock:
+            fingerprint = self._make_fingerprint(update_cache_dir, dpkg_status,
+                                                 codec, status_dir)
+            last = self._archives[-1] if self._archives else None
+
+            if last is not None and isfile(last) and \
+                    self._fingerprint is not None and \
+                    fingerprint[:-1] == self._fingerprint[:-1]:
+                if fingerprint[-1] == self._fingerprint[-1]:
+                    self._hand_out(last)
+                    return last
+
+                # dpkg status file was touched, check if it really changed
+                dpkg_hash = self._hash_dpkg_status() if dpkg_status else None
+                if dpkg_hash == self._dpkg_hash:
+                    self._fingerprint = fingerprint
+                    self._hand_out(last)
+                    return last
+
+            archive = make_status_archive(update_cache_dir, dpkg_status, codec,
+                                          status_dir, self._archive_dir)
+
+            self._fingerprint = fingerprint
+            self._dpkg_hash = self._hash_dpkg_status() if dpkg_status else None
+            if archive in self._archives:  # made in the same second
+                self._archives.remove(archive)
+            self._archives.append(archive)
+            self._hand_out(archive)
+            self._evict()
+
+        return archive
+
+    def _hand_out(self, archive: str):
+        """Keep a status archive until it is acknowledged, only the last
+        :data:`MAX_PENDING_SNAPSHOTS` are kept like their snapshots.
+        """
+
+        if archive in self._handed_out:
+            self._handed_out.remove(archive)
+        self._handed_out.append(archive)
+        del self._handed_out[:-MAX_PENDING_SNAPSHOTS]
+
+    def acknowledge(self, name: str):
+        """Release a status archive handed out and the older ones, so they
+        can be deleted once over the max size.
+
+        Parameters
+        ----------
+        name: str
+            Filename of the status archive.
+        """
+
+        name = basename(name)
+        with self._lock:
+            if name not in [basename(i) for i in self._handed_out]:
+                return
+
+            date = OLMFile(load=name).date
+            self._handed_out = [i for i in self._handed_out
+                                if OLMFile(load=basename(i)).date > date]
+            self._evict()
+
+    def _evict(self):
+        """Delete the oldest status archives until under the max size, never
+        the newest one or one handed out and not yet acknowledged.
+        """
+
+        keep = set(self._handed_out + self._archives[-1:])
+        sizes = {i: getsize(i) if isfile(i) else 0 for i in self._archives}
+        total = sum(sizes.values())
+        for archive in [i for i in self._archives if i not in keep]:
+            if total <= self._max_size:
+                break
+            if isfile(archive):
+                remove(archive)
+            self._archives.remove(archive)
+            total -= sizes[archive]
+
+    @property
+    def archives(self) -> list:
+        """list: The paths of the status archives kept, oldest first.
+        Readonly.
+        """
+
+        with self._lock:
+            return list(self._archives)
@@ -9,9 +9,13 @@ will be used to generate these files.
 Compression
 -----------
 
-Update files are a tar file compressed with xz. xz is used as it offers a great
-compression ratio and the extra compression time doesn't matter, since the
-update archive will be generated on a ground station server.
+Update files are a tar file compressed with xz by default. xz is used as it
+offers a great compression ratio and the extra compression time doesn't
+matter, since the update archive will be generated on a ground station server.
+
+Boards where decompression time matters more than uplink size can use zstd,
+gz, or no compression instead, see :mod:`oresat_linux_updater.codec`. The file
+extension is changed to match the codec (e.g. :code:`.tar.zst`).
 
 Tar Name
 ---------
@@ -35,8 +39,14 @@ The update archive will **always** include a instructions.txt file. It can also
 include deb files (debian package files), bash script, and/or files to be used
 by bash scripts as needed.
 
+Update archives made by :func:`create_update_archive` also have a
+manifest.json file as the **first** member, so it can be read by only
+decompressing the first few KiB of the update archive (see
+:func:`read_update_manifest`).
+
 **Example contents of a update archive**::
 
+    manifest.json
     instructions.txt
     package1.deb
     package2.deb
@@ -94,21 +104,74 @@ order.
             "items": ["bash_script2_external_file"]
         }
     ]
+
+manifest.json
+-------------
+
+manifest.json contains a JSON dictionary with the same `instructions` list as
+the instructions.txt and a `members` list with the `name`, `size`, and `sha256`
+(hex digest) of every other file in the update archive, in the order they are
+in the tar.
+
+It can also have a `requires` list with the filenames of the older update
+archives that must be run successfully before this one. If a update fails, only
+the cached update archives that require it (directly or thru other update
+archives) are deleted. Update archives without a `requires` list are assumed to
+require every older update archive.
+
+**Example manifest.json**::
+
+    {
+        "instructions": [
+            {
+                "type": "DPKG_INSTALL",
+                "items": ["package1.deb"]
+            }
+        ],
+        "members": [
+            {
+                "name": "instructions.txt",
+                "size": 53,
+                "sha256": "3f6c...9a1e"
+            },
+            {
+                "name": "package1.deb",
+                "size": 1052,
+                "sha256": "b5d4...03c2"
+            }
+        ],
+        "requires": ["gps_update_1612392000.tar.xz"]
+    }
 """
 
 import json
-import tarfile
+import hashlib
 from os import remove
 from os.path import abspath, basename, isfile
+from threading import Condition, Thread
 from oresat_linux_updater.instruction import Instruction, InstructionError, \
         InstructionType, INSTRUCTIONS_WITH_FILES
 from oresat_linux_updater.olm_file import OLMFile
+from oresat_linux_updater.codec import DEFAULT_CODEC, ARCHIVE_ERRORS, \
+        get_codec, open_archive
 
 INST_FILE = "instructions.txt"
 """The instructions file that is always in a OreSat Linux update archive. It
 defines the order instructions are ran in and how it is ran.
 """
 
+MANIFEST_FILE = "manifest.json"
+"""The manifest file that is the first member of update archives made by
+:func:`create_update_archive`. It has the instructions and the size and hash of
+all other members.
+"""
+
+MANIFEST_MAX_SIZE = 1024 * 1024
+"""The largest manifest file that will be read."""
+
+CHUNK_SIZE = 1024 * 1024
+"""The size of the chunks members are extracted and hashed in."""
+
 
 class UpdateArchiveError(Exception):
     """An error occurred when creating or extracting a update archive."""
@@ -135,10 +198,23 @@ def write_instructions_file(inst_list: list, path_dir) -> str:
         Absolute path to the new instructions file.
     """
 
-    inst_data = []
     path_dir = abspath(path_dir) + "/"
     inst_file = path_dir + INST_FILE
 
+    # make instructions file
+    with open(inst_file, "w") as fptr:
+        fptr.write(json.dumps(_instructions_data(inst_list)))
+
+    return inst_file
+
+
+def _instructions_data(inst_list: list) -> list:
+    """Convert a instructions list to the instruction dictionaries used in
+    the instructions and manifest files.
+    """
+
+    inst_data = []
+
     for inst in inst_list:
         if inst.type in INSTRUCTIONS_WITH_FILES:
             items = []
@@ -149,11 +225,7 @@ def write_instructions_file(inst_list: list, path_dir) -> str:
 
         inst_data.append({"type": inst.type.name, "items": items})
 
-    # make instructions file
-    with open(inst_file, "w") as fptr:
-        fptr.write(json.dumps(inst_data))
-
-    return inst_file
+    return inst_data
 
 
 def read_instructions_file(inst_file: str, work_dir: str) -> str:
@@ -177,8 +249,6 @@ def read_instructions_file(inst_file: str, work_dir: str) -> str:
         A list of Instructions.
     """
 
-    inst_list = []
-    work_dir = abspath(work_dir) + "/"
     inst_file = abspath(inst_file)
 
     try:
@@ -188,6 +258,26 @@ def read_instructions_file(inst_file: str, work_dir: str) -> str:
         msg = "Invalid instructions JSON in {}".format(inst_file)
         raise UpdateArchiveError(msg)
 
+    return _parse_instructions(inst_list_raw, work_dir)
+
+
+def _parse_instructions(inst_list_raw: list, work_dir: str) -> list:
+    """Convert a list of instruction dictionaries into a list of
+    Instructions, with the work directory added to all files.
+
+    Raises
+    ------
+    UpdateArchiveError
+        Invalid instruction dictionaries.
+    """
+
+    inst_list = []
+    work_dir = abspath(work_dir) + "/"
+
+    if not isinstance(inst_list_raw, list):
+        msg = "Instructions file JSON was formatted incorrectly"
+        raise UpdateArchiveError(msg)
+
     # add path to all files
     for inst_raw in inst_list_raw:
         try:
@@ -215,8 +305,258 @@ def read_instructions_file(inst_file: str, work_dir: str) -> str:
     return inst_list
 
 
+def _file_info(path: str) -> dict:
+    """Get the manifest member dictionary for a file."""
+
+    digest = hashlib.sha256()
+    size = 0
+
+    with open(path, "rb") as fptr:
+        for chunk in iter(lambda: fptr.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+            size += len(chunk)
+
+    return {"name": basename(path), "size": size, "sha256": digest.hexdigest()}
+
+
+def write_manifest_file(inst_list: list, files: list, path_dir: str,
+                        requires=None) -> str:
+    """Makes the manifest file from a instructions list and the files that
+    will be in the update archive.
+
+    Parameters
+    ----------
+    inst_list: list
+        A list of Instructions objects.
+    files: list
+        The paths to all files that will be in the update archive after the
+        manifest, in tar order.
+    path_dir: str
+        The directory to make the manifest in.
+    requires: list
+        Optional, the filenames of the update archives that must be run
+        before this one. If None, the manifest has no `requires` list.
+
+    Returns
+    -------
+    str
+        Absolute path to the new manifest file.
+    """
+
+    path_dir = abspath(path_dir) + "/"
+    manifest_file = path_dir + MANIFEST_FILE
+
+    manifest = {
+        "instructions": _instructions_data(inst_list),
+        "members": [_file_info(i) for i in files],
+    }
+    if requires is not None:
+        manifest["requires"] = [basename(i) for i in requires]
+
+    with open(manifest_file, "w") as fptr:
+        fptr.write(json.dumps(manifest))
+
+    return manifest_file
+
+
+def _check_manifest(manifest: dict) -> dict:
+    """Check the manifest is formatted correctly and all files the
+    instructions use are members.
+
+    Raises
+    ------
+    UpdateArchiveError
+        Invalid manifest.
+    """
+
+    msg = "Manifest JSON was formatted incorrectly"
+
+    if not isinstance(manifest, dict) or \
+            not isinstance(manifest.get("members"), list):
+        raise UpdateArchiveError(msg)
+
+    names = set()
+    for member in manifest["members"]:
+        if not isinstance(member, dict) or \
+                not isinstance(member.get("name"), str) or \
+                not isinstance(member.get("size"), int) or \
+                not isinstance(member.get("sha256"), str):
+            raise UpdateArchiveError(msg)
+        names.add(member["name"])
+
+    requires = manifest.get("requires", [])
+    if not isinstance(requires, list) or \
+            not all([isinstance(i, str) for i in requires]):
+        raise UpdateArchiveError(msg)
+
+    inst_list = _parse_instructions(manifest.get("instructions"), "")
+
+    for inst in inst_list:
+        if inst.type in INSTRUCTIONS_WITH_FILES:
+            for item in inst.items:
+                if basename(item) not in names:
+                    msg = "Missing file {}".format(basename(item))
+                    raise UpdateArchiveError(msg)
+
+    return manifest
+
+
+def _read_manifest_file(manifest_file: str) -> dict:
+    """Read and check a extracted manifest file.
+
+    Raises
+    ------
+    UpdateArchiveError
+        Invalid manifest.
+    """
+
+    try:
+        with open(manifest_file, "r") as fptr:
+            return _check_manifest(json.load(fptr))
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise UpdateArchiveError("Invalid manifest JSON")
+
+
+def _extract_member(tptr, member, work_dir: str, expected=None):
+    """Extract a member, hashing it while it is decompressed and written, so
+    it is only read once.
+
+    Parameters
+    ----------
+    tptr: tarfile.TarFile
+        The opened update archive.
+    member: tarfile.TarInfo
+        The member to extract.
+    work_dir: str
+        The directory to extract the member into.
+    expected: dict
+        The member dictionary from the manifest, to verify the member with.
+        If None, the member is not verified.
+
+    Raises
+    ------
+    UpdateArchiveError
+        Invalid member or the member does not match the manifest.
+    """
+
+    name = member.name
+    if not member.isfile() or name != basename(name) or \
+            name in ["", "..", "."]:
+        raise UpdateArchiveError("Invalid member {}".format(name))
+
+    digest = hashlib.sha256()
+    size = 0
+
+    src = tptr.extractfile(member)
+    with open(work_dir + name, "wb") as fptr:
+        for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+            fptr.write(chunk)
+            size += len(chunk)
+
+    if expected is not None and (size != expected["size"] or
+                                 digest.hexdigest() != expected["sha256"]):
+        remove(work_dir + name)
+        raise UpdateArchiveError("{} does not match manifest".format(name))
+
+
+def _extract_members(tptr, work_dir: str, extracted=None):
+    """Extract all members in tar order. If the first member is the
+    manifest, all other members are verified against it as they are
+    extracted.
+
+    Parameters
+    ----------
+    tptr: tarfile.TarFile
+        The update archive opened as a stream.
+    work_dir: str
+        The directory to extract into.
+    extracted: function
+        Called with the name of each member after it is extracted. Extraction
+        stops if it returns False.
+
+    Raises
+    ------
+    UpdateArchiveError
+        Invalid member or a member does not match the manifest.
+    """
+
+    members = None  # stays None if there is no manifest to verify with
+    first = True
+
+    for member in tptr:
+        if first and member.name == MANIFEST_FILE:
+            _extract_member(tptr, member, work_dir)
+            manifest = _read_manifest_file(work_dir + MANIFEST_FILE)
+            members = {i["name"]: i for i in manifest["members"]}
+        elif members is not None:
+            if member.name not in members:
+                msg = "{} is not in manifest".format(member.name)
+                raise UpdateArchiveError(msg)
+            _extract_member(tptr, member, work_dir, members[member.name])
+        else:  # made before manifests, nothing to verify with
+            _extract_member(tptr, member, work_dir)
+
+        first = False
+
+        if extracted is not None and extracted(member.name) is False:
+            break
+
+
+def read_update_manifest(update_archive: str) -> dict:
+    """Read the manifest of a update archive. Only the start of the update
+    archive is decompressed, as the manifest is always the first member.
+
+    Parameters
+    ----------
+    update_archive: str
+        Path to the update archive.
+
+    Raises
+    ------
+    UpdateArchiveError
+        Invalid update archive, the manifest is missing, or a file the
+        instructions use is missing.
+
+    Returns
+    -------
+    dict
+        The manifest with a list of instruction dictionaries as
+        `instructions`, a list of member dictionaries as `members`, and, if
+        the update archive has one, the list of required update archives as
+        `requires`.
+    """
+
+    if not is_update_archive(update_archive):
+        msg = "Update file does not follow OLM filename standards"
+        raise UpdateArchiveError(msg)
+
+    try:
+        with open_archive(update_archive, "r|") as tptr:
+            member = tptr.next()
+            if member is None or member.name != MANIFEST_FILE:
+                msg = "Missing {} in {}".format(MANIFEST_FILE,
+                                                basename(update_archive))
+                raise UpdateArchiveError(msg)
+            if member.size > MANIFEST_MAX_SIZE:
+                raise UpdateArchiveError("Manifest is too large")
+            data = tptr.extractfile(member).read()
+    except ARCHIVE_ERRORS:
+        raise UpdateArchiveError("Invalid update archive")
+    except FileNotFoundError as exc:
+        raise UpdateArchiveError(str(exc))
+
+    try:
+        manifest = json.loads(data)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise UpdateArchiveError("Invalid manifest JSON")
+
+    return _check_manifest(manifest)
+
+
 def create_update_archive(board: str, inst_list: dict, work_dir: str,
-                          consume_files=True) -> str:
+                          consume_files=True, codec=DEFAULT_CODEC,
+                          jobs=1, requires=None) -> str:
     """Makes the tar from a list of instructions. This will consume all files
     if a valid update archive is made.
 
@@ -230,11 +570,22 @@ def create_update_archive(board: str, inst_list: dict, work_dir: str,
         The directory to make the tar in.
     consume: bool
         A flag if the file should be consumed.
+    codec: str
+        The name of the compression codec to use.
+    jobs: int
+        Number of processes to compress with. Only the xz codec can compress
+        in parallel. If None, the number of cpus will be used.
+    requires: list
+        Optional, the filenames of the update archives that must be run
+        before this one. If None, the update archive requires every older
+        update archive.
 
     Raises
     ------
     InstructionError
         Invalid inst_list.
+    CodecError
+        Unknown or unavailable codec.
 
     Returns
     -------
@@ -244,7 +595,8 @@ def create_update_archive(board: str, inst_list: dict, work_dir: str,
 
     files = []
     work_dir = abspath(work_dir) + "/"
-    update = OLMFile(board=board, keyword="update", ext=".tar.xz")
+    codec = get_codec(codec)
+    update = OLMFile(board=board, keyword="update", ext=codec.extension)
 
     inst_file = write_instructions_file(inst_list, work_dir)
     files.append(inst_file)
@@ -257,8 +609,13 @@ def create_update_archive(board: str, inst_list: dict, work_dir: str,
         if not isfile(item):
             raise UpdateArchiveError("missing file {}".format(item))
 
+    # the manifest is always first, so it can be read without decompressing
+    # the whole update archive
+    files.insert(0, write_manifest_file(inst_list, files, work_dir,
+                                        requires))
+
     # make tar
-    with tarfile.open(work_dir + update.name, "w:xz") as tar:
+    with codec.open_tar(work_dir + update.name, "w", jobs) as tar:
         for item in files:
             tar.add(item, arcname=basename(item))
 
@@ -273,6 +630,9 @@ def create_update_archive(board: str, inst_list: dict, work_dir: str,
 def extract_update_archive(update_archive: str, work_dir: str) -> str:
     """Open the update archive file.
 
+    If the update archive has a manifest, the size and SHA-256 of every member
+    is checked while it is extracted.
+
     Parameters
     ----------
     update_archive: str
@@ -283,7 +643,7 @@ def extract_update_archive(update_archive: str, work_dir: str) -> str:
     Raises
     ------
     UpdateArchiveError
-        Invalid update archive.
+        Invalid update archive or a member does not match the manifest.
 
     Returns
     -------
@@ -298,9 +658,9 @@ def extract_update_archive(update_archive: str, work_dir: str) -> str:
         raise UpdateArchiveError(msg)
 
     try:
-        with tarfile.open(update_archive, "r:xz") as tptr:
-            tptr.extractall(work_dir)
-    except tarfile.TarError:
+        with open_archive(update_archive, "r|") as tptr:
+            _extract_members(tptr, work_dir)
+    except ARCHIVE_ERRORS:
         raise UpdateArchiveError("Invalid update archive")
 
     try:
@@ -318,6 +678,246 @@ def extract_update_archive(update_archive: str, work_dir: str) -> str:
     return inst_list
 
 
+def read_extracted_instructions(work_dir: str) -> list:
+    """Read the instructions of a update archive that was already extracted,
+    from the manifest if there is one or from the instructions file.
+
+    Parameters
+    ----------
+    work_dir: str
+        The directory the update archive was extracted into.
+
+    Raises
+    ------
+    UpdateArchiveError
+        Missing or invalid instructions file or manifest.
+
+    Returns
+    -------
+    list
+        A list of Instructions.
+    """
+
+    work_dir = abspath(work_dir) + "/"
+
+    if isfile(work_dir + MANIFEST_FILE):
+        manifest = _read_manifest_file(work_dir + MANIFEST_FILE)
+        return _parse_instructions(manifest["instructions"], work_dir)
+
+    try:
+        return read_instructions_file(work_dir + INST_FILE, work_dir)
+    except FileNotFoundError:
+        raise UpdateArchiveError("Missing file {}".format(INST_FILE))
+    except InstructionError as exc:
+        raise UpdateArchiveError(str(exc))
+
+
+def verify_extracted_files(work_dir: str, files: list):
+    """Check files of a update archive that was already extracted are still
+    intact. If there is a manifest, the size and SHA-256 of each file is
+    checked, otherwise only that the files exists.
+
+    Parameters
+    ----------
+    work_dir: str
+        The directory the update archive was extracted into.
+    files: list
+        A list of filepaths or filenames in the update archive.
+
+    Raises
+    ------
+    UpdateArchiveError
+        A file is missing or does not match the manifest.
+    """
+
+    work_dir = abspath(work_dir) + "/"
+    members = {}
+
+    if isfile(work_dir + MANIFEST_FILE):
+        manifest = _read_manifest_file(work_dir + MANIFEST_FILE)
+        members = {i["name"]: i for i in manifest["members"]}
+
+    for name in [basename(i) for i in files]:
+        if not isfile(work_dir + name):
+            raise UpdateArchiveError("Missing file {}".format(name))
+
+        expected = members.get(name)
+        if expected is None:
+            continue
+
+        info = _file_info(work_dir + name)
+        if info["size"] != expected["size"] or \
+                info["sha256"] != expected["sha256"]:
+            raise UpdateArchiveError("{} does not match manifest".format(
+                name))
+
+
+class UpdateArchiveStream():
+    """Extracts an update archive in a background thread, so the instructions
+    can be run while the rest of the update archive is still being
+    decompressed.
+
+    The members are extracted in the order they are in the tar, so an update
+    archive made by :func:`create_update_archive` (the instructions file
+    first, then the files in instruction order) gets the most overlap. Any
+    other order still works, it just has to wait longer.
+    """
+
+    def __init__(self, update_archive: str, work_dir: str):
+        """
+        Parameters
+        ----------
+        update_archive: str
+            Path to the update archive.
+        work_dir: str
+            The directory to extract the update archive into.
+
+        Raises
+        ------
+        UpdateArchiveError
+            Invalid update archive filename.
+        """
+
+        if not is_update_archive(update_archive):
+            msg = "Update file does not follow OLM filename standards"
+            raise UpdateArchiveError(msg)
+
+        self._update_archive = update_archive
+        self._work_dir = abspath(work_dir) + "/"
+
+        # things protected by the condition
+        self._cond = Condition()
+        self._extracted = set()
+        self._first_member = None
+        self._done = False
+        self._stop = False
+        self._error = None
+
+        self._thread = Thread(target=self._extract_loop, daemon=True)
+
+    def start(self):
+        """Start extracting the update archive in the background."""
+
+        self._thread.start()
+
+    def stop(self):
+        """Stop extracting after the current member and wait for the
+        background thread to exit.
+        """
+
+        with self._cond:
+            self._stop = True
+
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _extract_loop(self):
+        """Extract all members of the update archive, one by one. Will be in
+        its own thread.
+        """
+
+        error = None
+
+        try:
+            with open_archive(self._update_archive, "r|") as tptr:
+                _extract_members(tptr, self._work_dir, self._member_extracted)
+        except UpdateArchiveError as exc:
+            error = exc
+        except ARCHIVE_ERRORS:
+            error = UpdateArchiveError("Invalid update archive")
+        except OSError as exc:
+            error = UpdateArchiveError(str(exc))
+
+        with self._cond:
+            self._error = error
+            self._done = True
+            self._cond.notify_all()
+
+    def _member_extracted(self, name: str) -> bool:
+        """Mark a member as extracted. Returns False if extraction should
+        stop.
+        """
+
+        with self._cond:
+            if self._first_member is None:
+                self._first_member = name
+            self._extracted.add(name)
+            self._cond.notify_all()
+            return not self._stop
+
+    def wait_for(self, files: list):
+        """Block until all the files are extracted.
+
+        Parameters
+        ----------
+        files: list
+            A list of filepaths or filenames in the update archive.
+
+        Raises
+        ------
+        UpdateArchiveError
+            A file is not in the update archive or the update archive is
+            invalid.
+        """
+
+        names = [basename(i) for i in files]
+
+        with self._cond:
+            self._cond.wait_for(lambda: self._done or
+                                self._extracted.issuperset(names))
+
+            for name in names:
+                if name not in self._extracted:
+                    if self._error is not None:
+                        raise self._error
+                    raise UpdateArchiveError("Missing file {}".format(name))
+
+    @property
+    def finished(self) -> bool:
+        """bool: Flag if every member was extracted and verified."""
+
+        with self._cond:
+            return self._done and self._error is None and not self._stop
+
+    def read_instructions(self) -> list:
+        """Wait for the instructions file to be extracted and read it.
+
+        If the update archive starts with a manifest, the instructions are
+        read from it instead and all files the instructions use are checked
+        to be in the update archive, before any of them are extracted.
+
+        Raises
+        ------
+        UpdateArchiveError
+            Missing or invalid instructions file or manifest.
+
+        Returns
+        -------
+        list
+            A list of Instructions.
+        """
+
+        with self._cond:
+            self._cond.wait_for(lambda: self._done or
+                                self._first_member is not None)
+            first_member = self._first_member
+
+        if first_member == MANIFEST_FILE:
+            manifest = _read_manifest_file(self._work_dir + MANIFEST_FILE)
+            return _parse_instructions(manifest["instructions"],
+                                       self._work_dir)
+
+        self.wait_for([INST_FILE])
+
+        try:
+            inst_list = read_instructions_file(self._work_dir + INST_FILE,
+                                               self._work_dir)
+        except InstructionError as exc:
+            raise UpdateArchiveError(str(exc))
+
+        return inst_list
+
+
 def is_update_archive(update_archive: str) -> bool:
     """Check to see if the input is a valid update archive.
 
@@ -337,7 +937,7 @@ def is_update_archive(update_archive: str) -> bool:
     except Exception:
         return False
 
-    if fptr.keyword == "update" and fptr.extension == ".tar.xz":
+    if fptr.keyword == "update" and fptr.codec is not None:
         return True
 
     return False
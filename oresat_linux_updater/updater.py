@@ -2,15 +2,65 @@
 
 import json
 from logging import Logger
-from os import listdir
-from os.path import abspath, basename
-from shutil import copyfile, move, rmtree
+from os import listdir, remove, replace, stat, close, setpriority, \
+        readlink, PRIO_PROCESS, O_RDONLY, open as os_open
+from os.path import abspath, basename, dirname, isfile
+from shutil import move, rmtree
+from time import perf_counter
+from uuid import uuid4
 from pathlib import Path
 from enum import IntEnum, auto
-from threading import Lock
+from threading import Lock, Condition, Thread
 from oresat_linux_updater.olm_file import OLMFile
+from oresat_linux_updater.instruction import Instruction, InstructionType, \
+        INSTRUCTIONS_WITH_FILES, DPKG_INSTRUCTIONS, DPKG_TRIGGERS_COMMAND, \
+        CommandOutput, plan_instructions, plan_batch, run_pending_triggers, \
+        remove_satisfied
+from oresat_linux_updater.dpkg_status import DpkgStatus, DPKG_STATUS_FILE
+from oresat_linux_updater.preflight import PreflightError, check_plan, \
+        dpkg_architectures
 from oresat_linux_updater.update_archive import extract_update_archive, \
-        is_update_archive, UpdateArchiveError, InstructionError
+        is_update_archive, UpdateArchiveError, InstructionError, \
+        UpdateArchiveStream, read_extracted_instructions, \
+        verify_extracted_files, read_update_manifest
+from oresat_linux_updater.journal import UpdateJournal, JOURNAL_FILE
+from oresat_linux_updater.ingest import ingest_fd, INGEST_METHODS
+from oresat_linux_updater.cache_index import CacheIndex
+from oresat_linux_updater.upload import Upload, UploadError, UPLOAD_EXT, \
+        STATE_EXT
+
+PARTIAL_DIR = ".partial/"
+"""The directory in the cache directory that update archives are copied into
+before they are added to the cache."""
+
+
+def _proc_thread_id() -> int:
+    """Get the kernel thread id of the calling thread from procfs."""
+
+    return int(readlink("/proc/thread-self").rpartition("/")[2])
+
+
+def _file_uses(inst_list: list) -> tuple:
+    """Get the index of the last planned instruction to use each deb file and
+    the support files.
+    """
+
+    last_use = {}
+    support_files = []
+    for i in range(len(inst_list)):
+        if inst_list[i].type == InstructionType.DPKG_INSTALL:
+            for item in inst_list[i].items:
+                last_use[item] = i
+        elif inst_list[i].type == InstructionType.SUPPORT_FILE:
+            support_files += inst_list[i].items
+
+    return last_use, support_files
+
+
+try:
+    from threading import get_native_id
+except ImportError:  # python < 3.8
+    get_native_id = _proc_thread_id
 
 
 class UpdaterError(Exception):
@@ -50,9 +100,15 @@ class Updater():
 
     All functions and properties are thread safe.
 
+    If a stage directory is given, the oldest update archive in the cache is
+    extracted into it by a low priority background thread (see
+    :meth:`start_staging`), so :meth:`update` can go straight to running the
+    instructions. The staged files are only used if the update archive is
+    still the oldest in the cache and was not replaced since it was staged.
     """
 
-    def __init__(self, work_dir: str, cache_dir: str, logger: Logger):
+    def __init__(self, work_dir: str, cache_dir: str, logger: Logger,
+                 streaming=False, stage_dir=None, upload_dir=None):
         """
         Parameters
         ----------
@@ -62,9 +118,23 @@ class Updater():
             Directory to store update archives in. Should be a abslute path.
         logger: logging.Logger
             The logger object to use.
+        streaming: bool
+            Start running instructions while the update archive is still
+            being extracted. If a file is found to be missing from the update
+            archive after the first instruction ran, the update fails in the
+            critical section.
+        stage_dir: str
+            Directory to extract the next update archive into before it is
+            run. Should be a abslute path on the same filesystem as the
+            work_dir. If None, nothing is staged.
+        upload_dir: str
+            Directory to keep update archives being uploaded in parts in.
+            Should be a abslute path on the same filesystem as the cache_dir.
+            If None, update archives can't be uploaded in parts.
         """
 
         self._log = logger
+        self._streaming = streaming
 
         # make update_archives for cache dir
         Path(cache_dir).mkdir(parents=True, exist_ok=True)
@@ -76,15 +146,391 @@ class Updater():
         self._work_dir = abspath(work_dir) + "/"
         self._log.debug("work dir " + self._work_dir)
 
+        # make stage dir, anything in it is from before a restart
+        self._stage_dir = None
+        if stage_dir is not None:
+            rmtree(stage_dir, ignore_errors=True)
+            Path(stage_dir).mkdir(parents=True, exist_ok=True)
+            self._stage_dir = abspath(stage_dir) + "/"
+            self._log.debug("stage dir " + self._stage_dir)
+
+        # make upload dir, uploads in it are resumed
+        self._upload_dir = None
+        self._uploads = {}
+        self._upload_lock = Lock()
+        if upload_dir is not None:
+            Path(upload_dir).mkdir(parents=True, exist_ok=True)
+            self._upload_dir = abspath(upload_dir) + "/"
+            self._log.debug("upload dir " + self._upload_dir)
+            self._load_uploads()
+
         # mutex and things protected by lock
         self._lock = Lock()
         self._is_updating = False
         self._update_archive = ""
+        self._last_update_archive = ""
         self._total_instructions = 0
         self._current_instruction_index = 0
         self._current_command = ""
-        self._cache = listdir(self._cache_dir)
-        self._cache.sort()
+        self._output = CommandOutput()
+        self._skipped_packages = 0
+        self._archs = None  # architectures dpkg allows, read when needed
+        self._ingest_stats = {i: {"count": 0, "bytes": 0, "seconds": 0.0}
+                              for i in INGEST_METHODS}
+        self._cache = self._load_cache_index()
+
+        # staging, also protected by the lock
+        self._stage_cond = Condition(self._lock)
+        self._stage_thread = None
+        self._staging = False
+        self._staged = None  # key of the update archive in the stage dir
+        self._staged_ok = False
+
+    def start_staging(self):
+        """Start the background thread that stages the oldest update archive
+        in the cache. Does nothing if there is no stage directory.
+        """
+
+        if self._stage_dir is None or self._stage_thread is not None:
+            return
+
+        self._stage_thread = Thread(target=self._stage_loop, daemon=True)
+        self._stage_thread.start()
+
+    def stop_staging(self):
+        """Stop the staging thread, once the current update archive (if any)
+        is staged.
+        """
+
+        with self._stage_cond:
+            thread = self._stage_thread
+            self._stage_thread = None
+            self._stage_cond.notify_all()
+
+        if thread is not None and thread.is_alive():
+            thread.join()
+
+    def _file_key(self, name: str) -> tuple:
+        """Get the key of a update archive in the cache; its filename, size,
+        device, inode, and modification and change times. The change time
+        can't be set by a caller, so a re-sent update archive never has the
+        same key, even if it reuses the inode.
+
+        Returns
+        -------
+        tuple
+            The key or None if the update archive is not in the cache.
+        """
+
+        try:
+            info = stat(self._cache_dir + name)
+        except FileNotFoundError:
+            return None
+
+        return (name, info.st_size, info.st_dev, info.st_ino,
+                info.st_mtime_ns, info.st_ctime_ns)
+
+    def _stage_key(self) -> tuple:
+        """Get the key of the oldest update archive in the cache (see
+        :meth:`_file_key`). Must be called with the lock held.
+        """
+
+        if len(self._cache) == 0:
+            return None
+
+        return self._file_key(self._cache.oldest())
+
+    def _stage_needed(self) -> bool:
+        """Check if the staging thread has something to do. Must be called
+        with the lock held.
+        """
+
+        return self._stage_thread is None or \
+            (not self._is_updating and self._stage_key() != self._staged)
+
+    def _stage_loop(self):
+        """Extract the oldest update archive in the cache into the stage
+        directory every time it changes. Will be in its own thread.
+        """
+
+        try:  # only this thread
+            setpriority(PRIO_PROCESS, get_native_id(), 19)
+        except OSError:
+            pass
+
+        while True:
+            with self._stage_cond:
+                self._stage_cond.wait_for(self._stage_needed)
+                if self._stage_thread is None:
+                    break
+
+                key = self._stage_key()
+                self._staging = True
+                self._staged = None
+
+            rmtree(self._stage_dir, ignore_errors=True)
+            Path(self._stage_dir).mkdir(parents=True, exist_ok=True)
+
+            ok = False
+            if key is not None:
+                self._log.debug("staging " + key[0])
+                try:
+                    extract_update_archive(self._cache_dir + key[0],
+                                           self._stage_dir)
+                    ok = True
+                    self._log.info(key[0] + " was staged")
+                except (UpdateArchiveError, InstructionError, OSError) as exc:
+                    self._log.error("failed to stage {}: {}".format(key[0],
+                                                                    exc))
+
+            with self._stage_cond:
+                self._staging = False
+                self._staged = key
+                self._staged_ok = ok
+                self._stage_cond.notify_all()
+
+    def _take_staged(self, name: str) -> bool:
+        """Move the staged files into the working directory if they are for
+        the update archive. Must be called with the lock held, after the
+        update archive was removed from the cache list.
+        """
+
+        staged = self._staged is not None and self._staged_ok and \
+            self._staged[0] == name and self._staged == self._file_key(name)
+
+        self._staged = None
+        if not staged:
+            return False
+
+        for fname in listdir(self._stage_dir):
+            move(self._stage_dir + fname, self._work_dir)
+
+        return True
+
+    def _load_uploads(self):
+        """Load the uploads in the upload directory and delete anything else
+        in it.
+        """
+
+        fnames = listdir(self._upload_dir)
+        for fname in fnames:
+            if not fname.endswith(UPLOAD_EXT):
+                continue
+            upload = Upload.load(self._upload_dir + fname)
+            if upload is not None:
+                self._uploads[fname[:-len(UPLOAD_EXT)]] = upload
+                self._log.info("resuming upload of {}, {} parts missing"
+                               .format(fname[:-len(UPLOAD_EXT)],
+                                       len(upload.missing())))
+
+        keep = [basename(i.path) for i in self._uploads.values()]
+        keep += [i + STATE_EXT for i in keep]
+        for fname in fnames:
+            if fname not in keep:
+                remove(self._upload_dir + fname)
+
+    def _get_upload(self, filename: str) -> Upload:
+        """Get a upload. Must be called with the upload lock held.
+
+        Raises
+        ------
+        UploadError
+            Unknown upload or uploads are disabled.
+        """
+
+        if self._upload_dir is None:
+            raise UploadError("no upload directory")
+
+        upload = self._uploads.get(basename(filename))
+        if upload is None:
+            raise UploadError("no upload for " + filename)
+
+        return upload
+
+    def begin_upload(self, filename: str, size: int, sha256: str,
+                     part_size: int) -> bool:
+        """Begin uploading a update archive in parts. If the same update
+        archive is already being uploaded with the same part size, the parts
+        already received are kept, so the upload can be resumed.
+
+        Parameters
+        ----------
+        filename: str
+            The filename of the update archive.
+        size: int
+            The size of the update archive in bytes.
+        sha256: str
+            The SHA-256 hex digest of the update archive.
+        part_size: int
+            The size of every part in bytes, except the last one.
+
+        Returns
+        -------
+        bool
+            True if the upload can start or False on failure.
+        """
+
+        filename = basename(filename)
+
+        try:
+            OLMFile(load=filename)
+        except Exception:
+            self._log.error(filename + " is a invalid filename")
+            return False
+
+        with self._upload_lock:
+            try:
+                if self._upload_dir is None:
+                    raise UploadError("no upload directory")
+
+                upload = self._uploads.get(filename)
+                if upload is not None and upload.same(size, sha256,
+                                                      part_size):
+                    self._log.info("resuming upload of {}, {} parts missing"
+                                   .format(filename, len(upload.missing())))
+                    return True
+
+                if upload is not None:
+                    upload.delete()
+                    del self._uploads[filename]
+
+                upload = Upload(self._upload_dir + filename + UPLOAD_EXT,
+                                size, sha256, part_size)
+                upload.begin()
+            except (UploadError, OSError) as exc:
+                self._log.error("failed to begin upload of {}: {}".format(
+                    filename, exc))
+                return False
+
+            self._uploads[filename] = upload
+            self._log.info("began upload of {} in {} parts".format(
+                filename, upload.parts))
+
+        return True
+
+    def add_upload_part(self, filename: str, index: int, data: bytes,
+                        crc32: int) -> bool:
+        """Add a part to a update archive being uploaded. Parts can be added
+        in any order and the part is written in place.
+
+        Parameters
+        ----------
+        filename: str
+            The filename of the update archive.
+        index: int
+            The index of the part.
+        data: bytes
+            The part.
+        crc32: int
+            The CRC-32 of the part.
+
+        Returns
+        -------
+        bool
+            True if the part was added or False on failure.
+        """
+
+        with self._upload_lock:
+            try:
+                self._get_upload(filename).add_part(index, data, crc32)
+            except (UploadError, OSError) as exc:
+                self._log.error("failed to add part {} of {}: {}".format(
+                    index, filename, exc))
+                return False
+
+        return True
+
+    def missing_upload_parts(self, filename: str) -> list:
+        """Get the parts of a update archive being uploaded that were not
+        received yet.
+
+        Parameters
+        ----------
+        filename: str
+            The filename of the update archive.
+
+        Returns
+        -------
+        list
+            The indexes of the missing parts, in order. Empty if all parts
+            were received or there is no upload for the filename.
+        """
+
+        with self._upload_lock:
+            try:
+                return self._get_upload(filename).missing()
+            except UploadError as exc:
+                self._log.error(exc)
+                return []
+
+    def commit_upload(self, filename: str) -> bool:
+        """Check a update archive being uploaded has all parts and matches its
+        hash, then add it to the update archive cache. The upload file is
+        hardlinked into the cache when possible, so it is not copied.
+
+        Parameters
+        ----------
+        filename: str
+            The filename of the update archive.
+
+        Returns
+        -------
+        bool
+            True if the update archive was added to the cache or False on
+            failure.
+        """
+
+        filename = basename(filename)
+
+        with self._upload_lock:
+            try:
+                upload = self._get_upload(filename)
+                upload.verify()
+            except (UploadError, OSError) as exc:
+                self._log.error("failed to commit upload of {}: {}".format(
+                    filename, exc))
+                return False
+
+            fd = os_open(upload.path, O_RDONLY)
+            try:
+                ret = self._add_update_archive(filename, fd,
+                                               link_path=upload.path)
+            finally:
+                close(fd)
+
+            if ret:
+                upload.delete()
+                del self._uploads[filename]
+
+        return ret
+
+    def cancel_upload(self, filename: str) -> bool:
+        """Stop uploading a update archive and delete the parts received.
+
+        Parameters
+        ----------
+        filename: str
+            The filename of the update archive.
+
+        Returns
+        -------
+        bool
+            True if the upload was canceled or False if there is no upload for
+            the filename.
+        """
+
+        with self._upload_lock:
+            try:
+                upload = self._get_upload(filename)
+            except UploadError as exc:
+                self._log.error(exc)
+                return False
+
+            upload.delete()
+            del self._uploads[basename(filename)]
+            self._log.info("canceled upload of " + basename(filename))
+
+        return True
 
     def clear_cache_dir(self):
         """Clears the working directory."""
@@ -93,11 +539,28 @@ class Updater():
         if len(listdir(self._work_dir)) != 0:
             rmtree(self._work_dir, ignore_errors=True)
             Path(self._work_dir).mkdir(parents=True, exist_ok=True)
-            self._cache = listdir(self._cache_dir)
+            with self._stage_cond:  # not while a add is renaming its copy
+                self._cache = CacheIndex(self._cache_dir)
+
+    def _load_cache_index(self) -> CacheIndex:
+        """Load the index of the update archives in the cache directory.
+        Partial copies left by :meth:`add_update_archive` are deleted, so only
+        call it when the daemon starts, before anything can be added. They are
+        kept out of the cache directory itself, so it is not modified here.
+        """
+
+        partial_dir = self._cache_dir + PARTIAL_DIR
+        Path(partial_dir).mkdir(exist_ok=True)
+        for fname in listdir(partial_dir):
+            remove(partial_dir + fname)
+
+        return CacheIndex(self._cache_dir)
 
     def add_update_archive(self, update_archive: str) -> bool:
         """Copies update archive into the update archive cache.
 
+        See :meth:`add_update_archive_fd`.
+
         Parameters
         ----------
         update_archive: str
@@ -109,20 +572,92 @@ class Updater():
             True if a file was added or False on failure.
         """
 
-        ret = True
         filename = basename(update_archive)
 
         try:
-            OLMFile(load=update_archive)
-            copyfile(update_archive, self._cache_dir + filename)
-            if filename not in self._cache:
-                self._cache.append(filename)
-                self._cache.sort()
-                self._log.info(filename + " was added to cache")
-            else:
-                self._log.info("overwrote " + filename + " in cache")
+            fd = os_open(update_archive, O_RDONLY)
+        except OSError as exc:
+            self._log.error("failed to add {}: {}".format(filename, exc))
+            return False
+
+        try:
+            ret = self._add_update_archive(filename, fd)
+        finally:
+            close(fd)
+
+        return ret
+
+    def add_update_archive_fd(self, filename: str, fd: int) -> bool:
+        """Copies a open update archive into the update archive cache.
+
+        The update archive is copied to a temporary file in the hidden
+        :data:`PARTIAL_DIR` of the cache directory and then renamed into it,
+        so adds running at the same time (even of the same filename) never
+        see a partial copy. Only the rename and the
+        cache list change are done with the lock held.
+
+        The copy is made with the cheapest method that works (see
+        :func:`ingest_fd`); a reflink if possible. It is never hardlinked, as
+        the caller could still change it after it was added. The time and
+        bytes for each method are in :attr:`ingest_stats`.
+
+        Parameters
+        ----------
+        filename: str
+            The filename of the update archive.
+        fd: int
+            A file descriptor for the update archive. It is not closed.
+
+        Returns
+        -------
+        bool
+            True if a file was added or False on failure.
+        """
+
+        return self._add_update_archive(filename, fd)
+
+    def _add_update_archive(self, filename: str, fd: int,
+                            link_path=None) -> bool:
+        """Add a open update archive to the cache, see
+        :meth:`add_update_archive_fd`. The link path is only for files the
+        daemon made (uploads), they are hardlinked if possible.
+        """
+
+        ret = True
+        filename = basename(filename)
+
+        try:
+            OLMFile(load=filename)
         except Exception:
             self._log.error(filename + " is a invalid filename")
+            return False
+
+        tmp = "{}{}{}.{}".format(self._cache_dir, PARTIAL_DIR, filename,
+                                 uuid4().hex)
+        try:
+            start = perf_counter()
+            method = ingest_fd(fd, tmp, link_path)
+            elapsed = perf_counter() - start
+            size = stat(tmp).st_size
+            with self._stage_cond:
+                replace(tmp, self._cache_dir + filename)
+                if isfile(tmp):  # both were links to the same file
+                    remove(tmp)
+                if self._cache.add(filename):
+                    self._log.info(filename + " was added to cache")
+                else:
+                    self._log.info("overwrote " + filename + " in cache")
+                stats = self._ingest_stats[method]
+                stats["count"] += 1
+                stats["bytes"] += size
+                stats["seconds"] += elapsed
+                self._stage_cond.notify_all()
+            self._log.debug("{} {} bytes in {:.3f} s with {}".format(
+                filename, size, elapsed, method))
+        except OSError as exc:
+            self._log.error("failed to add {}: {}".format(filename, exc))
+            if isfile(tmp):
+                remove(tmp)
             ret = False
 
         return ret
@@ -134,8 +669,22 @@ class Updater():
         and resume the update, otherwise it will get the oldest archive from
         the update archive cache and run it.
 
-        If the update fails, the cache will be cleared, as it is asume all
-        newer updates require the failed updated to be run successfully first.
+        The progress of the update is saved in a :class:`UpdateJournal` in the
+        working directory. When resuming, extraction is skipped if the
+        extracted files are still intact and the instructions that already
+        finished are not run again. A batch of :meth:`update_all` interrupted
+        by a reboot is resumed instead (see :meth:`_resume_batch`) and the
+        worst result of its update archives is returned.
+
+        Before the first instruction is run, the deb files are checked
+        against the installed packages (see :meth:`_preflight`), so a update
+        that dpkg would fail on fails before the critical section. Not done
+        when streaming, as the deb files are not extracted yet, or when
+        resuming a partly run update.
+
+        If the update fails, the update archives in the cache that require the
+        failed update (see :meth:`_dependents`) are deleted, the rest are
+        kept.
 
         Raises
         ------
@@ -148,107 +697,866 @@ class Updater():
             A :class:`Result` value.
         """
 
-        ret = Result.SUCCESS
-        self._lock.acquire()
+        # a batch from update_all() was interrupted, finish it first
+        results = self._resume_batch()
+        if results is not None:
+            self._last_update_archive = results[-1][0] if results else ""
+            return max([i[1] for i in results], default=Result.NOTHING.value)
 
-        if self._is_updating:
-            self._lock.release()
-            raise UpdaterError("can't start an new update while updating")
+        self._begin_update()
 
-        self._update_archive = ""
-        self._is_updating = True
-        self._lock.release()
+        # if not resuming, get new update archive from cache
+        journal = self._resume_update()
+        if self._update_archive == "":
+            journal = self._pop_update()
+
+        if self._update_archive == "":  # nothing to do
+            ret = Result.NOTHING
+        else:
+            ret = self._run_update(journal)
+
+        # if update failed
+        if ret in [Result.FAILED_NON_CRIT, Result.FAILED_CRIT]:
+            self._delete_dependents([self._update_archive])
+
+        self._log.info("update {} result {}, {} dpkg package operations "
+                       "skipped".format(self._update_archive, ret,
+                                        self._skipped_packages))
+        self._last_update_archive = self._update_archive
+        self._end_update()
+        return ret.value
+
+    def _resume_update(self) -> UpdateJournal:
+        """Find a interrupted update in the working directory and make it the
+        update archive. If there is nothing to resume, the working directory
+        is cleared.
+
+        Returns
+        -------
+        UpdateJournal
+            The journal of the update or None if there is no journal for it or
+            nothing to resume.
+        """
 
-        # something in working dir, see if it an update to resume
         file_list = listdir(self._work_dir)
-        if len(file_list) != 0:
-            self._log.info("files found in working dir")
-
-            # find update archive in work directory
-            for fname in file_list:
-                if is_update_archive(fname):
-                    self._update_archive = self._work_dir + fname
-                    self._log.info("resuming update with " + fname)
-                    break
+        if len(file_list) == 0:
+            return None
 
-            if self._update_archive == "":  # Nothing to resume
-                self._log.info("nothing to resume")
-                self._log.info("clearing working directory")
-                rmtree(self._work_dir, ignore_errors=True)
-                Path(self._work_dir).mkdir(parents=True, exist_ok=True)
+        self._log.info("files found in working dir")
 
-        # if not resuming, get new update archive from cache
-        if self._update_archive == "" and len(self._cache) != 0:
-            self._update_archive = \
-                move(self._cache_dir + self._cache.pop(0), self._work_dir)
-            msg = "got {} from cache".format(basename(self._update_archive))
-            self._log.info(msg)
+        # find update archive in work directory
+        resume = [i for i in file_list if is_update_archive(i)]
+        if len(resume) == 0:
+            self._log.info("nothing to resume")
+            self._log.info("clearing working directory")
+            rmtree(self._work_dir, ignore_errors=True)
+            Path(self._work_dir).mkdir(parents=True, exist_ok=True)
+            return None
 
-        if self._update_archive == "":  # nothing to do
-            ret = Result.NOTHING
+        self._update_archive = resume[0]
+        self._log.info("resuming update with " + resume[0])
+        journal = UpdateJournal.load(self._work_dir + JOURNAL_FILE)
+        if journal is None or journal.update_archive != resume[0]:
+            return None
 
-        # if there is a update archive to use, open it
-        if ret == Result.SUCCESS:
-            self._update_archive = basename(self._update_archive)
-            self._log.info("opening " + self._update_archive)
-            try:
-                inst_list = extract_update_archive(
-                        self._work_dir + self._update_archive,
-                        self._work_dir)
-                self._log.debug(self._update_archive + " successfully opened")
-            except (UpdateArchiveError, InstructionError, FileNotFoundError) \
-                    as exc:
-                self._log.critical(exc)
-                ret = Result.FAILED_NON_CRIT
-
-        # if update archive opened successfully, run the update
-        if ret == Result.SUCCESS:
-            self._log.info("running update")
-            """
-            No turn back point, the update is starting!!!
-            If anything fails/errors the board's software could break.
-            All errors are log at critical level.
-            """
+        self._log.info("{} instructions already completed"
+                       .format(journal.completed))
+        return journal
+
+    def _pop_update(self) -> UpdateJournal:
+        """Move the oldest update archive in the cache into the working
+        directory and make it the update archive, with its staged files if it
+        was staged.
+
+        Returns
+        -------
+        UpdateJournal
+            The journal of the update if the staged files were used or None.
+        """
+
+        while len(self._cache) != 0:
+            with self._stage_cond:
+                self._stage_cond.wait_for(lambda: not self._staging)
+                fname = self._cache.pop()
+                staged = self._stage_dir is not None and \
+                    self._take_staged(fname)
             try:
-                self._total_instructions = len(inst_list)
-                for i in range(self._total_instructions):
-                    self._current_instruction_index = i
-                    self._current_command = inst_list[i].bash_command
-                    inst_list[i].run(self._log)
-                self._log.debug(self._update_archive + " successfully ran")
-            except (UpdateArchiveError, InstructionError, FileNotFoundError) \
-                    as exc:
-                self._log.critical(exc)
+                move(self._cache_dir + fname, self._work_dir)
+            except FileNotFoundError:  # see CacheIndex
+                self._log.error(fname + " is missing from the cache")
+                continue
+
+            self._update_archive = fname
+            self._log.info("got {} from cache".format(fname))
+            if not staged:
+                return None
+
+            self._log.info("using staged files for " + fname)
+            journal = UpdateJournal(self._work_dir + JOURNAL_FILE, fname, True)
+            journal.save()
+            return journal
+
+        return None
+
+    def _run_update(self, journal: UpdateJournal) -> Result:
+        """Open the update archive in the working directory, check its deb
+        files and run it, see :meth:`update`.
+
+        Parameters
+        ----------
+        journal: UpdateJournal
+            The journal of the update or None to start a new one.
+
+        Returns
+        -------
+        Result
+            The result of the update.
+        """
+
+        if journal is None:
+            journal = UpdateJournal(self._work_dir + JOURNAL_FILE,
+                                    self._update_archive)
+
+        stream = None
+        inst_list = None
+        if journal.extracted:
+            inst_list = self._read_extracted(journal.completed)
+        if inst_list is None:
+            inst_list, stream = self._open(
+                    self._work_dir + self._update_archive, self._work_dir,
+                    self._streaming)
+
+        ret = Result.FAILED_NON_CRIT
+        if inst_list is not None:
+            journal.extracted = stream is None
+            journal.save()
+
+            # merge consecutive dpkg instructions and defer their triggers
+            inst_list = plan_instructions(inst_list)
+
+            dpkg_status = None
+            failed = None
+            if stream is None and journal.completed == 0:
+                dpkg_status, failed = self._preflight(inst_list)
+
+            # if update archive opened successfully, run the update
+            if failed is None:
+                self._log.info("running update")
+                """
+                No turn back point, the update is starting!!!
+                If anything fails/errors the board's software could break.
+                All errors are log at critical level.
+                """
                 ret = Result.FAILED_CRIT
+                if self._run_plan(inst_list, stream, journal, dpkg_status):
+                    self._log.debug(self._update_archive + " successfully ran")
+                    ret = Result.SUCCESS
 
-        # if update failed
-        if ret in [Result.FAILED_NON_CRIT, Result.FAILED_CRIT]:
-            self._log.info("clearing file cache due to failed update")
+        if stream is not None:
+            stream.stop()
+
+        return ret
+
+    def _open(self, path: str, work_dir: str, streaming: bool = False) \
+            -> tuple:
+        """Open a update archive, extracting it into a directory.
+
+        Parameters
+        ----------
+        path: str
+            Path to the update archive.
+        work_dir: str
+            Directory to extract the update archive into.
+        streaming: bool
+            Extract the update archive in the background with a
+            :class:`UpdateArchiveStream`.
+
+        Returns
+        -------
+        tuple
+            The list of :class:`Instruction` or None if the update archive
+            failed to open (logged at critical level) and the stream or None
+            if not streaming.
+        """
+
+        self._log.info("opening " + basename(path))
+        Path(work_dir).mkdir(parents=True, exist_ok=True)
 
-            files = ""
-            for i in self._cache:
-                files += basename(i) + " "
-            self._log.info("deleted " + files)
+        stream = None
+        try:
+            if streaming:
+                stream = UpdateArchiveStream(path, work_dir)
+                stream.start()
+                inst_list = stream.read_instructions()
+            else:
+                inst_list = extract_update_archive(path, work_dir)
+        except (UpdateArchiveError, InstructionError, FileNotFoundError) \
+                as exc:
+            self._log.critical(exc)
+            return None, stream
+
+        self._log.debug(basename(path) + " successfully opened")
+        return inst_list, stream
+
+    def update_all(self) -> list:
+        """Run every update archive in the cache in one pass, oldest first.
+
+        A interrupted update in the working directory is resumed first with
+        :meth:`update`. Then all update archives in the cache are extracted
+        and their instructions are merged into one plan (see
+        :func:`plan_batch`), so dpkg is called less and packages that a later
+        update archive installs again in the same dpkg call are not installed
+        twice. Each
+        update archive is removed from the cache as soon as all instructions
+        for it finished.
+
+        If a update archive fails to extract or the pre-flight check of its
+        deb files (see :meth:`_preflight`), it and the update archives that
+        require it are deleted and the rest are still run. If a instruction
+        fails, the update archives it was for and the update archives that
+        were partly run fail, they and the update archives that require them
+        are deleted. Update archives that were not started are kept.
+
+        The merged plan and the number of its instructions that finished are
+        saved in a :class:`UpdateJournal`, so a batch interrupted by a reboot
+        is resumed by the next update (see :meth:`_resume_batch`) without
+        running any instruction again.
+
+        Raises
+        ------
+        UpdaterError
+            If called when already updating.
+
+        Returns
+        -------
+        list
+            A (filename, :class:`Result` value) tuple for each update archive
+            that was run, in the order the results were known, so update
+            archives that failed to extract or the pre-flight check come
+            first. Empty if there was nothing to do.
+        """
+
+        if self._is_updating:
+            raise UpdaterError("can't start an new update while updating")
+
+        # finish a interrupted batch or update first, they have their own
+        # journal
+        results = self._resume_batch()
+        if results is None:
+            results = []
+            resume = [i for i in listdir(self._work_dir)
+                      if is_update_archive(i)]
+            if len(resume) != 0:
+                ret = self.update()
+                if ret != Result.NOTHING.value:
+                    results.append((resume[0], ret))
+
+        self._begin_update()
+        with self._lock:
+            names = self._cache.names()
+
+        rmtree(self._work_dir, ignore_errors=True)
+        Path(self._work_dir).mkdir(parents=True, exist_ok=True)
+
+        # extract all update archives, each in its own directory
+        batch = []
+        inst_lists = []
+        failed = []
+        for fname in names:
+            self._update_archive = fname
+            inst_list, _ = self._open(self._cache_dir + fname,
+                                      self._work_dir + str(len(batch)))
+            if inst_list is None:
+                failed.append(fname)
+            else:
+                batch.append(fname)
+                inst_lists.append(inst_list)
+        self._drop_failed(failed, batch, inst_lists, results)
+
+        # drop update archives that fail the pre-flight check and plan again
+        plan, owners = plan_batch(inst_lists)
+        dpkg_status, index = self._preflight(plan)
+        while index is not None:
+            failed = [batch[j] for j in sorted(owners[index])]
+            self._drop_failed(failed, batch, inst_lists, results)
+            plan, owners = plan_batch(inst_lists)
+            dpkg_status, index = self._preflight(plan)
+
+        if len(batch) != 0:
+            journal = UpdateJournal(self._work_dir + JOURNAL_FILE, "", True,
+                                    batch=batch, plan=plan, owners=owners)
+            journal.save()
+            results += self._run_batch(journal, dpkg_status)
+
+        self._log.info("updated {} update archives, {} dpkg package "
+                       "operations skipped".format(len(results),
+                                                   self._skipped_packages))
+        self._end_update()
+        return results
+
+    def _drop_failed(self, failed: list, batch: list, inst_lists: list,
+                     results: list):
+        """Fail update archives of a batch before it is run. They and the
+        update archives that require them are deleted and removed from the
+        batch.
+
+        Parameters
+        ----------
+        failed: list
+            The filenames of the update archives that failed.
+        batch: list
+            The filenames of the update archives in the batch, changed in
+            place.
+        inst_lists: list
+            The list of :class:`Instruction` of each update archive in the
+            batch, changed in place.
+        results: list
+            The (filename, :class:`Result` value) tuples of the batch, the
+            failed update archives are appended to it.
+        """
+
+        if len(failed) == 0:
+            return
+
+        results.extend([(i, Result.FAILED_NON_CRIT.value) for i in failed])
+        with self._lock:
+            for fname in failed:
+                self._remove_cached(fname)
+
+        deleted = failed + self._delete_dependents(failed)
+        inst_lists[:] = [inst_lists[i] for i in range(len(batch))
+                         if batch[i] not in deleted]
+        batch[:] = [i for i in batch if i not in deleted]
+
+    def _resume_batch(self) -> list:
+        """Resume a batch of update archives interrupted by a reboot from its
+        journal in the working directory, see :meth:`update_all`. The planned
+        instructions that already finished are not run again.
+
+        If the extracted files the rest of the plan needs are not intact, the
+        update archives started but not finished fail like when a instruction
+        fails.
+
+        Raises
+        ------
+        UpdaterError
+            If called when already updating.
+
+        Returns
+        -------
+        list
+            A (filename, :class:`Result` value) tuple for each update archive
+            of the batch that finished or failed or None if there is no batch
+            to resume.
+        """
+
+        journal = UpdateJournal.load(self._work_dir + JOURNAL_FILE)
+        if journal is None or journal.batch is None:
+            return None
+
+        self._begin_update()
+        self._log.info("resuming batch of {} update archives, {} instructions "
+                       "already completed".format(len(journal.batch),
+                                                  journal.completed))
+
+        results = self._run_batch(journal)
+
+        self._log.info("updated {} update archives, {} dpkg package "
+                       "operations skipped".format(len(results),
+                                                   self._skipped_packages))
+        self._end_update()
+        return results
+
+    def _run_batch(self, journal: UpdateJournal, dpkg_status=None) -> list:
+        """Run the planned instructions of a batch of update archives from
+        their journal, from the instruction after the last one completed.
+        Each update archive is removed from the cache as soon as all
+        instructions for it finished.
+
+        If a instruction fails, the update archives that were started but not
+        finished fail, they and the update archives that require them are
+        deleted.
+
+        Parameters
+        ----------
+        journal: UpdateJournal
+            The journal of the batch, with the plan.
+        dpkg_status: DpkgStatus
+            See :meth:`_run_plan`.
+
+        Returns
+        -------
+        list
+            A (filename, :class:`Result` value) tuple for each update archive
+            that finished or failed, in the order they did.
+        """
+
+        batch = journal.batch
+        plan = journal.plan
+        owners = journal.owners
+        results = []
+
+        last = [-1] * len(batch)  # index of the last instruction for each
+        for i in range(len(owners)):
+            for j in owners[i]:
+                last[j] = i
+
+        ran = []  # update archives that finished
+
+        def done(index: int):
+            for j in range(len(batch)):
+                if j not in ran and last[j] <= index:
+                    ran.append(j)
+                    with self._lock:
+                        # not if it finished before a reboot
+                        if batch[j] in self._cache:
+                            results.append((batch[j], Result.SUCCESS.value))
+                            self._remove_cached(batch[j])
+                    self._log.info(batch[j] + " successfully ran")
+
+            left = [batch[j] for j in range(len(batch)) if j not in ran]
+            self._update_archive = left[0] if len(left) != 0 else ""
+
+        self._log.info("running {} update archives in {} instructions"
+                       .format(len(batch), len(plan)))
+        done(journal.completed - 1)
+        intact = journal.completed == 0 or \
+            self._verify_batch(plan, journal.completed)
+        if intact and self._run_plan(plan, journal=journal,
+                                     dpkg_status=dpkg_status, done=done):
+            return results
+
+        # everything started but not finished failed
+        index = max(self._current_instruction_index, journal.completed)
+        started = set().union(*owners[:index + 1])
+        failed = [batch[j] for j in sorted(started) if j not in ran]
+        for fname in failed:
+            results.append((fname, Result.FAILED_CRIT.value))
+        with self._lock:
+            for fname in failed:
+                self._remove_cached(fname)
+        self._delete_dependents(failed)
+
+        return results
+
+    def _verify_batch(self, plan: list, start: int) -> bool:
+        """Check the extracted files needed by the planned instructions of a
+        batch from start on are intact, see :meth:`_read_extracted`.
+
+        Returns
+        -------
+        bool
+            True if they are intact or False if a file is missing or does not
+            match its manifest (logged at critical level).
+        """
+
+        files = {}  # update archive directory: files
+        for i in range(len(plan)):
+            if plan[i].type == InstructionType.SUPPORT_FILE or \
+                    (i >= start and plan[i].type in INSTRUCTIONS_WITH_FILES):
+                for item in plan[i].items:
+                    files.setdefault(dirname(item), []).append(item)
+
+        try:
+            for work_dir, items in files.items():
+                verify_extracted_files(work_dir, items)
+        except UpdateArchiveError as exc:
+            self._log.critical(exc)
+            return False
+
+        return True
+
+    def _preflight(self, inst_list: list) -> tuple:
+        """Check the deb files of planned instructions against the installed
+        packages, see :func:`check_plan`. Skipped if there is no dpkg status
+        file.
+
+        Parameters
+        ----------
+        inst_list: list
+            The list of planned :class:`Instruction`.
+
+        Returns
+        -------
+        tuple
+            The installed packages it checked against (a
+            :class:`DpkgStatus`), so the run does not have to parse the dpkg
+            status file again, or None if skipped, and the index of the
+            planned instruction that would fail (logged at critical level) or
+            None if none would.
+        """
+
+        if not any([i.type == InstructionType.DPKG_INSTALL
+                    for i in inst_list]):
+            return None, None
+
+        start = perf_counter()
+        dpkg_status = self._load_dpkg_status()
+        if dpkg_status is None:
+            self._log.info("skipping pre-flight check")
+            return None, None
 
-            rmtree(self._cache_dir, ignore_errors=True)
-            Path(self._cache_dir).mkdir(parents=True, exist_ok=True)
-            self._lock.acquire()
-            self._cache = []
-            self._lock.release()
+        if self._archs is None:
+            self._archs = dpkg_architectures()
+
+        try:
+            count = check_plan(inst_list, dpkg_status, self._archs)
+        except PreflightError as exc:
+            self._log.critical(exc)
+            return dpkg_status, exc.index
+
+        self._log.info("pre-flight check of {} deb files took {:.3f} s"
+                       .format(count, perf_counter() - start))
+        return dpkg_status, None
+
+    def _load_dpkg_status(self) -> DpkgStatus:
+        """Load the dpkg status file.
+
+        Returns
+        -------
+        DpkgStatus
+            The installed packages or None if there is no dpkg status file.
+        """
+
+        try:
+            return DpkgStatus.from_file(DPKG_STATUS_FILE)
+        except FileNotFoundError:
+            self._log.info("no dpkg status file " + DPKG_STATUS_FILE)
+            return None
+
+    def _begin_update(self):
+        """Set the update properties for a new update.
+
+        Raises
+        ------
+        UpdaterError
+            If called when already updating.
+        """
+
+        with self._lock:
+            if self._is_updating:
+                raise UpdaterError("can't start an new update while updating")
+
+            self._update_archive = ""
+            self._is_updating = True
+            self._skipped_packages = 0
+
+    def _end_update(self):
+        """Clear the working directory and the update properties."""
 
-        self._log.info("update {} result {}".format(self._update_archive, ret))
         self._log.debug("clearing working directory")
         rmtree(self._work_dir, ignore_errors=True)
         Path(self._work_dir).mkdir(parents=True, exist_ok=True)
         self._total_instructions = 0
         self._current_instruction_index = 0
         self._current_command = ""
+        self._output.reset()
 
         self._lock.acquire()
         self._update_archive = ""
         self._is_updating = False
+        self._stage_cond.notify_all()  # stage the next update archive
         self._lock.release()
-        return ret.value
+
+    def _delete_dependents(self, failed: list) -> list:
+        """Delete the update archives in the cache that require failed update
+        archives (see :meth:`_dependents`).
+
+        Parameters
+        ----------
+        failed: list
+            The filenames of the failed update archives.
+
+        Returns
+        -------
+        list
+            The filenames deleted.
+        """
+
+        self._log.info("removing update archives that require the failed "
+                       "update from the cache")
+
+        with self._lock:
+            files = self._dependents(failed)
+            for fname in files:
+                self._remove_cached(fname)
+
+        self._log.info("deleted " + " ".join(files))
+        self._log.info("kept {} update archives".format(len(self._cache)))
+        return files
+
+    def _remove_cached(self, fname: str):
+        """Delete a update archive from the cache. Must be called with the
+        lock held.
+        """
+
+        if isfile(self._cache_dir + fname):
+            remove(self._cache_dir + fname)
+        self._cache.remove(fname)
+
+    def _dependents(self, failed: list) -> list:
+        """Find the update archives in the cache that require failed update
+        archives, directly or thru other update archives. Update archives
+        without a `requires` list in their manifest are assumed to require
+        every older update archive, as are update archives whose manifest
+        can't be read. Must be called with the lock held.
+
+        Parameters
+        ----------
+        failed: list
+            The filenames of the failed update archives.
+
+        Returns
+        -------
+        list
+            The filenames, oldest first.
+        """
+
+        failed_date = min([OLMFile(load=i).date for i in failed])
+        dependents = []
+        removed = set(failed)
+
+        # update archives can only require older ones, so oldest first is a
+        # topological order of the dependency graph
+        for fname in self._cache.names():
+            try:
+                manifest = read_update_manifest(self._cache_dir + fname)
+                requires = manifest.get("requires")
+            except (UpdateArchiveError, OSError):
+                requires = None
+
+            if requires is None:
+                required = OLMFile(load=fname).date >= failed_date
+            else:
+                required = not removed.isdisjoint(requires)
+
+            if required:
+                dependents.append(fname)
+                removed.add(fname)
+
+        return dependents
+
+    def _read_extracted(self, start: int) -> list:
+        """Read the instructions of the update archive already extracted in
+        the working directory and check the files needed by the instructions
+        from start on are intact.
+
+        Parameters
+        ----------
+        start: int
+            Index of the first planned instruction that will be run.
+
+        Returns
+        -------
+        list
+            The list of :class:`Instruction` or None if the update archive
+            must be extracted again.
+        """
+
+        try:
+            inst_list = read_extracted_instructions(self._work_dir)
+
+            # bash scripts can use any of the support files
+            files = []
+            plan = plan_instructions(inst_list)
+            for i in range(len(plan)):
+                if plan[i].type == InstructionType.SUPPORT_FILE or \
+                        (i >= start and
+                         plan[i].type in INSTRUCTIONS_WITH_FILES):
+                    files += plan[i].items
+
+            verify_extracted_files(self._work_dir, files)
+        except UpdateArchiveError as exc:
+            self._log.info("extracted files not intact, {}".format(exc))
+            return None
+
+        self._log.info("extracted files intact, skipping extraction")
+        return inst_list
+
+    def _run_plan(self, inst_list: list, stream=None, journal=None,
+                  dpkg_status=None, done=None) -> bool:
+        """Run planned instructions in order. Pending triggers are run before
+        each bash script and at the end.
+
+        dpkg operations already done (e.g. when a update is resumed or sent
+        again) are skipped, see :meth:`_skip_satisfied`.
+
+        If a journal is given, instructions before its completed count are
+        skipped and it is saved after each instruction.
+
+        Parameters
+        ----------
+        inst_list: list
+            The list of planned :class:`Instruction`.
+        stream: UpdateArchiveStream
+            The stream the update archive is being extracted with or None if
+            it was already fully extracted. When streaming, each instruction
+            will wait for its files and the deb files are deleted once no
+            later instruction uses them.
+        journal: UpdateJournal
+            The journal of the update or None.
+        dpkg_status: DpkgStatus
+            Optional, the installed packages if already loaded (e.g. by
+            :meth:`_preflight`), so the dpkg status file is not parsed again
+            before the first dpkg instruction.
+        done: function
+            Optional, called with the index of each instruction after it
+            finished. For the last one, after the pending triggers ran.
+
+        Returns
+        -------
+        bool
+            True if all instructions ran or False if a instruction failed or
+            a file is missing from the update archive (logged at critical
+            level).
+        """
+
+        start = 0 if journal is None else journal.completed
+
+        # triggers could be left pending by an instruction before the resume
+        triggers_pending = start != 0
+
+        last_use, support_files = _file_uses(inst_list)
+
+        self._total_instructions = len(inst_list)
+        try:
+            for i in range(start, self._total_instructions):
+                self._current_instruction_index = i
+                self._current_command = inst_list[i].bash_command
+                self._output.reset()
+
+                if stream is not None:
+                    self._wait_for_files(stream, inst_list[i], support_files)
+
+                dpkg_status, triggers_pending = self._run_instruction(
+                        inst_list[i], dpkg_status, triggers_pending)
+
+                if stream is not None:
+                    for item in [k for k, v in last_use.items() if v == i]:
+                        remove(item)
+
+                if journal is not None:
+                    journal.completed = i + 1
+                    if stream is not None:
+                        journal.extracted = stream.finished
+                    journal.save()
+
+                if done is not None and i + 1 != self._total_instructions:
+                    done(i)
+
+            if triggers_pending:
+                self._run_triggers()
+        except (UpdateArchiveError, InstructionError, FileNotFoundError) \
+                as exc:
+            self._log.critical(exc)
+            return False
+
+        if done is not None and self._total_instructions != 0:
+            done(self._total_instructions - 1)
+
+        return True
+
+    def _wait_for_files(self, stream: UpdateArchiveStream,
+                        inst: Instruction, support_files: list):
+        """Wait for the stream to extract the files a planned instruction
+        needs. Bash scripts can use any of the support files.
+
+        Raises
+        ------
+        UpdateArchiveError
+            A file is missing from the update archive.
+        """
+
+        if inst.type in INSTRUCTIONS_WITH_FILES:
+            stream.wait_for(inst.items)
+            if inst.type == InstructionType.BASH_SCRIPT:
+                stream.wait_for(support_files)
+
+    def _run_instruction(self, inst: Instruction, dpkg_status: DpkgStatus,
+                         triggers_pending: bool) -> tuple:
+        """Run a planned instruction, without the dpkg operations already done
+        (see :meth:`_skip_satisfied`). Pending triggers are run first if it is
+        a bash script.
+
+        Parameters
+        ----------
+        inst: Instruction
+            The planned instruction.
+        dpkg_status: DpkgStatus
+            The installed packages or None if not loaded.
+        triggers_pending: bool
+            Triggers could be pending.
+
+        Raises
+        ------
+        InstructionError
+            The instruction failed.
+
+        Returns
+        -------
+        tuple
+            The installed packages (None if the instruction could have changed
+            them) and if triggers could be pending after it.
+        """
+
+        inst, dpkg_status = self._skip_satisfied(inst, dpkg_status)
+        if inst is None:
+            return dpkg_status, triggers_pending
+
+        if triggers_pending and inst.type == InstructionType.BASH_SCRIPT:
+            self._run_triggers()
+            self._current_command = inst.bash_command
+            self._output.reset()
+            triggers_pending = False
+
+        if inst.type != InstructionType.SUPPORT_FILE:
+            dpkg_status = None
+        inst.run(self._log, self._output)
+
+        return dpkg_status, triggers_pending or inst.defer_triggers
+
+    def _skip_satisfied(self, inst: Instruction, dpkg_status: DpkgStatus) \
+            -> tuple:
+        """Remove the dpkg operations already done from a dpkg instruction,
+        see :func:`remove_satisfied`. If there is no dpkg status file, nothing
+        is skipped and dpkg is left to report it.
+
+        Parameters
+        ----------
+        inst: Instruction
+            The planned instruction.
+        dpkg_status: DpkgStatus
+            The installed packages or None to load them (if needed).
+
+        Returns
+        -------
+        tuple
+            The instruction (None if there is nothing left to do) and the
+            installed packages, if loaded.
+        """
+
+        if inst.type not in DPKG_INSTRUCTIONS:
+            return inst, dpkg_status
+
+        # loaded when needed, after anything changes it
+        if dpkg_status is None:
+            dpkg_status = self._load_dpkg_status()
+        if dpkg_status is not None:
+            inst, skipped = remove_satisfied(inst, dpkg_status)
+            if len(skipped) != 0:
+                self._log.info("skipping already done dpkg operations on " +
+                               " ".join(skipped))
+                self._skipped_packages += len(skipped)
+
+        self._current_command = "" if inst is None else inst.bash_command
+        return inst, dpkg_status
+
+    def _run_triggers(self):
+        """Run the pending dpkg triggers."""
+
+        self._current_command = DPKG_TRIGGERS_COMMAND
+        self._output.reset()
+        run_pending_triggers(self._log, self._output)
 
     @property
     def available_update_archives(self) -> int:
@@ -258,9 +1566,11 @@ class Updater():
 
     @property
     def list_updates(self) -> str:
-        """str: Get a JSON list of filename in cache. Readonly."""
+        """str: Get a JSON list of filename in cache, oldest first. Readonly.
+        """
 
-        return json.dumps(self._cache)
+        with self._lock:
+            return self._cache.listing
 
     @property
     def is_updating(self) -> bool:
@@ -268,6 +1578,14 @@ class Updater():
 
         return self._is_updating
 
+    @property
+    def last_update_archive(self) -> str:
+        """str: The filename of the update archive the last :meth:`update`
+        ran, or a empty str if it had nothing to do. Readonly.
+        """
+
+        return self._last_update_archive
+
     @property
     def update_archive(self) -> str:
         """str: Current update archive while updating. Will be a empty
@@ -299,3 +1617,47 @@ class Updater():
         """
 
         return self._current_command
+
+    @property
+    def instruction_output_bytes(self) -> int:
+        """int: The number of bytes of output from the current bash command so
+        far. Will be 0 if the not currently updating. Readonly.
+        """
+
+        return self._output.bytes
+
+    @property
+    def instruction_output_lines(self) -> int:
+        """int: The number of lines of output from the current bash command so
+        far. Will be 0 if the not currently updating. Readonly.
+        """
+
+        return self._output.lines
+
+    @property
+    def list_uploads(self) -> str:
+        """str: Get a JSON list of the filenames of update archives being
+        uploaded in parts. Readonly.
+        """
+
+        with self._upload_lock:
+            return json.dumps(sorted(self._uploads))
+
+    @property
+    def ingest_stats(self) -> str:
+        """str: A JSON dictionary with the number of update archives added,
+        the total bytes, and the total seconds for each ingest method (see
+        :data:`INGEST_METHODS`). Bytes for "link" and "reflink" were not
+        copied. Readonly.
+        """
+
+        with self._lock:
+            return json.dumps(self._ingest_stats)
+
+    @property
+    def skipped_packages(self) -> int:
+        """int: The number of dpkg package operations skipped in the current
+        or last update, because they were already done. Readonly.
+        """
+
+        return self._skipped_packages
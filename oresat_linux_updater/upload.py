@@ -0,0 +1,240 @@
+"""
+Update Archive Upload
+=====================
+
+A update archive can be uploaded in parts, in any order and over multiple
+passes, instead of as one file.
+
+Each upload is two files in the upload directory, the update archive itself
+(made at its full size when the upload begins, each part is written in place)
+and a JSON state file with the total size and SHA-256 of the update archive,
+the part size, and the indexes of the parts received so far. A part is flushed
+to storage before it is added to the state, so uploads survive restarts.
+
+**Example state file**::
+
+    {
+        "size": 2500000,
+        "sha256": "b5d4...03c2",
+        "part_size": 1000000,
+        "received": [0, 2]
+    }
+"""
+
+import json
+import hashlib
+import zlib
+from os import open as os_open, close, pwrite, fdatasync, ftruncate, \
+        remove, O_WRONLY, O_CREAT
+from os.path import isfile
+from oresat_linux_updater.journal import save_json
+
+UPLOAD_EXT = ".upload"
+"""The extension added to the filename of a update archive being uploaded."""
+
+STATE_EXT = ".json"
+"""The extension added to the upload file for its state file."""
+
+HASH_CHUNK_SIZE = 1024 * 1024
+"""The size of the chunks the update archive is hashed in."""
+
+
+class UploadError(Exception):
+    """Invalid upload or part."""
+
+
+class Upload():
+    """A update archive that is being uploaded in parts."""
+
+    def __init__(self, path: str, size: int, sha256: str, part_size: int,
+                 received=None):
+        """
+        Parameters
+        ----------
+        path: str
+            Path to the upload file. The state file is the path with
+            :data:`STATE_EXT` added.
+        size: int
+            The size of the whole update archive in bytes.
+        sha256: str
+            The SHA-256 hex digest of the whole update archive.
+        part_size: int
+            The size of every part, except the last one.
+        received: list
+            The indexes of the parts already received.
+
+        Raises
+        ------
+        UploadError
+            Invalid size, hash, or part size.
+        """
+
+        if size <= 0 or part_size <= 0:
+            raise UploadError("invalid size or part size")
+        if len(sha256) != 64:
+            raise UploadError("invalid sha256")
+
+        self._path = path
+        self._size = size
+        self._sha256 = sha256.lower()
+        self._part_size = part_size
+        self._received = set(received if received is not None else [])
+
+    def __repr__(self):
+        return "{}: {} {}/{}".format(self.__class__.__name__, self._path,
+                                     len(self._received), self.parts)
+
+    @classmethod
+    def load(cls, path: str):
+        """Load a upload from its state file.
+
+        Parameters
+        ----------
+        path: str
+            Path to the upload file.
+
+        Returns
+        -------
+        Upload
+            The upload or None if its state file or upload file is missing or
+            invalid.
+        """
+
+        try:
+            with open(path + STATE_EXT, "r") as fptr:
+                data = json.load(fptr)
+            upload = cls(path, data["size"], data["sha256"],
+                         data["part_size"], data["received"])
+        except (OSError, json.JSONDecodeError, UnicodeDecodeError, KeyError,
+                TypeError, UploadError):
+            return None
+
+        if not isfile(path) or \
+                any([i not in range(upload.parts) for i in upload._received]):
+            return None
+
+        return upload
+
+    def begin(self):
+        """Make the upload file at its full size and save the state file.
+
+        Raises
+        ------
+        OSError
+            The files could not be made.
+        """
+
+        fd = os_open(self._path, O_WRONLY | O_CREAT, 0o644)
+        try:
+            ftruncate(fd, self._size)
+        finally:
+            close(fd)
+
+        self._save()
+
+    def _save(self):
+        save_json(self._path + STATE_EXT, {
+            "size": self._size,
+            "sha256": self._sha256,
+            "part_size": self._part_size,
+            "received": sorted(self._received),
+        })
+
+    def add_part(self, index: int, data: bytes, crc32: int):
+        """Write a part in place. A part that was already received is written
+        again.
+
+        Parameters
+        ----------
+        index: int
+            The index of the part.
+        data: bytes
+            The part.
+        crc32: int
+            The CRC-32 of the part.
+
+        Raises
+        ------
+        UploadError
+            Invalid index, size, or CRC-32.
+        OSError
+            The part could not be written.
+        """
+
+        if index not in range(self.parts):
+            raise UploadError("invalid part index {}".format(index))
+
+        offset = index * self._part_size
+        if len(data) != min(self._part_size, self._size - offset):
+            raise UploadError("invalid size for part {}".format(index))
+
+        if zlib.crc32(data) != crc32:
+            raise UploadError("invalid CRC-32 for part {}".format(index))
+
+        fd = os_open(self._path, O_WRONLY)
+        try:
+            pwrite(fd, data, offset)
+            fdatasync(fd)
+        finally:
+            close(fd)
+
+        if index not in self._received:
+            self._received.add(index)
+            self._save()
+
+    def missing(self) -> list:
+        """Get the indexes of the parts not received yet.
+
+        Returns
+        -------
+        list
+            The indexes in order.
+        """
+
+        return [i for i in range(self.parts) if i not in self._received]
+
+    def verify(self):
+        """Check all parts were received and the whole update archive matches
+        the hash.
+
+        Raises
+        ------
+        UploadError
+            A part is missing or the hash does not match.
+        """
+
+        if len(self._received) != self.parts:
+            raise UploadError("missing {} parts".format(len(self.missing())))
+
+        digest = hashlib.sha256()
+        with open(self._path, "rb") as fptr:
+            for chunk in iter(lambda: fptr.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+
+        if digest.hexdigest() != self._sha256:
+            raise UploadError("sha256 does not match")
+
+    def delete(self):
+        """Delete the upload file and the state file."""
+
+        for path in [self._path, self._path + STATE_EXT]:
+            if isfile(path):
+                remove(path)
+
+    def same(self, size: int, sha256: str, part_size: int) -> bool:
+        """Check if the upload is for the same update archive and parts."""
+
+        return self._size == size and self._sha256 == sha256.lower() and \
+            self._part_size == part_size
+
+    @property
+    def path(self) -> str:
+        """str: Path to the upload file."""
+
+        return self._path
+
+    @property
+    def parts(self) -> int:
+        """int: The total number of parts."""
+
+        return (self._size + self._part_size - 1) // self._part_size
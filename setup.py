@@ -21,6 +21,9 @@ setup(
     install_requires=[
         "pydbus"
     ],
+    extras_require={
+        "zstd": ["zstandard"]
+    },
     entry_points={
         'console_scripts': [
             'oresat-linux-updater = oresat_linux_updater.main:main',
@@ -0,0 +1,154 @@
+"""tests for the update archive cache index"""
+
+import json
+from os import remove, stat, utime
+from pathlib import Path
+from oresat_linux_updater import cache_index
+from oresat_linux_updater.cache_index import CacheIndex, INDEX_FILE
+from .common import TEST_CACHE_DIR, clear_test_cache_dir
+
+# newest by name is the oldest by date
+NAMES = ["a_update_1611942222.tar.xz", "b_update_1611941111.tar.xz",
+         "c_update_1611940000.tar.xz"]
+
+
+def _touch(name: str):
+    Path(TEST_CACHE_DIR + name).touch()
+
+
+def _age_log():
+    """Make the log older than the cache directory, as a change in the same
+    timestamp tick as the last log write is not seen.
+    """
+
+    mtime = stat(TEST_CACHE_DIR).st_mtime_ns - 10**9
+    utime(TEST_CACHE_DIR + INDEX_FILE, ns=(mtime, mtime))
+
+
+def test_cache_index():
+    clear_test_cache_dir()
+
+    index = CacheIndex(TEST_CACHE_DIR)
+    assert len(index) == 0
+    assert index.oldest() is None
+    assert index.pop() is None
+    assert index.listing == "[]"
+
+    for name in NAMES:
+        _touch(name)
+        assert index.add(name)
+    assert not index.add(NAMES[0])
+    assert not index.add("invalid_file")
+
+    assert len(index) == 3
+    assert NAMES[1] in index
+    assert index.names() == NAMES[::-1]
+    assert index.listing == json.dumps(NAMES[::-1])
+
+    assert index.pop() == NAMES[2]
+    remove(TEST_CACHE_DIR + NAMES[2])
+    assert index.listing == json.dumps(NAMES[1::-1])
+
+    # removed and added again
+    assert index.remove(NAMES[1])
+    assert not index.remove(NAMES[1])
+    assert index.oldest() == NAMES[0]
+    assert index.add(NAMES[1])
+    assert index.oldest() == NAMES[1]
+
+    # reloaded from the log
+    index = CacheIndex(TEST_CACHE_DIR)
+    assert index.names() == NAMES[1::-1]
+
+    for name in index.names():
+        remove(TEST_CACHE_DIR + name)
+    index.clear()
+    assert len(index) == 0
+    assert CacheIndex(TEST_CACHE_DIR).names() == []
+
+    clear_test_cache_dir()
+
+
+def test_cache_index_log(monkeypatch):
+    """The index should be loaded from the log alone, without listing the
+    cache directory or parsing the filenames.
+    """
+
+    clear_test_cache_dir()
+
+    index = CacheIndex(TEST_CACHE_DIR)
+    for name in NAMES:
+        _touch(name)
+        index.add(name)
+    index.remove(NAMES[0])
+
+    with monkeypatch.context() as patch:
+        patch.setattr(cache_index, "listdir", None)
+        patch.setattr(cache_index, "OLMFile", None)
+        assert CacheIndex(TEST_CACHE_DIR).names() == NAMES[:0:-1]
+
+    clear_test_cache_dir()
+
+
+def test_cache_index_reconcile(monkeypatch):
+    """The index should be rebuilt from the cache directory if it was modified
+    after the log was last written.
+    """
+
+    clear_test_cache_dir()
+
+    index = CacheIndex(TEST_CACHE_DIR)
+    for name in NAMES[1:]:
+        _touch(name)
+        index.add(name)
+
+    # copied in and deleted by something else
+    _touch(NAMES[0])
+    remove(TEST_CACHE_DIR + NAMES[1])
+    _age_log()
+    assert CacheIndex(TEST_CACHE_DIR).names() == [NAMES[2], NAMES[0]]
+
+    # the dates of the logged filenames are not parsed again
+    _age_log()
+    with monkeypatch.context() as patch:
+        patch.setattr(cache_index.OLMFile, "__init__", None)
+        assert CacheIndex(TEST_CACHE_DIR).names() == [NAMES[2], NAMES[0]]
+
+    # the rewritten log is not older than the cache directory
+    with monkeypatch.context() as patch:
+        patch.setattr(cache_index, "listdir", None)
+        assert CacheIndex(TEST_CACHE_DIR).names() == [NAMES[2], NAMES[0]]
+
+    clear_test_cache_dir()
+
+
+def test_cache_index_rebuild(monkeypatch):
+    """The index should be rebuilt from the cache directory if the log is
+    missing or invalid.
+    """
+
+    clear_test_cache_dir()
+
+    index = CacheIndex(TEST_CACHE_DIR)
+    for name in NAMES:
+        _touch(name)
+        index.add(name)
+
+    remove(TEST_CACHE_DIR + NAMES[0])
+    remove(TEST_CACHE_DIR + INDEX_FILE)
+    assert CacheIndex(TEST_CACHE_DIR).names() == NAMES[:0:-1]
+
+    # a append cut short
+    _touch(NAMES[0])
+    with open(TEST_CACHE_DIR + INDEX_FILE, "a") as fptr:
+        fptr.write("- " + NAMES[1])
+    assert CacheIndex(TEST_CACHE_DIR).names() == NAMES[::-1]
+
+    # the rewritten log is used
+    with open(TEST_CACHE_DIR + INDEX_FILE, "r") as fptr:
+        assert fptr.read().endswith("\n")
+    with monkeypatch.context() as patch:
+        patch.setattr(cache_index, "listdir", None)
+        assert CacheIndex(TEST_CACHE_DIR).names() == NAMES[::-1]
+
+    clear_test_cache_dir()
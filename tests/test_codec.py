@@ -0,0 +1,111 @@
+"""tests for the compression codecs"""
+
+import pytest
+import tarfile
+from os import remove
+from oresat_linux_updater import codec as codec_module
+from oresat_linux_updater.codec import CODECS, CodecError, get_codec, \
+        detect_codec, open_archive
+from oresat_linux_updater.instruction import Instruction, InstructionType
+from oresat_linux_updater.update_archive import create_update_archive, \
+        extract_update_archive, is_update_archive, UpdateArchiveError
+from oresat_linux_updater.status_archive import make_status_archive, \
+        read_olu_status_file, read_dpkg_status_file
+from .common import TEST_WORK_DIR, TEST_FILE_DIR, TEST_DEB_PKG1, \
+        TEST_BASH_SCRIPT, TEST_UPDATE0, TEST_UPDATE8, clear_test_work_dir
+
+AVAILABLE_CODECS = [i for i in CODECS if CODECS[i].available]
+
+
+def test_get_codec():
+    """Test getting codecs by name."""
+
+    for name in CODECS:
+        assert get_codec(name).name == name
+
+    with pytest.raises(CodecError):
+        get_codec("invalid")
+
+
+def test_detect_codec():
+    """Test detecting the codec of existing archives."""
+
+    assert detect_codec(TEST_UPDATE0).name == "xz"
+
+    # not a xz file, falls back to the extension
+    assert detect_codec(TEST_UPDATE8).name == "xz"
+
+    with pytest.raises(CodecError):
+        detect_codec("invalid-file")
+
+
+@pytest.mark.parametrize("codec", AVAILABLE_CODECS)
+def test_update_archive_codecs(codec):
+    """Test making and extracting update archives with all codecs."""
+
+    inst_list = [
+                Instruction(InstructionType.DPKG_INSTALL, [TEST_DEB_PKG1]),
+                Instruction(InstructionType.BASH_SCRIPT, [TEST_BASH_SCRIPT])
+            ]
+
+    clear_test_work_dir()
+    update = create_update_archive("test", inst_list, TEST_WORK_DIR, False,
+                                   codec)
+    assert update.endswith(get_codec(codec).extension)
+    assert is_update_archive(update)
+    assert detect_codec(update).name == codec
+
+    with open_archive(update, "r|") as tar:
+        assert "instructions.txt" in [i.name for i in tar]
+
+    assert len(extract_update_archive(update, TEST_WORK_DIR)) == 2
+
+    # wrong extension, codec is still detected by magic bytes
+    if codec != "none":
+        with open(update, "rb") as fptr:
+            data = fptr.read()
+        with open(TEST_WORK_DIR + "test_update_1611940000.tar", "wb") as fptr:
+            fptr.write(data)
+        assert detect_codec(TEST_WORK_DIR + "test_update_1611940000.tar") \
+            .name == codec
+
+    clear_test_work_dir()
+    with open(update, "wb") as fptr:
+        fptr.write(b"not a archive")
+    with pytest.raises(UpdateArchiveError):
+        extract_update_archive(update, TEST_WORK_DIR)
+
+
+@pytest.mark.parametrize("codec", AVAILABLE_CODECS)
+def test_status_archive_codecs(codec):
+    """Test making and reading status archives with all codecs."""
+
+    status_file = make_status_archive(TEST_FILE_DIR, True, codec)
+    assert status_file.endswith(get_codec(codec).extension)
+    assert read_olu_status_file(status_file) != ""
+    assert read_dpkg_status_file(status_file) != ""
+    remove(status_file)
+
+
+def test_zstd_open_tar_error(monkeypatch):
+    """The file should be closed if the tar file can't be made."""
+
+    if not CODECS["zstd"].available:
+        pytest.skip("zstd requires the zstandard module")
+
+    files = []
+
+    def tracked_open(*args, **kwargs):
+        files.append(open(*args, **kwargs))
+        return files[-1]
+
+    def fail(*args, **kwargs):
+        raise tarfile.TarError("test")
+
+    monkeypatch.setattr(codec_module, "open", tracked_open, raising=False)
+    monkeypatch.setattr(codec_module._ClosingTarFile, "open", fail)
+
+    clear_test_work_dir()
+    with pytest.raises(tarfile.TarError):
+        CODECS["zstd"].open_tar(TEST_WORK_DIR + "test.tar.zst", "w")
+    assert len(files) == 1 and files[0].closed
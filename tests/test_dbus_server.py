@@ -0,0 +1,329 @@
+"""tests for the DBusServer class"""
+
+import pytest
+from os import open as os_open, O_RDONLY
+from os.path import basename
+from filecmp import cmp
+from time import sleep, perf_counter
+from threading import Event, Thread
+from .common import TEST_WORK_DIR, TEST_CACHE_DIR, LOGGER, TEST_UPDATE0, \
+        TEST_UPDATE1, TEST_UPDATE3, TEST_UPDATE9, clear_test_cache_dir, \
+        clear_test_work_dir
+
+pytest.importorskip("pydbus")
+
+from pydbus import connect  # noqa: E402
+from gi.repository import Gio, GLib  # noqa: E402
+from oresat_linux_updater.status_archive import (  # noqa: E402
+        StatusArchiveCache)
+from oresat_linux_updater.dbus_server import DBusServer, State, \
+        DBUS_INTERFACE_NAME  # noqa: E402
+from oresat_linux_updater.updater import Result  # noqa: E402
+
+
+@pytest.fixture
+def server():
+    """make the DBusServer object, without publishing it on a bus"""
+    clear_test_cache_dir()
+    clear_test_work_dir()
+    server = DBusServer(TEST_WORK_DIR, TEST_CACHE_DIR, LOGGER)
+    yield server
+    server.quit()
+
+
+@pytest.fixture
+def bus(server):
+    """publish the DBusServer on a private bus, yields a client connection"""
+    test_bus = Gio.TestDBus()
+    test_bus.up()
+    address = test_bus.get_bus_address()
+
+    publication = connect(address).publish(DBUS_INTERFACE_NAME, server)
+    loop = GLib.MainLoop()
+    thread = Thread(target=loop.run)
+    thread.start()
+
+    client = Gio.DBusConnection.new_for_address_sync(
+        address, Gio.DBusConnectionFlags.AUTHENTICATION_CLIENT |
+        Gio.DBusConnectionFlags.MESSAGE_BUS_CONNECTION, None, None)
+    yield client
+
+    client.close_sync(None)
+    publication.unpublish()
+    loop.quit()
+    thread.join()
+    test_bus.down()
+
+
+def _add_update_archive_fd(bus, filename: str, index: int, fds: list):
+    """Call AddUpdateArchiveFd over the bus with a Unix fd list."""
+
+    ret, _ = bus.call_with_unix_fd_list_sync(
+        DBUS_INTERFACE_NAME, "/" + DBUS_INTERFACE_NAME.replace(".", "/"),
+        DBUS_INTERFACE_NAME, "AddUpdateArchiveFd",
+        GLib.Variant("(sh)", (filename, index)), GLib.VariantType("(b)"),
+        Gio.DBusCallFlags.NONE, -1, Gio.UnixFDList.new_from_array(fds),
+        None)
+    return ret.unpack()[0]
+
+
+def test_add_update_archive_fd_no_context(server):
+    """Without the private pydbus attribute, it should fail, not raise."""
+
+    filename = basename(TEST_UPDATE0)
+    assert not server.AddUpdateArchiveFd(filename, 0)
+    assert not server.AddUpdateArchiveFd(filename, 0, dbus_context=object())
+    assert server.AvailableUpdateArchives == 0
+
+
+def test_total_instructions_bus(bus, server):
+    """A merged UpdateAll plan can have more than 255 instructions."""
+
+    server._updater._total_instructions = 300
+    server._updater._current_instruction_index = 299
+
+    for name, value in [("TotalInstructions", 300),
+                        ("InstructionIndex", 299)]:
+        ret = bus.call_sync(
+            DBUS_INTERFACE_NAME, "/" + DBUS_INTERFACE_NAME.replace(".", "/"),
+            "org.freedesktop.DBus.Properties", "Get",
+            GLib.Variant("(ss)", (DBUS_INTERFACE_NAME + ".Update", name)),
+            GLib.VariantType("(v)"), Gio.DBusCallFlags.NONE, -1, None)
+        assert ret.unpack()[0] == value
+
+
+def test_add_update_archive_fd(bus, server):
+    """The fd handle should be looked up in the message's Unix fd list."""
+
+    # the fd list takes ownership of the fds
+    filename = basename(TEST_UPDATE0)
+    fds = [os_open(TEST_UPDATE9, O_RDONLY), os_open(TEST_UPDATE0, O_RDONLY)]
+    assert _add_update_archive_fd(bus, filename, 1, fds)
+    assert cmp(TEST_CACHE_DIR + filename, TEST_UPDATE0, shallow=False)
+
+    # handle not in the fd list
+    assert not _add_update_archive_fd(bus, filename, 2,
+                                      [os_open(TEST_UPDATE0, O_RDONLY)])
+    assert server.AvailableUpdateArchives == 1
+
+
+def test_idle_wakeups(server):
+    """The working thread should not wake up while there is nothing to do."""
+
+    server.run()
+    sleep(0.5)
+    assert server._wakeups == 0
+    assert server.StatusName == State.STANDBY.name
+
+
+def test_update_start_latency(server):
+    """Update() should wake up the working thread right away."""
+
+    started = Event()
+
+    def update():
+        started.set()
+        return Result.NOTHING.value
+
+    server._updater.update = update
+    server.run()
+    sleep(0.1)
+
+    start = perf_counter()
+    assert server.Update()
+    assert started.wait(1.0)
+    latency = perf_counter() - start
+
+    assert latency < 0.05  # the old polling loop averaged 50 ms
+    assert server._wakeups == 1
+
+
+def test_make_status_archive_async(server, monkeypatch):
+    """Status archive requests should return right away, be coalesced, and
+    send the StatusArchive signal when done.
+    """
+
+    build = Event()
+    builds = []
+    signals = []
+
+    def make_status_archive(self, cache_dir, dpkg_status, status_dir=None):
+        build.wait(1.0)
+        builds.append(cache_dir)
+        return "/tmp/test_olu-status_1611940000.tar.xz"
+
+    monkeypatch.setattr(StatusArchiveCache, "make_status_archive",
+                        make_status_archive)
+    monkeypatch.setattr(DBusServer, "StatusArchive",
+                        lambda self, job, path: signals.append((job, path)),
+                        raising=False)
+    server.run()
+
+    start = perf_counter()
+    job = server.MakeStatusArchiveAsync()
+    assert perf_counter() - start < 0.05
+
+    # wait for the 1st job to start
+    while server.StatusName != State.STATUS_FILE.name:
+        sleep(0.01)
+
+    # queued while the 1st job is running, so coalesced into 1 new job
+    job2 = server.MakeStatusArchiveAsync()
+    assert server.MakeStatusArchiveAsync() == job2
+    assert job2 == job + 1
+
+    build.set()
+    while len(signals) < 2:
+        sleep(0.01)
+
+    assert len(builds) == 2
+    assert signals == [(job, "/tmp/test_olu-status_1611940000.tar.xz"),
+                       (job2, "/tmp/test_olu-status_1611940000.tar.xz")]
+    assert server.StatusName == State.STANDBY.name
+
+
+def test_acknowledge_status_archive(server, monkeypatch):
+    """Acknowledged status archives should be released by the cache, even
+    without a status directory.
+    """
+
+    acknowledged = []
+    monkeypatch.setattr(StatusArchiveCache, "acknowledge",
+                        lambda self, name: acknowledged.append(name))
+
+    name = "test_olu-status_1611940000.tar.xz"
+    assert not server.AcknowledgeStatusArchive(name)
+    assert acknowledged == [name]
+
+
+def test_add_update_archive_async(server, monkeypatch):
+    """Add requests should return right away and send the UpdateArchiveAdded
+    signal, in order, once each update archive is copied.
+    """
+
+    signals = []
+
+    monkeypatch.setattr(DBusServer, "UpdateArchiveAdded",
+                        lambda self, job, ret: signals.append((job, ret)),
+                        raising=False)
+    server.run()
+
+    start = perf_counter()
+    job = server.AddUpdateArchiveAsync(TEST_UPDATE0)
+    job2 = server.AddUpdateArchiveAsync(TEST_UPDATE9)  # invalid filename
+    assert perf_counter() - start < 0.05
+    assert job2 == job + 1
+
+    while len(signals) < 2:
+        sleep(0.01)
+
+    assert signals == [(job, True), (job2, False)]
+    assert server.AvailableUpdateArchives == 1
+
+
+def test_add_update_archive_async_quit(server, monkeypatch):
+    """Jobs still queued on quit should get a failed UpdateArchiveAdded
+    signal.
+    """
+
+    signals = []
+    started = Event()
+    copy = Event()
+
+    def add_update_archive(update_archive):
+        started.set()
+        copy.wait(1.0)
+        return True
+
+    monkeypatch.setattr(DBusServer, "UpdateArchiveAdded",
+                        lambda self, job, ret: signals.append((job, ret)),
+                        raising=False)
+    server._updater.add_update_archive = add_update_archive
+    server.run()
+
+    jobs = [server.AddUpdateArchiveAsync(TEST_UPDATE0) for _ in range(3)]
+    assert started.wait(1.0)
+
+    quit_thread = Thread(target=server.quit)
+    quit_thread.start()
+    while server._running:
+        sleep(0.01)
+    copy.set()
+    quit_thread.join()
+
+    # the running job finishes, the rest fail
+    assert signals == [(jobs[0], True), (jobs[1], False), (jobs[2], False)]
+
+
+def test_update_all(server, monkeypatch):
+    """UpdateAll() should send a UpdateArchiveResult signal for each update
+    archive, then one UpdateResult signal with the worst result.
+    """
+
+    signals = []
+    results_signals = []
+
+    monkeypatch.setattr(DBusServer, "UpdateArchiveResult",
+                        lambda self, fname, ret: signals.append((fname, ret)),
+                        raising=False)
+    monkeypatch.setattr(DBusServer, "UpdateResult",
+                        lambda self, ret: results_signals.append(ret),
+                        raising=False)
+    results = [("test_update_1611941111.tar.xz", Result.FAILED_NON_CRIT.value),
+               ("test_update_1611940000.tar.xz", Result.SUCCESS.value)]
+    server._updater.update_all = lambda: results
+    server.run()
+
+    assert server.UpdateAll()
+    while len(results_signals) < 1 or server.StatusName == State.UPDATE.name:
+        sleep(0.01)
+
+    # failures come first, the filename tells which update archive failed
+    assert signals == results
+    assert results_signals == [Result.FAILED_NON_CRIT.value]
+    assert server.StatusName == State.UPDATE_FAILED.name
+
+
+def test_update_all_bus(bus, server):
+    """The UpdateArchiveResult signals should tell which update archive each
+    result is for, the UpdateResult signal keeps its single byte.
+    """
+
+    signals = []
+    results_signals = []
+
+    def on_signal(connection, sender, path, interface, name, parameters):
+        signals.append(parameters.unpack())
+
+    def on_result(connection, sender, path, interface, name, parameters):
+        results_signals.append(parameters.unpack())
+
+    bus.signal_subscribe(None, DBUS_INTERFACE_NAME, "UpdateArchiveResult",
+                         None, None, Gio.DBusSignalFlags.NONE, on_signal)
+    bus.signal_subscribe(None, DBUS_INTERFACE_NAME, "UpdateResult", None,
+                         None, Gio.DBusSignalFlags.NONE, on_result)
+    server.run()
+
+    for update in [TEST_UPDATE3, TEST_UPDATE1, TEST_UPDATE0]:
+        assert server.AddUpdateArchive(update)
+    assert server.UpdateAll()
+
+    start = perf_counter()
+    while len(results_signals) < 1 and perf_counter() - start < 10:
+        sleep(0.01)
+
+    assert signals == [
+        (basename(TEST_UPDATE3), Result.FAILED_NON_CRIT.value),
+        (basename(TEST_UPDATE0), Result.SUCCESS.value),
+        (basename(TEST_UPDATE1), Result.SUCCESS.value),
+    ]
+
+    assert results_signals == [(Result.FAILED_NON_CRIT.value,)]
+
+    while server.StatusName == State.UPDATE.name:
+        sleep(0.01)
+    assert server.Update()
+    while len(results_signals) < 2:
+        sleep(0.01)
+    assert results_signals[1] == (Result.NOTHING.value,)
+    assert len(signals) == 3
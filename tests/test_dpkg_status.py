@@ -0,0 +1,153 @@
+"""tests for the dpkg status parser and index"""
+
+import pytest
+from oresat_linux_updater.dpkg_status import DpkgStatus, DpkgPackage, \
+        DpkgStatusError, read_deb_control, read_deb_fields, \
+        parse_relations, compare_versions, version_satisfies, DpkgVersionError
+from oresat_linux_updater.status_archive import StatusArchive
+from .common import TEST_FILE_DIR, TEST_DEB_PKG1, TEST_DEB_PKG1_NAME, \
+        TEST_DEB_PKG2, TEST_DEB_PKG2_NAME, TEST_BASH_SCRIPT
+
+STATUS = """Package: adduser
+Status: install ok installed
+Priority: important
+Architecture: all
+Version: 3.118
+Description: add and remove users and groups
+ Version: 0.0 is not a field
+
+Package: libc6
+Status: install ok installed
+Architecture: armhf
+Version: 2.28-10
+Config-Version: 2.28-9
+
+Package: libc6
+Status: install ok installed
+Architecture: arm64
+Version: 2.28-10
+
+Package: old-package
+Status: deinstall ok config-files
+Architecture: all
+Version: 1.0
+"""
+
+
+def test_dpkg_status():
+    index = DpkgStatus.from_string(STATUS)
+
+    assert len(index) == 4
+    assert "adduser" in index
+    assert "apt" not in index
+    assert index.get("adduser") == \
+        DpkgPackage("adduser", "3.118", "all", "install ok installed")
+    assert index.get("apt") is None
+
+    # multi-arch
+    assert index.get("libc6").arch == "armhf"
+    assert index.get("libc6", "arm64").arch == "arm64"
+    assert index.get("libc6", "amd64") is None
+    assert index.get("adduser", "armhf") is None
+    assert index.is_installed("libc6", "2.28-10", "arm64")
+    assert not index.is_installed("libc6", "2.28-9")
+
+    # only config files left
+    assert "old-package" in index
+    assert not index.is_installed("old-package")
+    assert index.get("old-package").state == "config-files"
+    assert not index.get("old-package").unpacked
+    assert index.get("adduser").unpacked
+    assert index.is_removed("old-package")
+    assert not index.is_purged("old-package")
+    assert index.is_removed("apt")
+    assert not index.is_removed("libc6", "arm64")
+
+    # strings are interned
+    assert index.get("libc6").status is index.get("adduser").status
+
+
+def test_dpkg_status_file():
+    index = DpkgStatus.from_file("/var/lib/dpkg/status")
+    assert index.is_installed("dpkg")
+
+    archive = StatusArchive(TEST_FILE_DIR +
+                            "generic_olu-status_1614805451.tar.xz")
+    index = archive.dpkg_index()
+    assert len(index) == archive.dpkg_status().count("\nPackage: ") + 1
+    assert index.is_installed("adduser")
+
+
+def test_read_deb_control():
+    assert read_deb_control(TEST_DEB_PKG1) == \
+        DpkgPackage(TEST_DEB_PKG1_NAME, "0.1.0-0", "all", "")
+
+    with pytest.raises(DpkgStatusError):
+        read_deb_control(TEST_BASH_SCRIPT)
+
+
+def test_read_deb_fields():
+    fields = read_deb_fields(TEST_DEB_PKG2)
+    assert fields["Package"] == TEST_DEB_PKG2_NAME
+    assert fields["Depends"] == TEST_DEB_PKG1_NAME
+    assert fields["Description"] == \
+        "A test package for the oresat linux updater"
+
+    with pytest.raises(DpkgStatusError):
+        read_deb_fields(TEST_BASH_SCRIPT)
+
+
+def test_provides(tmp_path):
+    content = ("Package: mawk\n"
+               "Status: install ok installed\n"
+               "Provides: awk\n"
+               "Version: 1.3.3-17\n"
+               "\n"
+               "Package: exim4\n"
+               "Status: deinstall ok config-files\n"
+               "Provides: mail-transport-agent\n"
+               "\n" + STATUS)
+    path = str(tmp_path / "status")
+    with open(path, "w") as fptr:
+        fptr.write(content)
+
+    assert DpkgStatus.from_file(path).provides == {"awk"}
+    assert DpkgStatus.from_string(content).provides == {"awk"}
+    assert DpkgStatus().provides == set()
+
+
+def test_parse_relations():
+    assert parse_relations("") == []
+    assert parse_relations("libc6 (>= 2.28), python3:any | python (<< 3), "
+                           "foo [armhf]") == [
+        [("libc6", ">=", "2.28")],
+        [("python3", None, None), ("python", "<<", "3")],
+        [("foo", None, None)],
+    ]
+
+
+def test_compare_versions():
+    # each version is older than the next one
+    versions = ["0.1.0-0", "1.0~rc1", "1.0", "1.0-1~bpo1", "1.0-1", "1.0a",
+                "1.0+b1", "1.1", "1.10", "1:0.9"]
+    for i in range(len(versions)):
+        assert compare_versions(versions[i], versions[i]) == 0
+        for j in range(i + 1, len(versions)):
+            assert compare_versions(versions[i], versions[j]) == -1
+            assert compare_versions(versions[j], versions[i]) == 1
+
+    assert compare_versions("1.0", "1.00") == 0
+
+    # colons after the epoch are part of the upstream version
+    assert compare_versions("1:2.0:git3-1", "1:2.0:git2-1") == 1
+    assert compare_versions("1:2.0:git3-1", "2.0") == 1
+    assert version_satisfies("2.28-10", ">=", "2.28")
+    assert not version_satisfies("2.28-10", "<<", "2.28")
+    assert version_satisfies("2.28-10", None, None)
+
+    # malformed versions, e.g. from a corrupt dpkg status file
+    for version in ["a:1.0", ":1.0", "1:", "", "1.0-", "1.0-a:b", "1.0 1"]:
+        with pytest.raises(DpkgVersionError):
+            compare_versions(version, "1.0")
+        with pytest.raises(DpkgStatusError):
+            version_satisfies("1.0", ">=", version)
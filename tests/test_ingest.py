@@ -0,0 +1,61 @@
+"""tests for ingesting update archives into the cache"""
+
+import os
+import shutil
+import filecmp
+import pytest
+from oresat_linux_updater import ingest
+from oresat_linux_updater.ingest import ingest_fd
+from .common import TEST_WORK_DIR, TEST_UPDATE0, clear_test_work_dir
+
+
+@pytest.mark.parametrize("method", ingest.INGEST_METHODS)
+def test_ingest_fd(method, monkeypatch):
+    """Every method should make the same file, only the first one that works
+    is used.
+    """
+
+    if method == "copy_file_range" and not hasattr(os, "copy_file_range"):
+        pytest.skip("copy_file_range requires python 3.8")
+
+    clear_test_work_dir()
+    dst = TEST_WORK_DIR + "test_update_1611940000.tar.xz"
+
+    # make all methods before this one fail
+    for i in ingest.INGEST_METHODS[:ingest.INGEST_METHODS.index(method)]:
+        if i != "copy":
+            monkeypatch.setattr(ingest, "_" + i, lambda *args: False)
+
+    fd = os.open(TEST_UPDATE0, os.O_RDONLY)
+    os.lseek(fd, 100, os.SEEK_SET)  # the file offset is not used
+    used = ingest_fd(fd, dst, TEST_UPDATE0)
+
+    # reflinks are not supported by every filesystem
+    if method != "reflink":
+        assert used == method
+    assert filecmp.cmp(TEST_UPDATE0, dst, shallow=False)
+
+    with pytest.raises(FileExistsError):
+        ingest_fd(fd, dst, TEST_UPDATE0)
+
+    os.close(fd)
+
+    clear_test_work_dir()
+
+
+def test_ingest_fd_no_link():
+    """A file should only be hardlinked if a link path is given."""
+
+    clear_test_work_dir()
+    src = TEST_WORK_DIR + "test_update_1611940000.tar.xz"
+    dst = TEST_WORK_DIR + "test_update_1611941111.tar.xz"
+    shutil.copyfile(TEST_UPDATE0, src)
+
+    fd = os.open(src, os.O_RDONLY)
+    assert ingest_fd(fd, dst) != "link"
+    os.close(fd)
+
+    assert os.stat(src).st_ino != os.stat(dst).st_ino
+    assert filecmp.cmp(src, dst, shallow=False)
+
+    clear_test_work_dir()
@@ -2,7 +2,10 @@
 
 import pytest
 from oresat_linux_updater.instruction import Instruction, InstructionType, \
-        InstructionError, run_bash_command
+        InstructionError, run_bash_command, plan_instructions, \
+        run_pending_triggers, CommandOutput, OUTPUT_CHUNK_SIZE, \
+        remove_satisfied, plan_batch
+from oresat_linux_updater.dpkg_status import DpkgStatus
 from .common import LOGGER, TEST_DEB_PKG1, TEST_DEB_PKG2, TEST_DEB_PKG1_NAME, \
         TEST_DEB_PKG2_NAME, TEST_BASH_SCRIPT
 
@@ -16,6 +19,30 @@ def test_bash_command():
         run_bash_command("abcd", LOGGER)
 
 
+def test_bash_command_output():
+    """Test the output of bash commands is counted and its tail kept."""
+
+    output = CommandOutput(tail_lines=3)
+    run_bash_command("seq 1 10; echo error >&2", LOGGER, output)
+    assert output.lines == 11
+    assert output.bytes == len("".join(str(i) + "\n" for i in range(1, 11))) \
+        + len("error\n")
+    assert len(output.tail) == 3
+
+    # long lines without newlines are split
+    output.reset()
+    assert output.lines == 0 and output.bytes == 0 and output.tail == []
+    run_bash_command("head -c {} /dev/zero | tr '\\0' a".format(
+                     OUTPUT_CHUNK_SIZE * 3), LOGGER, output)
+    assert output.bytes == OUTPUT_CHUNK_SIZE * 3
+    assert output.lines >= 3
+
+    # tail is in error message
+    output.reset()
+    with pytest.raises(InstructionError, match="last words"):
+        run_bash_command("echo last words; exit 3", LOGGER, output)
+
+
 def test_run_instruction():
     """Test opening instructions file."""
 
@@ -40,3 +67,152 @@ def test_run_instruction():
     Instruction(InstructionType.DPKG_INSTALL, [TEST_DEB_PKG1, TEST_DEB_PKG2]).run(LOGGER)
     Instruction(InstructionType.DPKG_REMOVE, [TEST_DEB_PKG1_NAME, TEST_DEB_PKG2_NAME]).run(LOGGER)
     Instruction(InstructionType.DPKG_REMOVE, [TEST_DEB_PKG1_NAME]).run(LOGGER)  # cleanup
+
+
+def test_plan_instructions():
+    """Test merging dpkg instructions."""
+
+    inst_list = [
+        Instruction(InstructionType.DPKG_INSTALL, [TEST_DEB_PKG1]),
+        Instruction(InstructionType.SUPPORT_FILE, ["file1"]),
+        Instruction(InstructionType.DPKG_INSTALL, [TEST_DEB_PKG2]),
+        Instruction(InstructionType.BASH_SCRIPT, [TEST_BASH_SCRIPT]),
+        Instruction(InstructionType.DPKG_REMOVE, [TEST_DEB_PKG2_NAME]),
+        Instruction(InstructionType.DPKG_REMOVE, [TEST_DEB_PKG1_NAME]),
+        Instruction(InstructionType.DPKG_PURGE, [TEST_DEB_PKG1_NAME]),
+        Instruction(InstructionType.DPKG_PURGE, [TEST_DEB_PKG1_NAME]),
+    ]
+
+    plan = plan_instructions(inst_list)
+    assert [i.type for i in plan] == [
+        InstructionType.SUPPORT_FILE,
+        InstructionType.DPKG_INSTALL,
+        InstructionType.BASH_SCRIPT,
+        InstructionType.DPKG_REMOVE,
+        InstructionType.DPKG_PURGE,
+        InstructionType.DPKG_PURGE,
+    ]
+    assert plan[1].items == [TEST_DEB_PKG1, TEST_DEB_PKG2]
+    assert plan[1].bash_command == \
+        "dpkg --no-triggers -i {} {}".format(TEST_DEB_PKG1, TEST_DEB_PKG2)
+    assert plan[3].items == [TEST_DEB_PKG2_NAME, TEST_DEB_PKG1_NAME]
+    assert plan[1].defer_triggers and not plan[2].defer_triggers
+
+    # input is not changed
+    assert inst_list[0].items == [TEST_DEB_PKG1]
+
+    plan = plan_instructions(inst_list, False)
+    assert plan[1].bash_command == \
+        "dpkg -i {} {}".format(TEST_DEB_PKG1, TEST_DEB_PKG2)
+
+    # run with deferred triggers
+    for inst in plan_instructions(inst_list[:4]):
+        if inst.type == InstructionType.BASH_SCRIPT:
+            run_pending_triggers(LOGGER)
+        inst.run(LOGGER)
+    Instruction(InstructionType.DPKG_REMOVE, [TEST_DEB_PKG2_NAME,
+                TEST_DEB_PKG1_NAME], True).run(LOGGER)
+    run_pending_triggers(LOGGER)
+
+
+def test_remove_satisfied():
+    """Test dpkg items already done are removed from instructions."""
+
+    dpkg_status = DpkgStatus.from_string(
+        "Package: {}\nStatus: install ok installed\nArchitecture: all\n"
+        "Version: 0.1.0-0\n\n"
+        "Package: {}\nStatus: deinstall ok config-files\n"
+        "Architecture: all\nVersion: 0.1.0-0\n".format(
+            TEST_DEB_PKG1_NAME, TEST_DEB_PKG2_NAME))
+
+    # pkg1 is installed, pkg2 is not
+    inst = Instruction(InstructionType.DPKG_INSTALL,
+                       [TEST_DEB_PKG1, TEST_DEB_PKG2], True)
+    new_inst, skipped = remove_satisfied(inst, dpkg_status)
+    assert skipped == [TEST_DEB_PKG1]
+    assert new_inst.items == [TEST_DEB_PKG2]
+    assert new_inst.defer_triggers
+
+    # pkg2 is removed, but not purged
+    inst = Instruction(InstructionType.DPKG_REMOVE,
+                       [TEST_DEB_PKG1_NAME, TEST_DEB_PKG2_NAME + ":all"])
+    new_inst, skipped = remove_satisfied(inst, dpkg_status)
+    assert skipped == [TEST_DEB_PKG2_NAME + ":all"]
+    assert new_inst.items == [TEST_DEB_PKG1_NAME]
+
+    inst = Instruction(InstructionType.DPKG_PURGE, [TEST_DEB_PKG2_NAME])
+    assert remove_satisfied(inst, dpkg_status) == (inst, [])
+
+    inst = Instruction(InstructionType.DPKG_PURGE, ["not-a-package"])
+    assert remove_satisfied(inst, dpkg_status) == (None, ["not-a-package"])
+
+    # still on disk, but not fully installed (e.g. triggers deferred or a
+    # interrupted install), so removes are not skipped
+    for state in ["triggers-pending", "triggers-awaited", "half-configured",
+                  "unpacked", "half-installed"]:
+        partly = DpkgStatus.from_string(
+            "Package: {}\nStatus: install ok {}\nArchitecture: all\n"
+            "Version: 0.1.0-0\n".format(TEST_DEB_PKG1_NAME, state))
+        for inst_type in [InstructionType.DPKG_REMOVE,
+                          InstructionType.DPKG_PURGE]:
+            inst = Instruction(inst_type, [TEST_DEB_PKG1_NAME])
+            assert remove_satisfied(inst, partly) == (inst, [])
+
+    # nothing to check
+    inst = Instruction(InstructionType.BASH_SCRIPT, [TEST_BASH_SCRIPT])
+    assert remove_satisfied(inst, dpkg_status) == (inst, [])
+
+
+def test_plan_batch():
+    """Test merging the instructions of several update archives."""
+
+    inst_lists = [
+        [Instruction(InstructionType.DPKG_INSTALL,
+                     [TEST_DEB_PKG1, TEST_DEB_PKG2])],
+        [Instruction(InstructionType.DPKG_INSTALL, [TEST_DEB_PKG1]),
+         Instruction(InstructionType.DPKG_REMOVE, [TEST_DEB_PKG2_NAME])],
+        [Instruction(InstructionType.DPKG_INSTALL, [TEST_DEB_PKG2]),
+         Instruction(InstructionType.BASH_SCRIPT, [TEST_BASH_SCRIPT])],
+        [Instruction(InstructionType.DPKG_PURGE, [TEST_DEB_PKG2_NAME])],
+    ]
+
+    # pkg1 of the first install is replaced by the second update archive's
+    # install in the same dpkg call, pkg2 is not as the remove is not, a bash
+    # script is between the third and fourth
+    plan, owners = plan_batch(inst_lists)
+    assert [i.type for i in plan] == [
+        InstructionType.DPKG_INSTALL,
+        InstructionType.DPKG_REMOVE,
+        InstructionType.DPKG_INSTALL,
+        InstructionType.BASH_SCRIPT,
+        InstructionType.DPKG_PURGE,
+    ]
+    assert plan[0].items == [TEST_DEB_PKG2, TEST_DEB_PKG1]
+    assert plan[0].defer_triggers
+    assert owners == [{0, 1}, {1}, {2}, {2}, {3}]
+
+    # nothing is dropped across another dpkg instruction, it could need the
+    # dropped version
+    plan, owners = plan_batch([
+        [Instruction(InstructionType.DPKG_INSTALL, [TEST_DEB_PKG1])],
+        [Instruction(InstructionType.DPKG_REMOVE, [TEST_DEB_PKG2_NAME])],
+        [Instruction(InstructionType.DPKG_INSTALL, [TEST_DEB_PKG1])],
+    ])
+    assert [(i.type, i.items) for i in plan] == [
+        (InstructionType.DPKG_INSTALL, [TEST_DEB_PKG1]),
+        (InstructionType.DPKG_REMOVE, [TEST_DEB_PKG2_NAME]),
+        (InstructionType.DPKG_INSTALL, [TEST_DEB_PKG1]),
+    ]
+    assert owners == [{0}, {1}, {2}]
+
+    # update archives without a later archive in common are only merged
+    plan, owners = plan_batch([
+        [Instruction(InstructionType.DPKG_REMOVE, [TEST_DEB_PKG1_NAME])],
+        [Instruction(InstructionType.DPKG_REMOVE, [TEST_DEB_PKG2_NAME])],
+    ])
+    assert len(plan) == 1
+    assert plan[0].items == [TEST_DEB_PKG1_NAME, TEST_DEB_PKG2_NAME]
+    assert owners == [{0, 1}]
+
+    # input is not changed
+    assert inst_lists[0][0].items == [TEST_DEB_PKG1, TEST_DEB_PKG2]
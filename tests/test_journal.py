@@ -0,0 +1,61 @@
+"""tests for the update journal"""
+
+from oresat_linux_updater.journal import UpdateJournal, JOURNAL_FILE
+from oresat_linux_updater.instruction import Instruction, InstructionType
+from .common import TEST_WORK_DIR, TEST_UPDATE0, clear_test_work_dir
+
+
+def test_journal():
+    clear_test_work_dir()
+    path = TEST_WORK_DIR + JOURNAL_FILE
+
+    assert UpdateJournal.load(path) is None
+
+    journal = UpdateJournal(path, TEST_UPDATE0)
+    journal.save()
+    journal = UpdateJournal.load(path)
+    assert journal.update_archive == TEST_UPDATE0
+    assert journal.extracted is False
+    assert journal.completed == 0
+
+    journal.extracted = True
+    journal.completed = 2
+    journal.save()
+    journal = UpdateJournal.load(path)
+    assert journal.extracted is True
+    assert journal.completed == 2
+
+    # batch with its plan
+    plan = [Instruction(InstructionType.DPKG_INSTALL, ["/a.deb", "/b.deb"],
+                        True),
+            Instruction(InstructionType.BASH_SCRIPT, ["/c.sh"])]
+    UpdateJournal(path, "", True, 1, ["a", "b"], plan, [{0, 1}, {1}]).save()
+    journal = UpdateJournal.load(path)
+    assert journal.batch == ["a", "b"]
+    assert [(i.type, i.items, i.defer_triggers) for i in journal.plan] == \
+        [(i.type, i.items, i.defer_triggers) for i in plan]
+    assert journal.owners == [{0, 1}, {1}]
+    assert journal.completed == 1
+
+    # a single update archive has no plan
+    UpdateJournal(path, TEST_UPDATE0).save()
+    assert UpdateJournal.load(path).batch is None
+
+    # invalid journals
+    with open(path, "w") as fptr:
+        fptr.write("{\"update_archive\": ")
+    assert UpdateJournal.load(path) is None
+
+    with open(path, "w") as fptr:
+        fptr.write("{\"update_archive\": \"a\", \"extracted\": true, "
+                   "\"completed\": -1}")
+    assert UpdateJournal.load(path) is None
+
+    with open(path, "w") as fptr:
+        fptr.write("{\"update_archive\": \"\", \"extracted\": true, "
+                   "\"completed\": 0, \"batch\": [\"a\"], \"plan\": "
+                   "[{\"type\": \"NOT_A_TYPE\", \"items\": [], "
+                   "\"defer_triggers\": false, \"owners\": [0]}]}")
+    assert UpdateJournal.load(path) is None
+
+    clear_test_work_dir()
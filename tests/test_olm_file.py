@@ -0,0 +1,77 @@
+"""tests for the OLM file format"""
+
+import pytest
+from pathlib import Path
+from oresat_linux_updater.olm_file import OLMFile, scan_dir
+
+
+def test_olm_file():
+    olm = OLMFile(load="/tmp/gps_update_1612392143.tar.xz")
+    assert olm.name == "gps_update_1612392143.tar.xz"
+    assert olm.board == "gps"
+    assert olm.keyword == "update"
+    assert olm.date == 1612392143
+    assert olm.extension == ".tar.xz"
+
+    olm = OLMFile(load="star-tracker_olu-status_1612392143")
+    assert olm.board == "star-tracker"
+    assert olm.keyword == "olu-status"
+    assert olm.extension == ""
+
+    # invalid filenames
+    for name in ["gps.tar.xz", "gps_update.tar.xz", "gps_update_abc.tar.xz",
+                 "gps_update_1612392143_1.tar.xz", "gps_update_.tar.xz"]:
+        with pytest.raises(ValueError):
+            OLMFile(load=name)
+
+    with pytest.raises(ValueError):
+        OLMFile(load="gps_update_1612392143.tar.xz", keyword="update")
+
+    # new file without a board uses the hostname
+    olm = OLMFile(keyword="update")
+    assert olm.board != ""
+    assert olm.name.startswith(olm.board + "_update_")
+
+
+def test_olm_file_order():
+    old = OLMFile(load="gps_update_1612392143.tar.xz")
+    new = OLMFile(load="gps_update_1612392200.tar.xz")
+    same_date = OLMFile(load="cfc_update_1612392143.tar.xz")
+
+    # sorted lists are newest first
+    files = sorted([old, same_date, new])
+    assert files == [new, old, same_date]
+    assert files.pop() == same_date
+    assert new < old and old > new
+    assert old <= old and old >= old
+
+    # hashable, equal by filename
+    assert old == OLMFile(load="/tmp/gps_update_1612392143.tar.xz")
+    assert old != same_date
+    assert len({old, new, same_date,
+                OLMFile(load="gps_update_1612392200.tar.xz")}) == 3
+    assert {old: 1}[OLMFile(load="gps_update_1612392143.tar.xz")] == 1
+
+    with pytest.raises(AttributeError):
+        old.other = 1
+
+
+def test_scan_dir(tmp_path):
+    names = ["gps_update_1612392143.tar.xz", "gps_update_1612392200.tar.zst",
+             "cfc_update_1612392100.tar.xz", "gps_olu-status_1612392150.tar",
+             ".gps_update_1612392300.tar.xz", "not_a_olm_file.txt",
+             "README"]
+    for name in names:
+        Path(str(tmp_path / name)).touch()
+
+    assert [i.name for i in scan_dir(str(tmp_path))] == [
+        "gps_update_1612392200.tar.zst", "gps_olu-status_1612392150.tar",
+        "gps_update_1612392143.tar.xz", "cfc_update_1612392100.tar.xz"]
+    assert [i.name for i in scan_dir(str(tmp_path), keyword="update",
+                                     board="gps")] == [
+        "gps_update_1612392200.tar.zst", "gps_update_1612392143.tar.xz"]
+    assert scan_dir(str(tmp_path), board="dxwifi") == []
+
+    # same order as sorting the list
+    files = scan_dir(str(tmp_path))
+    assert sorted(files) == files
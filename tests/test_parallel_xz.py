@@ -0,0 +1,87 @@
+"""tests for the multi-process xz compressor"""
+
+import lzma
+import tarfile
+import pytest
+from random import Random
+from oresat_linux_updater.instruction import Instruction, InstructionType
+from oresat_linux_updater.update_archive import create_update_archive, \
+        extract_update_archive
+from oresat_linux_updater.parallel_xz import ParallelXZWriter, XZError, \
+        read_xz_index, read_xz_block
+from .common import TEST_WORK_DIR, TEST_DEB_PKG1, TEST_DEB_PKG2, \
+        TEST_BASH_SCRIPT, TEST_UPDATE0, TEST_UPDATE8, clear_test_work_dir
+
+BLOCK_SIZE = 64 * 1024
+
+
+def _test_data(size: int) -> bytes:
+    """Some compressible data."""
+
+    rand = Random(0)
+    words = [bytes(rand.choices(b"abcdefgh", k=8)) for _ in range(256)]
+    return b" ".join(rand.choices(words, k=size // 9 + 1))[:size]
+
+
+def test_parallel_xz_writer():
+    """Test the xz file can be read by lzma and its block index."""
+
+    clear_test_work_dir()
+    xz_file = TEST_WORK_DIR + "test.xz"
+
+    for size in [0, 100, BLOCK_SIZE, BLOCK_SIZE * 5 + 123]:
+        data = _test_data(size)
+
+        with ParallelXZWriter(xz_file, 2, BLOCK_SIZE) as fptr:
+            for i in range(0, len(data), 10000):
+                fptr.write(data[i:i + 10000])
+
+        with open(xz_file, "rb") as fptr:
+            assert lzma.decompress(fptr.read()) == data
+
+        blocks = read_xz_index(xz_file)
+        assert len(blocks) == (size + BLOCK_SIZE - 1) // BLOCK_SIZE
+        assert sum(i.uncompressed_size for i in blocks) == size
+
+        # random access
+        for block in reversed(blocks):
+            start = block.uncompressed_offset
+            end = start + block.uncompressed_size
+            assert read_xz_block(xz_file, block) == data[start:end]
+
+
+def test_read_xz_index():
+    """Test reading the index of xz files not made by ParallelXZWriter."""
+
+    assert len(read_xz_index(TEST_UPDATE0)) == 1
+
+    # concatenated streams with stream padding
+    clear_test_work_dir()
+    xz_file = TEST_WORK_DIR + "test.xz"
+    with open(xz_file, "wb") as fptr:
+        fptr.write(lzma.compress(b"abc") + bytes(4) + lzma.compress(b"def"))
+
+    blocks = read_xz_index(xz_file)
+    assert len(blocks) == 2
+    assert read_xz_block(xz_file, blocks[1]) == b"def"
+
+    with pytest.raises(XZError):
+        read_xz_index(TEST_UPDATE8)
+
+
+def test_parallel_update_archive():
+    """Test a update archive made with multiple processes can be extracted."""
+
+    inst_list = [
+                Instruction(InstructionType.DPKG_INSTALL,
+                            [TEST_DEB_PKG1, TEST_DEB_PKG2]),
+                Instruction(InstructionType.BASH_SCRIPT, [TEST_BASH_SCRIPT])
+            ]
+
+    clear_test_work_dir()
+    update = create_update_archive("test", inst_list, TEST_WORK_DIR, False,
+                                   jobs=2)
+
+    with tarfile.open(update, "r:xz") as tar:
+        assert len(tar.getnames()) == 5
+    assert len(extract_update_archive(update, TEST_WORK_DIR)) == 2
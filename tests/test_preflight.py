@@ -0,0 +1,111 @@
+"""tests for the pre-flight check of deb files"""
+
+import pytest
+from oresat_linux_updater import preflight
+from oresat_linux_updater.preflight import PreflightError, check_plan, \
+        read_deb_files, dpkg_architectures
+from oresat_linux_updater.instruction import Instruction, InstructionType
+from oresat_linux_updater.dpkg_status import DpkgStatus, DpkgStatusError
+from .common import TEST_DEB_PKG1, TEST_DEB_PKG2, TEST_DEB_PKG1_NAME, \
+        TEST_DEB_PKG2_NAME, TEST_BASH_SCRIPT
+
+STATUS = """Package: test-package1
+Status: install ok installed
+Architecture: all
+Version: 0.0.1
+"""
+
+
+def _install(*debs) -> Instruction:
+    return Instruction(InstructionType.DPKG_INSTALL, list(debs))
+
+
+def test_read_deb_files():
+    debs = read_deb_files([TEST_DEB_PKG1, TEST_DEB_PKG2, TEST_BASH_SCRIPT,
+                           TEST_DEB_PKG1], 4)
+
+    assert list(debs) == [TEST_DEB_PKG1, TEST_DEB_PKG2, TEST_BASH_SCRIPT]
+    assert debs[TEST_DEB_PKG1]["Package"] == TEST_DEB_PKG1_NAME
+    assert debs[TEST_DEB_PKG2]["Package"] == TEST_DEB_PKG2_NAME
+    assert isinstance(debs[TEST_BASH_SCRIPT], DpkgStatusError)
+    assert read_deb_files([TEST_DEB_PKG1], 1) == \
+        {TEST_DEB_PKG1: debs[TEST_DEB_PKG1]}
+
+
+def test_check_plan_invalid_version(monkeypatch):
+    """A malformed version should fail the check, not raise ValueError."""
+
+    fields = {"Package": TEST_DEB_PKG2_NAME, "Version": "0.1.0-0",
+              "Architecture": "all",
+              "Depends": TEST_DEB_PKG1_NAME + " (>= 0.1.0)"}
+    monkeypatch.setattr(preflight, "read_deb_files",
+                        lambda paths, threads: {TEST_DEB_PKG2: fields})
+
+    status = DpkgStatus.from_string(STATUS.replace("0.0.1", "a:0.0.1"))
+    with pytest.raises(PreflightError) as exc:
+        check_plan([_install(TEST_DEB_PKG2)], status)
+    assert exc.value.index == 0
+    assert "a:0.0.1" in str(exc.value)
+
+    # and the version it depends on
+    fields["Depends"] = TEST_DEB_PKG1_NAME + " (>= a:0.1.0)"
+    with pytest.raises(PreflightError):
+        check_plan([_install(TEST_DEB_PKG2)],
+                   DpkgStatus.from_string(STATUS))
+
+    fields["Depends"] = TEST_DEB_PKG1_NAME + " (<< 0.1.0)"
+    assert check_plan([_install(TEST_DEB_PKG2)],
+                      DpkgStatus.from_string(STATUS)) == 1
+
+
+def test_check_plan():
+    empty = DpkgStatus()
+    installed = DpkgStatus.from_string(STATUS)
+
+    # dependency in the same dpkg call, installed, or provided
+    assert check_plan([_install(TEST_DEB_PKG1, TEST_DEB_PKG2)], empty) == 2
+    assert check_plan([_install(TEST_DEB_PKG2)], installed) == 1
+    provided = DpkgStatus.from_string("Package: provider\n"
+                                      "Status: install ok installed\n"
+                                      "Provides: {}\n"
+                                      "Version: 1.0\n".format(
+                                          TEST_DEB_PKG1_NAME))
+    assert check_plan([_install(TEST_DEB_PKG2)], provided) == 1
+
+    # files on disk but not fully configured, e.g. after deferred triggers
+    for state in ["triggers-pending", "triggers-awaited", "half-configured",
+                  "unpacked"]:
+        partly = DpkgStatus.from_string(STATUS.replace(" installed",
+                                                       " " + state))
+        assert check_plan([_install(TEST_DEB_PKG2)], partly) == 1
+
+    # only config files left or a interrupted unpack
+    for status in ["deinstall ok config-files", "install ok half-installed"]:
+        partly = DpkgStatus.from_string(STATUS.replace(
+            "install ok installed", status))
+        with pytest.raises(PreflightError):
+            check_plan([_install(TEST_DEB_PKG2)], partly)
+
+    # missing dependency, the index is of the instruction that would fail
+    with pytest.raises(PreflightError) as exc:
+        check_plan([_install(TEST_DEB_PKG2)], empty)
+    assert exc.value.index == 0
+
+    inst_list = [
+        Instruction(InstructionType.BASH_SCRIPT, [TEST_BASH_SCRIPT]),
+        Instruction(InstructionType.DPKG_REMOVE, [TEST_DEB_PKG1_NAME]),
+        _install(TEST_DEB_PKG2),
+    ]
+    with pytest.raises(PreflightError) as exc:
+        check_plan(inst_list, installed)
+    assert exc.value.index == 2
+
+    # not a deb file
+    with pytest.raises(PreflightError) as exc:
+        check_plan([_install(TEST_BASH_SCRIPT)], empty)
+    assert exc.value.index == 0
+
+    # architecture, test packages are for all architectures
+    assert check_plan([_install(TEST_DEB_PKG1)], empty, archs=["armhf"]) == 1
+    archs = dpkg_architectures()
+    assert archs is None or len(archs) != 0
@@ -1,12 +1,183 @@
 """tests for the status archive functions"""
 
+import builtins
 from os import remove
-from os.path import isfile
-from oresat_linux_updater.status_archive import make_status_archive
-from .common import TEST_FILE_DIR
+from os.path import isfile, basename
+from shutil import move
+import pytest
+from oresat_linux_updater import status_archive, olm_file
+from oresat_linux_updater.codec import open_archive
+from oresat_linux_updater.status_archive import make_status_archive, \
+        make_dpkg_status_delta, apply_dpkg_status_delta, \
+        read_dpkg_status_file, acknowledge_status_archive, \
+        reset_status_snapshot, StatusArchiveCache, StatusArchive, \
+        MAX_PENDING_SNAPSHOTS
+from .common import TEST_FILE_DIR, TEST_WORK_DIR, TEST_CACHE_DIR, \
+        clear_test_work_dir, clear_test_cache_dir
 
 
 def test_make_status_file():
     status_file = make_status_archive(TEST_FILE_DIR, True)
     assert isfile(status_file)
     remove(status_file)
+
+
+def test_make_status_archive_writes(monkeypatch):
+    """The status archive should be the only file written, the members should
+    be added from memory.
+    """
+
+    clear_test_work_dir()
+    written = []
+    real_open = builtins.open
+
+    def counting_open(file, mode="r", *args, **kwargs):
+        if any(i in mode for i in "wax+"):
+            written.append(file)
+        return real_open(file, mode, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, "open", counting_open)
+    status_file = make_status_archive(TEST_FILE_DIR, True,
+                                      archive_dir=TEST_WORK_DIR)
+    monkeypatch.undo()
+
+    assert written == [status_file]
+    with open_archive(status_file) as tar:
+        assert len(tar.getnames()) == 2
+
+
+def test_dpkg_status_delta():
+    base = "Package: a\nVersion: 1\n\nPackage: b\nVersion: 1\n\n"
+    target = "Package: c\nVersion: 1\n\nPackage: a\nVersion: 2\n\n"
+
+    delta = make_dpkg_status_delta(base, target)
+    assert delta["removed"] == ["b:"]
+    assert delta["changed"] == {"a:": "Package: a\nVersion: 2",
+                                "c:": "Package: c\nVersion: 1"}
+    assert apply_dpkg_status_delta(base, delta) == \
+        "Package: a\nVersion: 2\n\nPackage: c\nVersion: 1\n\n"
+
+    with pytest.raises(ValueError):
+        apply_dpkg_status_delta(target, delta)
+
+
+def test_delta_status_archive(monkeypatch):
+    clear_test_work_dir()
+    status_dir = TEST_WORK_DIR + "status"
+    dpkg_file = TEST_WORK_DIR + "status.txt"
+    monkeypatch.setattr(status_archive, "DPKG_STATUS_FILE", dpkg_file)
+    dates = iter(range(1611940000, 1611950000))
+    monkeypatch.setattr(olm_file, "time", lambda: next(dates))
+
+    def make(content: str) -> str:
+        with open(dpkg_file, "w") as fptr:
+            fptr.write(content)
+        archive = make_status_archive(TEST_FILE_DIR, True,
+                                      status_dir=status_dir)
+        return move(archive, TEST_WORK_DIR)
+
+    status1 = "Package: a\nVersion: 1\n\nPackage: b\nVersion: 1\n\n"
+    status2 = "Package: a\nVersion: 2\n\nPackage: b\nVersion: 1\n\n"
+    status3 = "Package: a\nVersion: 2\n\n"
+
+    # nothing acknowledged yet, so full dpkg status file
+    full = make(status1)
+    assert read_dpkg_status_file(full) == status1
+    assert acknowledge_status_archive(status_dir, "bad_olu-status_0.tar.xz") \
+        is False
+    assert acknowledge_status_archive(status_dir, basename(full))
+
+    # now deltas, rebuilt from the chain of archives
+    delta1 = make(status2)
+    with pytest.raises(FileNotFoundError):
+        read_dpkg_status_file(delta1)
+    assert read_dpkg_status_file(delta1, [full]) == status2
+    assert acknowledge_status_archive(status_dir, basename(delta1))
+    delta2 = make(status3)
+    assert read_dpkg_status_file(delta2, [delta1, full]) == status3
+    with pytest.raises(FileNotFoundError):
+        read_dpkg_status_file(delta2, [delta1])
+
+    # reset, full dpkg status file again
+    reset_status_snapshot(status_dir)
+    assert read_dpkg_status_file(make(status1)) == status1
+
+
+def test_status_archive_cache(monkeypatch):
+    clear_test_work_dir()
+    clear_test_cache_dir()
+    dpkg_file = TEST_WORK_DIR + "status.txt"
+    monkeypatch.setattr(status_archive, "DPKG_STATUS_FILE", dpkg_file)
+    dates = iter(range(1611940000, 1611950000))
+    monkeypatch.setattr(olm_file, "time", lambda: next(dates))
+    with open(dpkg_file, "w") as fptr:
+        fptr.write("Package: a\nVersion: 1\n\n")
+
+    cache = StatusArchiveCache(TEST_WORK_DIR, max_size=1)
+
+    # nothing changed, so the same archive
+    archive = cache.make_status_archive(TEST_CACHE_DIR, True)
+    assert cache.make_status_archive(TEST_CACHE_DIR, True) == archive
+
+    # dpkg status file touched, but not changed
+    with open(dpkg_file, "w") as fptr:
+        fptr.write("Package: a\nVersion: 1\n\n")
+    assert cache.make_status_archive(TEST_CACHE_DIR, True) == archive
+
+    # dpkg status file changed
+    with open(dpkg_file, "a") as fptr:
+        fptr.write("Package: b\nVersion: 1\n\n")
+    archive2 = cache.make_status_archive(TEST_CACHE_DIR, True)
+    assert archive2 != archive
+
+    # update archive cache changed, over max size but the old archives were
+    # handed out and not acknowledged
+    open(TEST_CACHE_DIR + "test_update_1611940000.tar.xz", "w").close()
+    archive3 = cache.make_status_archive(TEST_CACHE_DIR, True)
+    assert archive3 != archive2
+    assert cache.archives == [archive, archive2, archive3]
+
+    # unknown archive, nothing is released
+    cache.acknowledge("olu-status_1611949999.tar.xz")
+    assert cache.archives == [archive, archive2, archive3]
+
+    # acknowledging releases it and the older ones, they are evicted
+    cache.acknowledge(basename(archive2))
+    assert cache.archives == [archive3]
+    assert not isfile(archive) and not isfile(archive2)
+    assert isfile(archive3)
+
+    # the newest archive is never evicted, even once acknowledged
+    cache.acknowledge(basename(archive3))
+    assert cache.archives == [archive3]
+    assert isfile(archive3)
+
+    # only the last handed out archives are kept
+    for i in range(MAX_PENDING_SNAPSHOTS + 2):
+        open(TEST_CACHE_DIR + "test_update_16119410{:02}.tar.xz".format(i),
+             "w").close()
+        cache.make_status_archive(TEST_CACHE_DIR, True)
+    assert len(cache.archives) == MAX_PENDING_SNAPSHOTS
+
+
+def test_status_archive_reader(monkeypatch):
+    """All members should be read with one pass over the status archive."""
+
+    opens = []
+    real_open_archive = status_archive.open_archive
+
+    def counting_open_archive(*args, **kwargs):
+        opens.append(args[0])
+        return real_open_archive(*args, **kwargs)
+
+    monkeypatch.setattr(status_archive, "open_archive", counting_open_archive)
+
+    archive = StatusArchive(TEST_FILE_DIR +
+                            "generic_olu-status_1614805451.tar.xz")
+    assert opens == []
+    assert isinstance(archive.update_archives, list)
+    assert archive.has_dpkg_status
+    assert archive.dpkg_status_delta is None
+    assert archive.dpkg_status().startswith("Package: ")
+    assert archive.dpkg_status() == archive.dpkg_status()
+    assert len(opens) == 1
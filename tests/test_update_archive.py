@@ -1,16 +1,22 @@
 """tests for the updater archives and its instructions file"""
 
+import tarfile
 import pytest
-from oresat_linux_updater.instruction import Instruction, InstructionType
+from io import BytesIO
+from os.path import isfile, basename, getsize
+from oresat_linux_updater.instruction import Instruction, InstructionType, \
+        INSTRUCTIONS_WITH_FILES
 from oresat_linux_updater.update_archive import UpdateArchiveError, \
         read_instructions_file, extract_update_archive, \
-        write_instructions_file, create_update_archive
-from .common import TEST_WORK_DIR, TEST_INST_FILE1, TEST_INST_FILE2, \
-        TEST_INST_FILE3, TEST_INST_FILE4, TEST_INST_FILE5, TEST_UPDATE0, \
-        TEST_UPDATE1, TEST_UPDATE2, TEST_UPDATE3, TEST_UPDATE4, TEST_UPDATE5, \
-        TEST_UPDATE6, TEST_UPDATE7, TEST_UPDATE8, TEST_UPDATE9, \
-        clear_test_work_dir, TEST_DEB_PKG1, TEST_DEB_PKG2, TEST_DEB_PKG1_NAME,\
-        TEST_DEB_PKG2_NAME, TEST_BASH_SCRIPT
+        write_instructions_file, create_update_archive, UpdateArchiveStream, \
+        read_update_manifest, MANIFEST_FILE, INST_FILE
+from .common import TEST_WORK_DIR, TEST_CACHE_DIR, TEST_INST_FILE1, \
+        TEST_INST_FILE2, TEST_INST_FILE3, TEST_INST_FILE4, TEST_INST_FILE5, \
+        TEST_UPDATE0, TEST_UPDATE1, TEST_UPDATE2, TEST_UPDATE3, TEST_UPDATE4, \
+        TEST_UPDATE5, TEST_UPDATE6, TEST_UPDATE7, TEST_UPDATE8, TEST_UPDATE9, \
+        clear_test_work_dir, clear_test_cache_dir, TEST_DEB_PKG1, \
+        TEST_DEB_PKG2, TEST_DEB_PKG1_NAME, TEST_DEB_PKG2_NAME, \
+        TEST_BASH_SCRIPT
 
 
 def test_read_instructions_file():
@@ -113,3 +119,140 @@ def test_create_update_archive():
 
     with pytest.raises(UpdateArchiveError):
         create_update_archive("test", inst_list2, TEST_WORK_DIR)
+
+
+def test_update_archive_stream():
+    """Test extracting updates archives in the background."""
+
+    # valid updates
+
+    for update in [TEST_UPDATE0, TEST_UPDATE1, TEST_UPDATE2]:
+        clear_test_work_dir()
+        stream = UpdateArchiveStream(update, TEST_WORK_DIR)
+        stream.start()
+        for inst in stream.read_instructions():
+            if inst.type in INSTRUCTIONS_WITH_FILES:
+                stream.wait_for(inst.items)
+                for item in inst.items:
+                    assert isfile(item)
+        stream.stop()
+
+    # invalid updates
+
+    for update in [TEST_UPDATE3, TEST_UPDATE6, TEST_UPDATE7, TEST_UPDATE8]:
+        clear_test_work_dir()
+        stream = UpdateArchiveStream(update, TEST_WORK_DIR)
+        stream.start()
+        with pytest.raises(UpdateArchiveError):
+            stream.read_instructions()
+        stream.stop()
+
+    clear_test_work_dir()
+    stream = UpdateArchiveStream(TEST_UPDATE4, TEST_WORK_DIR)
+    stream.start()
+    with pytest.raises(UpdateArchiveError):
+        for inst in stream.read_instructions():
+            if inst.type in INSTRUCTIONS_WITH_FILES:
+                stream.wait_for(inst.items)
+    stream.stop()
+
+    with pytest.raises(UpdateArchiveError):
+        UpdateArchiveStream(TEST_UPDATE9, TEST_WORK_DIR)
+
+
+def test_read_update_manifest():
+    """Test reading the manifest without extracting the update archive."""
+
+    inst_list = [
+                Instruction(InstructionType.DPKG_INSTALL, [TEST_DEB_PKG1, TEST_DEB_PKG2]),
+                Instruction(InstructionType.DPKG_REMOVE, [TEST_DEB_PKG1_NAME]),
+                Instruction(InstructionType.BASH_SCRIPT, [TEST_BASH_SCRIPT])
+            ]
+
+    clear_test_work_dir()
+    update = create_update_archive("test", inst_list, TEST_WORK_DIR, False)
+
+    manifest = read_update_manifest(update)
+    assert len(manifest["instructions"]) == 3
+    assert manifest["instructions"][0]["items"] == \
+        [basename(TEST_DEB_PKG1), basename(TEST_DEB_PKG2)]
+    assert [i["name"] for i in manifest["members"]] == \
+        [INST_FILE, basename(TEST_DEB_PKG1), basename(TEST_DEB_PKG2),
+         basename(TEST_BASH_SCRIPT)]
+    assert manifest["members"][1]["size"] == getsize(TEST_DEB_PKG1)
+    assert "requires" not in manifest
+
+    clear_test_work_dir()
+    update = create_update_archive("test", inst_list, TEST_WORK_DIR, False,
+                                   requires=["/tmp/" + basename(TEST_UPDATE0)])
+    manifest = read_update_manifest(update)
+    assert manifest["requires"] == [basename(TEST_UPDATE0)]
+
+    # manifest is the first member
+    with tarfile.open(update, "r:xz") as tar:
+        assert tar.getnames()[0] == MANIFEST_FILE
+
+    # streaming reads the instructions from the manifest
+    stream = UpdateArchiveStream(update, TEST_WORK_DIR)
+    stream.start()
+    assert len(stream.read_instructions()) == 3
+    stream.stop()
+
+    # old update archives without a manifest
+    with pytest.raises(UpdateArchiveError):
+        read_update_manifest(TEST_UPDATE0)
+
+    # invalid update archives
+    with pytest.raises(UpdateArchiveError):
+        read_update_manifest(TEST_UPDATE8)
+    with pytest.raises(UpdateArchiveError):
+        read_update_manifest(TEST_UPDATE9)
+    with pytest.raises(UpdateArchiveError):
+        read_update_manifest(TEST_WORK_DIR + "test_update_1611940000.tar.xz")
+
+
+def _tamper_update_archive(update: str, name: str):
+    """Replace the contents of a member in a update archive, but not its
+    manifest entry.
+    """
+
+    members = []
+    with tarfile.open(update, "r:xz") as tar:
+        for member in tar.getmembers():
+            data = tar.extractfile(member).read()
+            if member.name == name:
+                data = data[:-1] + bytes([data[-1] ^ 0xff])
+            members.append((member, data))
+
+    with tarfile.open(update, "w:xz") as tar:
+        for member, data in members:
+            tar.addfile(member, BytesIO(data))
+
+
+def test_verify_update_archive():
+    """Test members are verified against the manifest while extracting."""
+
+    inst_list = [
+                Instruction(InstructionType.DPKG_INSTALL, [TEST_DEB_PKG1]),
+                Instruction(InstructionType.BASH_SCRIPT, [TEST_BASH_SCRIPT])
+            ]
+
+    clear_test_cache_dir()
+    clear_test_work_dir()
+    update = create_update_archive("test", inst_list, TEST_CACHE_DIR, False)
+    assert len(extract_update_archive(update, TEST_WORK_DIR)) == 2
+
+    _tamper_update_archive(update, basename(TEST_DEB_PKG1))
+
+    clear_test_work_dir()
+    with pytest.raises(UpdateArchiveError):
+        extract_update_archive(update, TEST_WORK_DIR)
+    assert not isfile(TEST_WORK_DIR + basename(TEST_DEB_PKG1))
+
+    clear_test_work_dir()
+    stream = UpdateArchiveStream(update, TEST_WORK_DIR)
+    stream.start()
+    stream.read_instructions()
+    with pytest.raises(UpdateArchiveError):
+        stream.wait_for([TEST_DEB_PKG1])
+    stream.stop()
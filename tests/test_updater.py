@@ -1,10 +1,28 @@
 """tests for the Updater class"""
 
+import json
+import zlib
+import hashlib
 import pytest
-from oresat_linux_updater.updater import Updater, Result
+import threading
+from os import remove, listdir, mkdir, stat, utime, open as os_open, \
+        close, O_RDONLY
+from os.path import basename, isfile
+from shutil import copyfile, move
+from threading import Thread
+from oresat_linux_updater import updater as updater_module
+from oresat_linux_updater.updater import Updater, Result, PARTIAL_DIR, \
+        _proc_thread_id
+from oresat_linux_updater.update_archive import extract_update_archive, \
+        create_update_archive
+from oresat_linux_updater.instruction import Instruction, InstructionType, \
+        plan_batch
+from oresat_linux_updater.journal import UpdateJournal, JOURNAL_FILE
+from oresat_linux_updater.dpkg_status import DpkgStatus, DPKG_STATUS_FILE
 from .common import TEST_WORK_DIR, TEST_CACHE_DIR, LOGGER, TEST_UPDATE0, \
         TEST_UPDATE1, TEST_UPDATE2, TEST_UPDATE3, TEST_UPDATE9, \
-        clear_test_cache_dir, clear_test_work_dir
+        TEST_DEB_PKG1_NAME, TEST_BASH_SCRIPT, clear_test_cache_dir, \
+        clear_test_work_dir
 
 
 @pytest.fixture
@@ -15,6 +33,106 @@ def updater():
     return Updater(TEST_WORK_DIR, TEST_CACHE_DIR, LOGGER)
 
 
+def test_add_update_parallel(updater, tmp_path):
+    """Adds at the same time, some with the same filename, should leave the
+    cache list and the cache directory the same.
+    """
+
+    names = []
+    for i in range(8):
+        names.append(str(tmp_path / "test_update_16119400{:02}.tar.xz".format(
+            i)))
+        copyfile(TEST_UPDATE0, names[-1])
+
+    threads = [Thread(target=updater.add_update_archive, args=(i,))
+               for i in names * 4]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    cache = sorted([basename(i) for i in names])
+    assert updater.available_update_archives == len(names)
+    assert updater.list_updates == json.dumps(cache)
+    assert sorted([i for i in listdir(TEST_CACHE_DIR)
+                   if not i.startswith(".")]) == cache
+
+
+def test_clear_cache_dir(updater):
+    """Copies being added should only be deleted when the updater starts."""
+
+    partial = TEST_CACHE_DIR + PARTIAL_DIR + basename(TEST_UPDATE0) + ".1234"
+    copyfile(TEST_UPDATE0, partial)
+    copyfile(TEST_UPDATE0, TEST_WORK_DIR + basename(TEST_UPDATE0))
+
+    updater.clear_cache_dir()
+    assert listdir(TEST_WORK_DIR) == []
+    assert isfile(partial)
+
+    Updater(TEST_WORK_DIR, TEST_CACHE_DIR, LOGGER)
+    assert not isfile(partial)
+
+
+def test_add_update_fd(updater):
+    fd = os_open(TEST_UPDATE1, O_RDONLY)
+    assert updater.add_update_archive_fd(basename(TEST_UPDATE1), fd)
+    assert not updater.add_update_archive_fd(basename(TEST_UPDATE9), fd)
+    close(fd)
+    assert updater.add_update_archive(TEST_UPDATE2)
+    assert updater.available_update_archives == 2
+
+    # the caller's files are never hardlinked, even on the same filesystem
+    stats = json.loads(updater.ingest_stats)
+    assert sum([i["count"] for i in stats.values()]) == 2
+    assert stats["link"]["count"] == 0
+
+
+def test_upload(updater, tmp_path):
+    """Upload a update archive in parts over two "passes", with a restart of
+    the daemon between them.
+    """
+
+    upload_dir = str(tmp_path / "upload")
+    updater = Updater(TEST_WORK_DIR, TEST_CACHE_DIR, LOGGER,
+                      upload_dir=upload_dir)
+    filename = basename(TEST_UPDATE0)
+    with open(TEST_UPDATE0, "rb") as fptr:
+        data = fptr.read()
+    sha256 = hashlib.sha256(data).hexdigest()
+    parts = [data[i:i + 500] for i in range(0, len(data), 500)]
+
+    assert not updater.begin_upload("invalid", len(data), sha256, 500)
+    assert updater.begin_upload(filename, len(data), sha256, 500)
+    assert updater.add_upload_part(filename, 1, parts[1],
+                                   zlib.crc32(parts[1]))
+    assert not updater.add_upload_part(filename, 0, parts[0], 0)
+    assert not updater.commit_upload(filename)
+
+    updater = Updater(TEST_WORK_DIR, TEST_CACHE_DIR, LOGGER,
+                      upload_dir=upload_dir)
+    assert updater.list_uploads == json.dumps([filename])
+    assert updater.begin_upload(filename, len(data), sha256, 500)
+    missing = updater.missing_upload_parts(filename)
+    assert 1 not in missing
+    for i in missing:
+        assert updater.add_upload_part(filename, i, parts[i],
+                                       zlib.crc32(parts[i]))
+
+    assert updater.missing_upload_parts(filename) == []
+    assert updater.commit_upload(filename)
+    assert updater.list_uploads == "[]"
+    assert updater.available_update_archives == 1
+    assert listdir(upload_dir) == []
+    with open(TEST_CACHE_DIR + filename, "rb") as fptr:
+        assert fptr.read() == data
+
+    # cancel
+    assert updater.begin_upload(filename, len(data), sha256, 500)
+    assert updater.cancel_upload(filename)
+    assert not updater.cancel_upload(filename)
+    assert listdir(upload_dir) == []
+
+
 def test_default_update_properties(updater):
     # test all property are back to default
     assert updater.is_updating is False
@@ -22,6 +140,8 @@ def test_default_update_properties(updater):
     assert updater.total_instructions == 0
     assert updater.instruction_index == 0
     assert updater.instruction_command == ""
+    assert updater.instruction_output_bytes == 0
+    assert updater.instruction_output_lines == 0
 
 
 def test_add_update(updater):
@@ -43,12 +163,21 @@ def test_add_update(updater):
     test_default_update_properties(updater)
 
 
-def test_update(updater):
+@pytest.fixture
+def streaming_updater():
+    """make the file_cache object that runs instructions while extracting"""
+    clear_test_cache_dir()
+    clear_test_work_dir()
+    return Updater(TEST_WORK_DIR, TEST_CACHE_DIR, LOGGER, streaming=True)
+
+
+def _run_updates(updater, failed: int):
+    """Run the test updates, the 3rd update fails with the failed result."""
 
     # test valid updates and correct ordering
     # should fails on the 3rd update due to missing dependencies
     # should run in order 0 -> 1 -> 2
-    # when 2 fails cache should be cleared
+    # when 2 fails, 3 has no requires list so it should be deleted
     assert updater.available_update_archives == 0
     updater.add_update_archive(TEST_UPDATE0)
     updater.add_update_archive(TEST_UPDATE1)
@@ -58,13 +187,14 @@ def test_update(updater):
 
     assert updater.update() == Result.SUCCESS.value
     assert updater.available_update_archives == 3
+    assert updater.last_update_archive == basename(TEST_UPDATE0)
     test_default_update_properties(updater)
 
     assert updater.update() == Result.SUCCESS.value
     assert updater.available_update_archives == 2
     test_default_update_properties(updater)
 
-    assert updater.update() == Result.FAILED_CRIT.value
+    assert updater.update() == failed
     assert updater.available_update_archives == 0
     test_default_update_properties(updater)
 
@@ -74,3 +204,350 @@ def test_update(updater):
     assert updater.update() == Result.FAILED_NON_CRIT.value
     assert updater.available_update_archives == 0
     test_default_update_properties(updater)
+
+
+def test_update(updater):
+    """The missing dependency should be found by the pre-flight check."""
+
+    _run_updates(updater, Result.FAILED_NON_CRIT.value)
+
+
+def test_update_missing_file(updater):
+    """A update archive in the cache index but not the cache directory should
+    be skipped.
+    """
+
+    updater.add_update_archive(TEST_UPDATE0)
+    updater.add_update_archive(TEST_UPDATE1)
+    remove(TEST_CACHE_DIR + basename(TEST_UPDATE0))
+
+    assert updater.update() == Result.SUCCESS.value
+    assert updater.available_update_archives == 0
+    assert updater.update() == Result.NOTHING.value
+
+
+def test_failed_update_dependents(updater, tmp_path):
+    """Only the update archives that require the failed update should be
+    deleted from the cache.
+    """
+
+    inst_list = [Instruction(InstructionType.BASH_SCRIPT, [TEST_BASH_SCRIPT])]
+    failed = basename(TEST_UPDATE2)
+    requires = {
+        "test_update_1611943000.tar.xz": [],  # unrelated
+        "test_update_1611944000.tar.xz": [failed],
+        "test_update_1611945000.tar.xz": ["test_update_1611944000.tar.xz"],
+        "test_update_1611946000.tar.xz": [basename(TEST_UPDATE0)],
+    }
+    for name in requires:
+        update = create_update_archive("test", inst_list, str(tmp_path),
+                                       False, requires=requires[name])
+        move(update, str(tmp_path / name))
+        updater.add_update_archive(str(tmp_path / name))
+
+    updater.add_update_archive(TEST_UPDATE2)
+    updater.add_update_archive(TEST_UPDATE3)  # no requires list
+
+    assert updater.update() == Result.FAILED_NON_CRIT.value
+    assert json.loads(updater.list_updates) == [
+        "test_update_1611943000.tar.xz", "test_update_1611946000.tar.xz"]
+
+
+def test_failed_update_unreadable_dependent(updater, tmp_path):
+    """A update archive in the cache that can't be read when a update fails
+    should be treated as requiring the failed update.
+    """
+
+    newer = str(tmp_path / "test_update_1611944000.tar.xz")
+    copyfile(TEST_UPDATE0, newer)
+    updater.add_update_archive(TEST_UPDATE3)
+    updater.add_update_archive(newer)
+    remove(TEST_CACHE_DIR + basename(newer))
+    mkdir(TEST_CACHE_DIR + basename(newer))  # IsADirectoryError when read
+
+    assert updater.update() == Result.FAILED_NON_CRIT.value
+    assert updater.available_update_archives == 0
+    test_default_update_properties(updater)
+
+
+def test_update_all(updater, tmp_path):
+    """All cached update archives should run in one pass, with a result for
+    each of them.
+    """
+
+    updater.add_update_archive(TEST_UPDATE0)
+    updater.add_update_archive(TEST_UPDATE1)
+    updater.add_update_archive(TEST_UPDATE2)
+    updater.add_update_archive(TEST_UPDATE3)
+
+    # 3 is invalid, so it is not run, 2 fails the pre-flight check due to
+    # missing dependencies, so it is not run either
+    assert updater.update_all() == [
+        (basename(TEST_UPDATE3), Result.FAILED_NON_CRIT.value),
+        (basename(TEST_UPDATE2), Result.FAILED_NON_CRIT.value),
+        (basename(TEST_UPDATE0), Result.SUCCESS.value),
+        (basename(TEST_UPDATE1), Result.SUCCESS.value),
+    ]
+    assert updater.available_update_archives == 0
+    test_default_update_properties(updater)
+
+    assert updater.update_all() == []
+
+    # a later remove does not replace the install that fails alone, it is
+    # not in the same dpkg call, so the later update archive that requires it
+    # is deleted too
+    remove_again = str(tmp_path / "test_update_1611943000.tar.xz")
+    copyfile(TEST_UPDATE1, remove_again)
+    updater.add_update_archive(TEST_UPDATE2)
+    updater.add_update_archive(remove_again)
+    assert updater.update_all() == [
+        (basename(TEST_UPDATE2), Result.FAILED_NON_CRIT.value),
+    ]
+    assert updater.available_update_archives == 0
+
+
+def test_streaming_update(streaming_updater):
+    """Same as test_update, but running instructions while extracting, so
+    there is no pre-flight check and dpkg fails on the missing dependency.
+    """
+
+    _run_updates(streaming_updater, Result.FAILED_CRIT.value)
+
+
+def test_skip_satisfied(updater, tmp_path):
+    """dpkg operations already done should be skipped, the rest of the update
+    should still run.
+    """
+
+    # same updates sent twice
+    resent0 = str(tmp_path / "test_update_1611940001.tar.xz")
+    resent1 = str(tmp_path / "test_update_1611941112.tar.xz")
+    copyfile(TEST_UPDATE0, resent0)
+    copyfile(TEST_UPDATE1, resent1)
+
+    # install
+    updater.add_update_archive(TEST_UPDATE0)
+    assert updater.update() == Result.SUCCESS.value
+    assert updater.skipped_packages == 0
+
+    updater.add_update_archive(resent0)
+    assert updater.update() == Result.SUCCESS.value
+    assert updater.skipped_packages == 2
+
+    # remove
+    updater.add_update_archive(TEST_UPDATE1)
+    assert updater.update() == Result.SUCCESS.value
+    assert updater.skipped_packages == 0
+
+    updater.add_update_archive(resent1)
+    assert updater.update() == Result.SUCCESS.value
+    assert updater.skipped_packages == 2
+
+
+def test_parse_dpkg_status_once(updater, monkeypatch, tmp_path):
+    """The dpkg status file loaded by the pre-flight check should be reused by
+    the first dpkg instruction.
+    """
+
+    loads = []
+    from_file = DpkgStatus.from_file
+
+    def counted(path):
+        loads.append(path)
+        return from_file(path)
+
+    monkeypatch.setattr(DpkgStatus, "from_file", counted)
+
+    updater.add_update_archive(TEST_UPDATE0)
+    assert updater.update() == Result.SUCCESS.value
+    assert len(loads) == 1
+
+    # nothing to pre-flight check, loaded by the dpkg instruction
+    loads.clear()
+    updater.add_update_archive(TEST_UPDATE1)
+    assert updater.update() == Result.SUCCESS.value
+    assert len(loads) == 1
+
+    resent0 = str(tmp_path / "test_update_1611950000.tar.xz")
+    copyfile(TEST_UPDATE0, resent0)
+    loads.clear()
+    updater.add_update_archive(resent0)
+    assert updater.update_all() == [(basename(resent0),
+                                     Result.SUCCESS.value)]
+    assert len(loads) == 1
+
+    resent1 = str(tmp_path / "test_update_1611951111.tar.xz")
+    copyfile(TEST_UPDATE1, resent1)
+    updater.add_update_archive(resent1)
+    assert updater.update() == Result.SUCCESS.value
+
+
+def test_missing_dpkg_status(updater, monkeypatch, caplog):
+    """A missing dpkg status file should skip the pre-flight check and the
+    check for dpkg operations already done, not fail the update.
+    """
+
+    monkeypatch.setattr(updater_module, "DPKG_STATUS_FILE",
+                        TEST_WORK_DIR + "missing-status")
+    runs = []
+    monkeypatch.setattr(Instruction, "run",
+                        lambda self, log, output=None: runs.append(self.type))
+
+    updater.add_update_archive(TEST_UPDATE1)
+    caplog.clear()
+    assert updater.update() == Result.SUCCESS.value
+    assert runs == [InstructionType.DPKG_REMOVE]
+    assert "no dpkg status file" in caplog.text
+
+
+def test_resume_update(updater, caplog):
+    """A resumed update should skip extraction if the extracted files are
+    intact and only run the instructions that did not complete.
+    """
+
+    def interrupted_update():
+        clear_test_work_dir()
+        copyfile(TEST_UPDATE0, TEST_WORK_DIR + basename(TEST_UPDATE0))
+        extract_update_archive(TEST_UPDATE0, TEST_WORK_DIR)
+        # the dpkg install completed, the bash script did not
+        UpdateJournal(TEST_WORK_DIR + JOURNAL_FILE, basename(TEST_UPDATE0),
+                      True, 1).save()
+
+    interrupted_update()
+    caplog.clear()
+    assert updater.update() == Result.SUCCESS.value
+    assert "skipping extraction" in caplog.text
+    assert "dpkg --no-triggers -i" not in caplog.text
+    assert not DpkgStatus.from_file(DPKG_STATUS_FILE).is_installed(
+        TEST_DEB_PKG1_NAME)
+
+    # extracted files are not intact, extract again
+    interrupted_update()
+    remove(TEST_WORK_DIR + basename(TEST_BASH_SCRIPT))
+    caplog.clear()
+    assert updater.update() == Result.SUCCESS.value
+    assert "skipping extraction" not in caplog.text
+    assert "dpkg --no-triggers -i" not in caplog.text
+
+
+def test_resume_batch(updater, caplog):
+    """A batch from update_all() interrupted by a reboot should be resumed
+    from its journal, without running the finished instructions again.
+    """
+
+    def interrupted_batch():
+        clear_test_work_dir()
+        updater.add_update_archive(TEST_UPDATE0)
+        updater.add_update_archive(TEST_UPDATE1)
+        inst_lists = []
+        for i, update in enumerate([TEST_UPDATE0, TEST_UPDATE1]):
+            mkdir(TEST_WORK_DIR + str(i))
+            inst_lists.append(extract_update_archive(update, TEST_WORK_DIR +
+                                                     str(i)))
+        plan, owners = plan_batch(inst_lists)
+        # the dpkg install completed, the bash script and remove did not
+        UpdateJournal(TEST_WORK_DIR + JOURNAL_FILE, "", True, 1,
+                      [basename(TEST_UPDATE0), basename(TEST_UPDATE1)], plan,
+                      owners).save()
+
+    interrupted_batch()
+    caplog.clear()
+    assert updater.update_all() == [
+        (basename(TEST_UPDATE0), Result.SUCCESS.value),
+        (basename(TEST_UPDATE1), Result.SUCCESS.value),
+    ]
+    assert "resuming batch of 2 update archives" in caplog.text
+    assert "dpkg --no-triggers -i" not in caplog.text
+    assert updater.available_update_archives == 0
+
+    # update() resumes it too
+    interrupted_batch()
+    assert updater.update() == Result.SUCCESS.value
+    assert updater.last_update_archive == basename(TEST_UPDATE1)
+    assert updater.available_update_archives == 0
+
+    # extracted files are not intact, the started update archive fails and
+    # the later one requires it
+    interrupted_batch()
+    remove(TEST_WORK_DIR + "0/" + basename(TEST_BASH_SCRIPT))
+    assert updater.update_all() == [
+        (basename(TEST_UPDATE0), Result.FAILED_CRIT.value),
+    ]
+    assert updater.available_update_archives == 0
+    test_default_update_properties(updater)
+
+
+def test_thread_id():
+    """The procfs thread id used on python < 3.8 should be the kernel's."""
+
+    ids = []
+    thread = Thread(target=lambda: ids.append(_proc_thread_id()))
+    thread.start()
+    thread.join()
+
+    assert ids[0] != _proc_thread_id()
+    if hasattr(threading, "get_native_id"):
+        assert _proc_thread_id() == threading.get_native_id()
+
+
+def test_stage_key(updater, tmp_path):
+    """A re-sent update archive with the same name, size, and modification
+    time should not match the staged one.
+    """
+
+    resent = str(tmp_path / basename(TEST_UPDATE0))
+    copyfile(TEST_UPDATE0, resent)
+    info = stat(resent)
+
+    updater.add_update_archive(resent)
+    with updater._stage_cond:
+        key = updater._stage_key()
+
+    remove(resent)
+    copyfile(TEST_UPDATE0, resent)
+    utime(resent, ns=(info.st_atime_ns, info.st_mtime_ns))  # like cp -p
+    updater.add_update_archive(resent)
+    with updater._stage_cond:
+        assert updater._stage_key()[:2] == key[:2]
+        assert updater._stage_key() != key
+
+
+def test_staging(tmp_path, caplog):
+    """The oldest update archive in the cache should be staged in the
+    background, restaged when the cache order changes, and used by update().
+    """
+
+    clear_test_cache_dir()
+    clear_test_work_dir()
+    updater = Updater(TEST_WORK_DIR, TEST_CACHE_DIR, LOGGER,
+                      stage_dir=str(tmp_path / "stage"))
+    updater.start_staging()
+
+    def wait_for_staged(name: str):
+        with updater._stage_cond:
+            assert updater._stage_cond.wait_for(
+                lambda: updater._staged is not None and
+                updater._staged[0] == name, 10)
+
+    # a older update archive is added after the newer one was staged
+    older = str(tmp_path / "test_update_1611930000.tar.xz")
+    copyfile(TEST_UPDATE0, older)
+    updater.add_update_archive(TEST_UPDATE1)
+    wait_for_staged(basename(TEST_UPDATE1))
+    updater.add_update_archive(older)
+    wait_for_staged(basename(older))
+
+    caplog.clear()
+    assert updater.update() == Result.SUCCESS.value
+    assert "using staged files for " + basename(older) in caplog.text
+    assert DpkgStatus.from_file(DPKG_STATUS_FILE).is_installed(
+        TEST_DEB_PKG1_NAME)
+
+    wait_for_staged(basename(TEST_UPDATE1))
+    caplog.clear()
+    assert updater.update() == Result.SUCCESS.value
+    assert "using staged files for " + basename(TEST_UPDATE1) in caplog.text
+    assert not DpkgStatus.from_file(DPKG_STATUS_FILE).is_installed(
+        TEST_DEB_PKG1_NAME)
+
+    updater.stop_staging()
@@ -0,0 +1,63 @@
+"""tests for uploading update archives in parts"""
+
+import zlib
+import hashlib
+import pytest
+from os.path import isfile
+from oresat_linux_updater.upload import Upload, UploadError, STATE_EXT
+from .common import TEST_WORK_DIR, TEST_UPDATE0, clear_test_work_dir
+
+PART_SIZE = 500
+
+
+def _parts(path: str) -> list:
+    with open(path, "rb") as fptr:
+        data = fptr.read()
+    return [data[i:i + PART_SIZE] for i in range(0, len(data), PART_SIZE)]
+
+
+def test_upload():
+    clear_test_work_dir()
+    path = TEST_WORK_DIR + "test_update_1611940000.tar.xz.upload"
+
+    with open(TEST_UPDATE0, "rb") as fptr:
+        data = fptr.read()
+    sha256 = hashlib.sha256(data).hexdigest()
+    parts = _parts(TEST_UPDATE0)
+
+    upload = Upload(path, len(data), sha256, PART_SIZE)
+    upload.begin()
+    assert upload.parts == len(parts)
+    assert upload.missing() == list(range(len(parts)))
+
+    # out of order
+    upload.add_part(2, parts[2], zlib.crc32(parts[2]))
+    upload.add_part(0, parts[0], zlib.crc32(parts[0]))
+
+    with pytest.raises(UploadError):  # bad crc
+        upload.add_part(1, parts[1], zlib.crc32(parts[1]) ^ 1)
+    with pytest.raises(UploadError):  # bad size
+        upload.add_part(1, parts[1][1:], zlib.crc32(parts[1][1:]))
+    with pytest.raises(UploadError):  # bad index
+        upload.add_part(len(parts), parts[0], zlib.crc32(parts[0]))
+    with pytest.raises(UploadError):  # missing parts
+        upload.verify()
+
+    # survives a restart
+    upload = Upload.load(path)
+    assert upload.missing() == [1] + list(range(3, len(parts)))
+
+    for i in upload.missing():
+        upload.add_part(i, parts[i], zlib.crc32(parts[i]))
+    assert upload.missing() == []
+    upload.verify()
+
+    with open(path, "rb") as fptr:
+        assert fptr.read() == data
+
+    upload.delete()
+    assert not isfile(path)
+    assert not isfile(path + STATE_EXT)
+    assert Upload.load(path) is None
+
+    clear_test_work_dir()
@@ -68,6 +68,12 @@ def main():
                         help="define the board used")
     parser.add_argument("-a", "--add",
                         help="add olu-status tar files to the olu-status cache")
+    parser.add_argument("-c", "--codec", default=None,
+                        help="override the board's update archive compression "
+                        "codec (xz, zstd, gz, none)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of processes to compress with (default "
+                        "is the number of cpus)")
     args = parser.parse_args()
 
     if len(sys.argv) < 2:
@@ -79,7 +85,7 @@ def main():
 
     # check if board parameter exists
     if args.board != None:
-        maker = UpdateMaker(args.board)
+        maker = UpdateMaker(args.board, args.codec, args.jobs)
 
         while True:
             command = input("-> ").split(" ")
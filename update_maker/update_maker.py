@@ -1,16 +1,16 @@
 """Make update files for OreSat Linux Updater daemon."""
 
-import tarfile
 import json
 from os import listdir, remove, walk, stat
 from os.path import isfile, basename
 from shutil import copyfile
 from pathlib import Path
-from ast import literal_eval
-from oresat_linux_updater.olm_file import OLMFile
+from oresat_linux_updater.olm_file import scan_dir
 from oresat_linux_updater.instruction import Instruction, InstructionType
-from oresat_linux_updater.update_archive import create_update_archive
-from oresat_linux_updater.status_archive import read_dpkg_status_file, read_olu_status_file
+from oresat_linux_updater.update_archive import create_update_archive, \
+        read_update_manifest, UpdateArchiveError, INST_FILE
+from oresat_linux_updater.codec import DEFAULT_CODEC, get_codec, open_archive
+from oresat_linux_updater.status_archive import StatusArchive
 from apt.cache import Cache
 
 
@@ -24,26 +24,48 @@ SYSTEM_APT_SOURCES_FILE = "/etc/apt/sources.list"
 SYSTEM_SIGNATURES_DIR = "/var/lib/apt/lists/"
 OLU_APT_SOURCES_FILE = ROOT_DIR + "etc/apt/sources.list"
 OLU_SIGNATURES_DIR = ROOT_DIR + "var/lib/apt/lists/"
+BOARD_CODECS = {
+    "gps": "zstd",
+    "star-tracker": "zstd",
+    "dxwifi": "zstd",
+    "cfc": "zstd",
+}
+"""Compression codec profile for each board. xz makes the smallest update
+archives, zstd updates archive are a bit bigger, but are much faster to
+decompress on the boards' ARM processors. Boards not listed use
+:data:`DEFAULT_CODEC`.
+"""
 
 
 class UpdateMaker():
     """A class for making updates for OreSat Linux Updater daemon"""
 
-    def __init__(self, board: str):
+    def __init__(self, board: str, codec=None, jobs=None):
         """
         Parameters
         ----------
         board: str
             The board to make the update for.
+        codec: str
+            The compression codec to use for update archive. If not set, the
+            codec in the board's profile will be used.
+        jobs: int
+            Number of processes to compress the update archive with. If not
+            set, the number of cpus will be used.
         """
         self._board = board
         self._status_file = ""
         self._board = board
+        if codec is None:
+            codec = BOARD_CODECS.get(board, DEFAULT_CODEC)
+        self._codec = get_codec(codec).name
+        self._jobs = jobs
         self._cache = Cache(rootdir=ROOT_DIR)
         self._deb_pkgs = []
         self._inst_list = []
         self._not_installed_yet_list = []
         self._not_removed_yet_list = []
+        self._requires = []
 
         print("updating cache")
         self._cache.update(raise_on_error=False)
@@ -69,39 +91,49 @@ class UpdateMaker():
             if i.endswith(".deb"):
                 remove(DOWNLOAD_DIR + i)        
 
-        status_files = []
-        for i in listdir(STATUS_CACHE_DIR):
-            status_files.append(OLMFile(load=i))
-        status_files.sort()
-
         # find latest olu status tar file
-        for i in status_files:
-            if i.board == board:
-                self._status_file = STATUS_CACHE_DIR + i.name
-                break
+        board_status_files = [STATUS_CACHE_DIR + i.name for i in
+                              scan_dir(STATUS_CACHE_DIR, board=board)]
+        if len(board_status_files) != 0:
+            self._status_file = board_status_files[0]
 
         if self._status_file == "":
             msg = "No status file for {} board in cache".format(board)
             raise FileNotFoundError(msg)
 
-        # update status file
-        dpkg_data = read_dpkg_status_file(self._status_file)
+        # update status file, older status files may be needed if the latest
+        # only has a delta
+        status_archive = StatusArchive(self._status_file)
+        dpkg_data = status_archive.dpkg_status(board_status_files[1:])
         with open(DPKG_STATUS_FILE, "w") as fptr:
             fptr.write(dpkg_data)
 
-        # dealing with update files that are not installed yet
-        olu_status_data = read_olu_status_file(self._status_file)
-        for file in literal_eval(olu_status_data):
-            with tarfile.open(UPDATE_CACHE_DIR + file, "r") as tar:
-                with tar.extractfile("instructions.txt") as instructions:
-                    for i in json.loads(instructions.read()):
-                        if i["type"] == "DPKG_INSTALL":
-                            for pkg in i["items"]:
-                                pkg_obj = self._cache[pkg.split('_')[0]]
-                                pkg_obj.mark_install() 
-                            self._not_installed_yet_list.extend(i["items"])
-                        elif i["type"] == "DPKG_REMOVE" or i["type"] == "DPKG_PURGE":
-                            self._not_removed_yet_list.extend(i["items"])
+        # dealing with update files that are not installed yet, the new
+        # update is made on top of them, so it requires them
+        self._requires = status_archive.update_archives
+        for file in status_archive.update_archives:
+            try:
+                manifest = read_update_manifest(UPDATE_CACHE_DIR + file)
+                inst_data = manifest["instructions"]
+            except UpdateArchiveError:
+                # made before manifests, find the instructions file (members
+                # must be read in order for stream only codecs)
+                inst_data = []
+                with open_archive(UPDATE_CACHE_DIR + file) as tar:
+                    for member in tar:
+                        if member.name == INST_FILE:
+                            inst_data = json.loads(
+                                    tar.extractfile(member).read())
+                            break
+
+            for i in inst_data:
+                if i["type"] == "DPKG_INSTALL":
+                    for pkg in i["items"]:
+                        pkg_obj = self._cache[pkg.split('_')[0]]
+                        pkg_obj.mark_install()
+                    self._not_installed_yet_list.extend(i["items"])
+                elif i["type"] == "DPKG_REMOVE" or i["type"] == "DPKG_PURGE":
+                    self._not_removed_yet_list.extend(i["items"])
 
     @property
     def not_installed_yet(self) -> list:
@@ -244,7 +276,10 @@ class UpdateMaker():
 
         print("Making tar")
 
-        update_file = create_update_archive(self._board, self._inst_list, "./")
+        update_file = create_update_archive(self._board, self._inst_list, "./",
+                                            codec=self._codec,
+                                            jobs=self._jobs,
+                                            requires=self._requires)
 
         print("{} was made".format(update_file))
 